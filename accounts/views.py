@@ -106,16 +106,18 @@ def profile(request):
 @require_POST
 def update_location(request):
     """Update user's current location (AJAX endpoint)"""
+    from emergencies.locations import parse_fix, record_user_fix
+    
     try:
         data = json.loads(request.body)
-        latitude = data.get('latitude')
-        longitude = data.get('longitude')
+        try:
+            fix = parse_fix(data)
+        except (KeyError, TypeError, ValueError):
+            fix = None
         
-        if latitude and longitude:
-            request.user.latitude = latitude
-            request.user.longitude = longitude
-            request.user.location_updated_at = timezone.now()
-            request.user.save()
+        if fix:
+            # Buffered; only the location columns are written, in batches
+            record_user_fix(request.user.id, fix)
             
             return JsonResponse({
                 'success': True,
@@ -84,9 +84,38 @@ class EmergencyAdmin(admin.ModelAdmin):
     
     def mark_resolved(self, request, queryset):
         """Mark emergencies as resolved"""
+        from django.db import transaction
         from django.utils import timezone
-        queryset.update(status='resolved', resolved_at=timezone.now())
-        self.message_user(request, f"Marked {queryset.count()} emergencies as resolved.")
+        from responders import stats as responder_stats
+        from . import rollups, snapshots
+        
+        with transaction.atomic():
+            # Lock the rows first, so a concurrent save can't move them
+            # between reading their old keys and the update
+            changing = list(
+                queryset.exclude(status='resolved').select_for_update()
+                .values_list('pk', 'triggered_at', 'primary_responder_id', *Emergency.ROLLUP_FIELDS)
+            )
+            if not changing:
+                self.message_user(request, "No emergencies to resolve.")
+                return
+            
+            pks = [row[0] for row in changing]
+            count = Emergency.objects.filter(pk__in=pks).update(status='resolved', resolved_at=timezone.now())
+            # Bulk update skips save(), so stamp the live map change by hand
+            if any(fields[2] in snapshots.ACTIVE_MAP_STATUSES for _, _, _, *fields in changing):
+                snapshots.invalidate(pks)
+            
+            for _, triggered_at, responder_id, *fields in changing:
+                # Bulk update skips signals, so move the analytics count by hand;
+                # only the status changes, accepted / arrived stay as they were
+                old_key = Emergency.make_rollup_key(*fields)
+                rollups.record_change(triggered_at, old_key, old_key[:2] + ('resolved',) + old_key[3:])
+                # Credit the completed response to the primary responder
+                if responder_id:
+                    responder_stats.record_resolution(responder_id)
+        
+        self.message_user(request, f"Marked {count} emergencies as resolved.")
     mark_resolved.short_description = "Mark as resolved"
 
 
@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class EmergenciesConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "emergencies"
+    
+    def ready(self):
+        # Import signals to register them
+        import emergencies.signals
+        # Register outbox consumers
+        import emergencies.consumers
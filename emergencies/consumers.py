@@ -0,0 +1,21 @@
+"""
+Outbox consumers for emergency lifecycle events (see emergencies.outbox)
+"""
+
+import time
+
+from django.utils import timezone
+
+from . import escalation
+from .outbox import consumer
+
+
+@consumer('sos_triggered')
+def dispatch_responders(event):
+    """Fan out to the nearest available volunteers and start the escalation ladder"""
+    emergency = event.emergency
+    if emergency is None or emergency.status != 'active':
+        return
+    # Count the time the event waited in the outbox in the dispatch latency
+    waited = (timezone.now() - event.created_at).total_seconds()
+    escalation.begin_escalation(emergency, started=time.perf_counter() - max(waited, 0.0))
@@ -0,0 +1,186 @@
+"""
+Dispatch engine
+Picks the nearest suitable volunteers for an emergency, records them as
+notified responses and hands them to the notification pipeline. With a
+road graph configured, a wider straight-line shortlist is re-ranked by
+road travel time, so a volunteer across a river doesn't beat one around
+the corner.
+"""
+
+import logging
+import math
+import time
+
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+
+from . import routing
+from .eta import straight_line_route
+from .geo import nearest_responders
+from .models import EmergencyResponse, EmergencyTimeline, ResponderLocation
+from .notifications import notify_responders
+
+logger = logging.getLogger(__name__)
+
+ROLE_LEVEL_RANK = {'general': 0, 'first_aid': 1, 'medical': 2}
+# Straight-line candidates fetched per slot when re-ranking by road
+ROAD_RANKING_OVERFETCH = 2
+
+
+def required_role_level(severity):
+    """Minimum volunteer role level for a severity (DISPATCH_MIN_ROLE_LEVEL)"""
+    table = getattr(settings, 'DISPATCH_MIN_ROLE_LEVEL', {})
+    return table.get(severity, 'general')
+
+
+def candidate_locations(emergency, min_role_level='general'):
+    """Available volunteers not yet involved in this emergency"""
+    min_rank = ROLE_LEVEL_RANK.get(min_role_level, 0)
+    role_levels = [level for level, rank in ROLE_LEVEL_RANK.items() if rank >= min_rank]
+
+    return ResponderLocation.objects.filter(
+        responder__role='volunteer',
+        responder__volunteer_profile__is_available=True,
+        responder__volunteer_profile__role_level__in=role_levels,
+    ).exclude(
+        responder_id=emergency.victim_id
+    ).exclude(
+        responder__emergency_responses__emergency=emergency
+    ).annotate(
+        max_radius_km=F('responder__volunteer_profile__availability_radius_km'),
+    ).only('responder_id', 'latitude', 'longitude')
+
+
+def find_candidates(emergency, k=None, radius_km=None, min_role_level=None):
+    """
+    Nearest eligible volunteers as (distance_km, ResponderLocation) pairs.
+    Without min_role_level the severity's DISPATCH_MIN_ROLE_LEVEL applies,
+    falling back to any volunteer if nobody that trained is in reach. An
+    explicit min_role_level (an escalation stage asking for medical-level
+    help) never falls back.
+    """
+    fallback = min_role_level is None
+    if fallback:
+        min_role_level = required_role_level(emergency.severity)
+
+    def within_own_radius(location, distance):
+        return location.max_radius_km is None or distance <= location.max_radius_km
+
+    hits = nearest_responders(
+        emergency.latitude, emergency.longitude,
+        k=k, radius_km=radius_km,
+        queryset=candidate_locations(emergency, min_role_level),
+        accept=within_own_radius,
+    )
+
+    if not hits and min_role_level != 'general':
+        if fallback:
+            # Never leave an emergency with nobody just because no one is trained enough
+            return find_candidates(emergency, k, radius_km, 'general')
+        logger.info("No %s-level volunteers in reach of %s", min_role_level, emergency.emergency_id)
+    return hits
+
+
+def rank_by_road(emergency, hits, k, deadline=None):
+    """
+    Re-rank (distance_km, location) hits by travel time to the emergency
+    and keep the k fastest, as (distance_km, location, minutes). Distances
+    and times are by road where the responder could be routed before the
+    time.perf_counter() deadline; the rest keep straight-line estimates
+    and rank after them.
+    """
+    max_seconds = getattr(settings, 'ROUTING_MAX_MINUTES', 30) * 60
+    road = routing.travel_to(
+        emergency.latitude, emergency.longitude,
+        {location.responder_id: (location.latitude, location.longitude) for _, location in hits},
+        max_seconds, deadline,
+    ) or {}
+
+    ranked = []
+    for distance, location in hits:
+        if location.responder_id in road:
+            seconds, distance = road[location.responder_id]
+            routed = True
+        else:
+            _, seconds = straight_line_route(
+                location.latitude, location.longitude, emergency.latitude, emergency.longitude,
+            )
+            routed = False
+        ranked.append((not routed, seconds, distance, location))
+    ranked.sort(key=lambda row: row[:2])
+    return [(distance, location, math.ceil(seconds / 60)) for _, seconds, distance, location in ranked[:k]]
+
+
+def dispatch_emergency(emergency, k=None, radius_km=None, min_role_level=None, started=None, announce=True):
+    """
+    Notify the nearest available volunteers about an emergency.
+
+    Creates all EmergencyResponse rows with a single bulk_create and passes
+    the ones actually inserted to the notification pipeline. `started` is a
+    time.perf_counter() value taken when the SOS arrived. Road ranking has
+    to finish within DISPATCH_LATENCY_BUDGET_MS of it, or the responders
+    not routed by then keep their straight-line order. Escalation stages
+    pass announce=False: the area-wide alert went out with the first
+    dispatch.
+    """
+    if started is None:
+        started = time.perf_counter()
+    budget_ms = getattr(settings, 'DISPATCH_LATENCY_BUDGET_MS', 500)
+    deadline = started + budget_ms / 1000
+
+    if k is None:
+        k = getattr(settings, 'MAX_RESPONDERS_TO_NOTIFY', 10)
+    # Never wait for the graph here: until it's loaded, rank by straight line
+    if routing.loaded_graph() is not None:
+        hits = find_candidates(emergency, k * ROAD_RANKING_OVERFETCH, radius_km, min_role_level)
+        if time.perf_counter() < deadline:
+            ranked = rank_by_road(emergency, hits, k, deadline)
+        else:
+            ranked = [(distance, location, None) for distance, location in hits[:k]]
+    else:
+        ranked = [
+            (distance, location, None)
+            for distance, location in find_candidates(emergency, k, radius_km, min_role_level)
+        ]
+
+    responses = [
+        EmergencyResponse(
+            emergency=emergency,
+            responder_id=location.responder_id,
+            status='notified',
+            distance_km=round(distance, 2),
+            estimated_arrival_minutes=minutes,
+        )
+        for distance, location, minutes in ranked
+    ]
+    if responses:
+        inserted_at = timezone.now()
+        EmergencyResponse.objects.bulk_create(responses, ignore_conflicts=True)
+        # Rows that already existed were skipped as conflicts and belong to
+        # another dispatch: notify and count only what was inserted here
+        responses = list(EmergencyResponse.objects.filter(
+            emergency=emergency,
+            responder_id__in=[response.responder_id for response in responses],
+            notified_at__gte=inserted_at,
+        ))
+
+    if responses:
+        EmergencyTimeline.objects.create(
+            emergency=emergency,
+            event_type='responder_notified',
+            description=f'{len(responses)} nearby responders notified',
+        )
+
+    notify_responders(emergency, responses, announce=announce)
+
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    if elapsed_ms > budget_ms:
+        logger.warning(
+            "Dispatch for %s took %.1f ms (budget %d ms)",
+            emergency.emergency_id, elapsed_ms, budget_ms,
+        )
+    else:
+        logger.info("Dispatch for %s took %.1f ms", emergency.emergency_id, elapsed_ms)
+
+    return responses
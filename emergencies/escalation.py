@@ -0,0 +1,334 @@
+"""
+Escalation ladder and scheduler
+ESCALATION_POLICY maps each severity to a ladder of stages. The first
+stage is the dispatch made when the SOS is triggered; each later stage
+runs `after` seconds past the trigger unless a responder has accepted:
+it dispatches again with its own k / radius_km / min_role_level (only
+volunteers not yet notified are picked), or, with 'bystander', switches
+the emergency to bystander mode. Severities without a ladder get one
+built from MAX_RESPONDERS_TO_NOTIFY, EMERGENCY_RADIUS_KM and
+EMERGENCY_TIMEOUT_MINUTES.
+
+Stage deadlines sit in a hashed timer wheel driven by one lightweight
+thread per process and fire to within ESCALATION_TICK_SECONDS. Accepting
+the emergency cancels them. Deadlines live in memory, so each serving
+process rebuilds them from the database when it starts (recover, called
+from golden_minutes.wsgi; the test runner and other management commands
+never do). Every stage is claimed with a conditional UPDATE of
+Emergency.escalation_stage, so a deadline that several processes hold,
+or one that outlived an acceptance handled elsewhere, runs at most once
+and never after a responder took the emergency.
+
+ESCALATION_IN_PROCESS = False leaves the web processes alone; run
+`manage.py run_escalation_worker` instead, which also rescans for new
+emergencies every ESCALATION_RESCAN_SECONDS.
+"""
+
+import logging
+import math
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+
+class TimerWheel:
+    """
+    Hashed timer wheel: a deadline hashes to slot (tick % slots) and keeps
+    its absolute tick, so timers further out than one turn simply wait for
+    a later pass. Schedule and cancel are O(1); advancing one tick only
+    looks at one slot. Not thread-safe on its own.
+    """
+
+    def __init__(self, tick_seconds=1.0, slots=512, start=0.0):
+        self.tick_seconds = tick_seconds
+        self.slots = [{} for _ in range(slots)]
+        self._slot_of = {}
+        self._tick = int(start // tick_seconds)
+
+    def __len__(self):
+        return len(self._slot_of)
+
+    def __contains__(self, key):
+        return key in self._slot_of
+
+    def schedule(self, key, deadline, payload):
+        """(Re)schedule key to fire at deadline (epoch seconds) with payload"""
+        self.cancel(key)
+        # Never into a tick that has already been processed
+        tick = max(math.ceil(deadline / self.tick_seconds), self._tick + 1)
+        slot = tick % len(self.slots)
+        self.slots[slot][key] = (tick, payload)
+        self._slot_of[key] = slot
+
+    def cancel(self, key):
+        """Drop a pending timer; True if there was one"""
+        slot = self._slot_of.pop(key, None)
+        if slot is None:
+            return False
+        del self.slots[slot][key]
+        return True
+
+    def advance(self, now):
+        """Remove and return (key, payload) of every timer due by now, earliest first"""
+        target = int(now // self.tick_seconds)
+        due = []
+        # After a long stall one full turn already visits every slot
+        for offset in range(1, min(target - self._tick, len(self.slots)) + 1):
+            bucket = self.slots[(self._tick + offset) % len(self.slots)]
+            for key, (tick, payload) in list(bucket.items()):
+                if tick <= target:
+                    del bucket[key]
+                    del self._slot_of[key]
+                    due.append((tick, key, payload))
+        self._tick = max(self._tick, target)
+        due.sort(key=lambda entry: entry[0])
+        return [(key, payload) for _, key, payload in due]
+
+
+def timeout_minutes():
+    return getattr(settings, 'EMERGENCY_TIMEOUT_MINUTES', 5)
+
+
+def escalation_policy(severity):
+    """Ladder of stage dicts for a severity, first stage (the SOS dispatch) first"""
+    ladder = getattr(settings, 'ESCALATION_POLICY', {}).get(severity)
+    if not ladder:
+        ladder = [
+            {'after': 0},
+            {'after': timeout_minutes() * 60, 'bystander': True},
+        ]
+    return ladder
+
+
+def describe_stage(stage):
+    parts = []
+    if stage.get('radius_km') is not None:
+        parts.append(f"radius {stage['radius_km']:g} km")
+    if stage.get('k') is not None:
+        parts.append(f"up to {stage['k']} responders")
+    if stage.get('min_role_level'):
+        parts.append(f"{stage['min_role_level']} level")
+    return ', '.join(parts) or 'default dispatch'
+
+
+def activate_bystander(emergency_id, after_seconds=None):
+    """
+    Switch an emergency that still has no responder to bystander mode.
+    Returns True if this call switched it.
+    """
+    from .models import Emergency, EmergencyTimeline
+
+    minutes = timeout_minutes() if after_seconds is None else after_seconds / 60
+    with transaction.atomic():
+        switched = Emergency.objects.filter(
+            pk=emergency_id,
+            status='active',
+            primary_responder__isnull=True,
+            bystander_mode_active=False,
+        ).update(bystander_mode_active=True, bystander_mode_activated_at=timezone.now())
+        if switched:
+            EmergencyTimeline.objects.create(
+                emergency_id=emergency_id,
+                event_type='bystander_mode_activated',
+                description=f'Bystander mode activated after {minutes:g} minutes with no responder',
+            )
+    return bool(switched)
+
+
+def run_stage(emergency_id, severity, index):
+    """
+    Run ladder stage `index` of an emergency if nobody has accepted it and
+    the stage hasn't run yet. Returns True if this call ran it.
+    """
+    from .dispatch import dispatch_emergency
+    from .models import Emergency, EmergencyTimeline
+
+    ladder = escalation_policy(severity)
+    if index >= len(ladder):
+        return False
+    stage = ladder[index]
+    # Claim and run the stage in one transaction: if the dispatch fails the
+    # claim rolls back with it and the scheduler retries the stage.
+    # Notifications go out on commit.
+    with transaction.atomic():
+        claimed = Emergency.objects.filter(
+            pk=emergency_id,
+            status='active',
+            primary_responder__isnull=True,
+            bystander_mode_active=False,
+            escalation_stage__lt=index,
+        ).update(escalation_stage=index)
+        if not claimed:
+            return False
+        if stage.get('bystander'):
+            return activate_bystander(emergency_id, stage.get('after'))
+
+        emergency = Emergency.objects.get(pk=emergency_id)
+        EmergencyTimeline.objects.create(
+            emergency=emergency,
+            event_type='escalated',
+            description=f'No responder after {stage["after"]:g}s, escalation stage {index}: {describe_stage(stage)}',
+        )
+        # Already-notified volunteers are excluded, so this only adds new ones
+        dispatch_emergency(
+            emergency,
+            k=stage.get('k'),
+            radius_km=stage.get('radius_km'),
+            min_role_level=stage.get('min_role_level'),
+            announce=False,
+        )
+    return True
+
+
+def pending_escalations():
+    """(emergency pk, severity, triggered_at, last stage run) of every emergency still waiting for a responder"""
+    from .models import Emergency
+
+    return list(Emergency.objects.filter(
+        status='active', primary_responder__isnull=True, bystander_mode_active=False,
+    ).values_list('pk', 'severity', 'triggered_at', 'escalation_stage'))
+
+
+def stage_key(emergency_id, index):
+    return ('escalation', emergency_id, index)
+
+
+class EscalationScheduler:
+    """Timer wheel plus the thread that drives it"""
+
+    def __init__(self, tick_seconds, slots=512, threaded=True):
+        self.wheel = TimerWheel(tick_seconds, slots, time.time())
+        self.threaded = threaded
+        self._lock = threading.Lock()
+        self._recover_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._recovered = False
+
+    def schedule(self, key, deadline, action, *args):
+        """Run action(*args) at deadline (aware datetime); replaces any timer with the same key"""
+        with self._lock:
+            self.wheel.schedule(key, deadline.timestamp(), (action, args))
+        self._ensure_thread()
+
+    def cancel(self, key):
+        with self._lock:
+            return self.wheel.cancel(key)
+
+    def schedule_ladder(self, emergency_id, severity, triggered_at, done_stage=0):
+        """Schedule every stage after done_stage of an emergency's ladder"""
+        ladder = escalation_policy(severity)
+        for index in range(done_stage + 1, len(ladder)):
+            deadline = triggered_at + timedelta(seconds=ladder[index]['after'])
+            self.schedule(stage_key(emergency_id, index), deadline, run_stage, emergency_id, severity, index)
+
+    def cancel_ladder(self, emergency_id, severity):
+        for index in range(1, len(escalation_policy(severity))):
+            self.cancel(stage_key(emergency_id, index))
+
+    def recover(self):
+        """Schedule every stage the database says is still pending"""
+        for emergency_id, severity, triggered_at, done_stage in pending_escalations():
+            self.schedule_ladder(emergency_id, severity, triggered_at, done_stage)
+
+    def start(self):
+        """Recover once per process and make sure the wheel is turning"""
+        if not self._recovered:
+            with self._recover_lock:
+                if not self._recovered:
+                    self.recover()
+                    self._recovered = True
+        self._ensure_thread()
+
+    def run_due(self, now=None):
+        """Fire everything due by now; returns how many timers fired"""
+        now = time.time() if now is None else now
+        with self._lock:
+            due = self.wheel.advance(now)
+        for key, (action, args) in due:
+            try:
+                action(*args)
+            except Exception:
+                retry_seconds = getattr(settings, 'ESCALATION_RETRY_SECONDS', 5)
+                logger.exception("Escalation %s failed, retrying in %ss", key, retry_seconds)
+                with self._lock:
+                    self.wheel.schedule(key, now + retry_seconds, (action, args))
+        return len(due)
+
+    def _ensure_thread(self):
+        if not self.threaded or (self._thread is not None and self._thread.is_alive()):
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='escalation', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        tick = self.wheel.tick_seconds
+        while True:
+            # Wake on tick boundaries so a deadline fires at most one tick late
+            self._wakeup.wait(tick - time.time() % tick + 0.01)
+            if self.run_due():
+                close_old_connections()
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler():
+    """Process-wide escalation scheduler"""
+    global _scheduler
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                _scheduler = EscalationScheduler(getattr(settings, 'ESCALATION_TICK_SECONDS', 1))
+    return _scheduler
+
+
+def in_process():
+    return getattr(settings, 'ESCALATION_IN_PROCESS', True)
+
+
+def start():
+    """Recover pending deadlines in this serving process and turn the wheel"""
+    try:
+        get_scheduler().start()
+    except Exception:
+        # Worker startup must not fail; run_escalation_worker --once catches up
+        logger.exception("Escalation recovery failed")
+
+
+def begin_escalation(emergency, started=None):
+    """
+    Run the first stage of a new emergency's ladder (the SOS dispatch) and
+    register the deadlines of the rest. Returns the dispatched responses.
+    """
+    from .dispatch import dispatch_emergency
+
+    first = escalation_policy(emergency.severity)[0]
+    responses = dispatch_emergency(
+        emergency,
+        k=first.get('k'),
+        radius_km=first.get('radius_km'),
+        min_role_level=first.get('min_role_level'),
+        started=started,
+    )
+    if in_process():
+        # Once the dispatch commits, like its notifications
+        transaction.on_commit(
+            lambda: get_scheduler().schedule_ladder(emergency.pk, emergency.severity, emergency.triggered_at)
+        )
+    return responses
+
+
+def cancel_escalation(emergency):
+    """A responder accepted: drop the emergency's pending deadlines"""
+    if in_process():
+        get_scheduler().cancel_ladder(emergency.pk, emergency.severity)
@@ -0,0 +1,116 @@
+"""
+Responder ETA estimates
+ETA = route distance from the responder's latest fix to the emergency,
+divided by their recent speed from the route track. Until there is
+enough movement to measure, the road graph's free-flow travel time is
+used, or a default city speed without one. Distances are by road when a
+road graph is configured (see routing.py), otherwise straight line times
+a detour factor. Estimates are cached
+per (responder, emergency) and only recomputed when a newer fix arrives;
+each recompute also stores EmergencyResponse.estimated_arrival_minutes.
+"""
+
+import math
+
+from django.conf import settings
+from django.core.cache import cache
+
+from . import routing
+from .geo import haversine_km
+from .locations import latest_fix
+from .tracks import path_length_km, recent_points
+
+ETA_CACHE_SECONDS = 10 * 60
+# Speeds below this are a responder standing still or at a light, not their travel speed
+MIN_MEASURED_SPEED_KMH = 5
+MAX_SPEED_KMH = 120
+
+
+def eta_cache_key(responder_id, emergency_id):
+    return f'emergencies:eta:{responder_id}:{emergency_id}'
+
+
+def straight_line_route(latitude, longitude, to_latitude, to_longitude):
+    """(distance_km, seconds) guess: straight line scaled by a detour factor at the default speed"""
+    factor = getattr(settings, 'ETA_ROUTE_FACTOR', 1.3)
+    distance = haversine_km(latitude, longitude, to_latitude, to_longitude) * factor
+    return distance, distance / getattr(settings, 'ETA_DEFAULT_SPEED_KMH', 30) * 3600
+
+
+def route_to(latitude, longitude, emergency):
+    """
+    (distance_km, seconds, routed) from a point to an emergency, by road
+    when possible. Never waits for the graph: until this process has
+    loaded it, the estimate is straight line.
+    """
+    road = None
+    if routing.loaded_graph() is not None:
+        road = routing.travel(latitude, longitude, emergency.latitude, emergency.longitude)
+    if road is not None:
+        seconds, distance = road
+        return distance, seconds, True
+    return (*straight_line_route(latitude, longitude, emergency.latitude, emergency.longitude), False)
+
+
+def recent_speed_kmh(response_id, fix_timestamp):
+    """Average speed over the recent part of the track, or None if it can't be measured"""
+    window = getattr(settings, 'ETA_SPEED_WINDOW_SECONDS', 120)
+    points = recent_points(response_id, fix_timestamp - window)
+    if len(points) < 2:
+        return None
+    hours = (points[-1][0] - points[0][0]) / 3600
+    if hours * 3600 < 10:
+        return None
+    speed = path_length_km(points) / hours
+    if speed < MIN_MEASURED_SPEED_KMH:
+        return None
+    return min(speed, MAX_SPEED_KMH)
+
+
+def estimate(responder_id, emergency):
+    """
+    {'minutes', 'distance_km', 'speed_kmh', 'measured_speed', 'routed', 'fix_at'} for a
+    responder heading to an emergency, or None without a known location
+    """
+    from .models import EmergencyResponse
+
+    fix = latest_fix(responder_id)
+    if fix is None:
+        return None
+
+    key = eta_cache_key(responder_id, emergency.pk)
+    fix_at = fix.recorded_at.isoformat() if fix.recorded_at else None
+    cached = cache.get(key)
+    if cached is not None and cached['fix_at'] == fix_at:
+        return cached
+
+    response_id = EmergencyResponse.objects.filter(
+        emergency=emergency, responder_id=responder_id
+    ).values_list('id', flat=True).first()
+
+    speed = None
+    if response_id and fix.recorded_at:
+        speed = recent_speed_kmh(response_id, fix.recorded_at.timestamp())
+    measured = speed is not None
+
+    distance, seconds, routed = route_to(fix.latitude, fix.longitude, emergency)
+    if measured:
+        minutes = math.ceil(distance / speed * 60)
+    else:
+        minutes = math.ceil(seconds / 60)
+        speed = distance / (seconds / 3600) if seconds else getattr(settings, 'ETA_DEFAULT_SPEED_KMH', 30)
+    result = {
+        'minutes': minutes,
+        'distance_km': round(distance, 2),
+        'speed_kmh': round(speed, 1),
+        'measured_speed': measured,
+        'routed': routed,
+        'fix_at': fix_at,
+    }
+    cache.set(key, result, ETA_CACHE_SECONDS)
+
+    if response_id:
+        EmergencyResponse.objects.filter(pk=response_id).exclude(
+            estimated_arrival_minutes=result['minutes']
+        ).update(estimated_arrival_minutes=result['minutes'])
+    return result
@@ -0,0 +1,202 @@
+"""
+Spatial helpers for Golden Minutes
+Fixed lat/lon grid used to index responder locations and answer
+"who are the N closest volunteers" without scanning every row
+"""
+
+import math
+
+from django.conf import settings
+
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEGREE = 2 * math.pi * EARTH_RADIUS_KM / 360
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """Great-circle distance between two points in kilometres"""
+    lat1, lon1, lat2, lon2 = map(math.radians, (float(lat1), float(lon1), float(lat2), float(lon2)))
+    dlat = lat2 - lat1
+    dlon = lon2 - lon1
+    a = math.sin(dlat / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def cell_size_deg():
+    """Edge length of one grid cell in degrees"""
+    return getattr(settings, 'RESPONDER_GRID_CELL_DEG', 0.01)
+
+
+def _grid_dims(size):
+    return int(math.ceil(180 / size)), int(math.ceil(360 / size))
+
+
+def cell_coords(lat, lon, size=None):
+    """(row, col) of the grid cell containing a point"""
+    size = size or cell_size_deg()
+    rows, cols = _grid_dims(size)
+    row = min(max(int((float(lat) + 90) // size), 0), rows - 1)
+    col = int((float(lon) + 180) // size) % cols
+    return row, col
+
+
+def cell_key(row, col, size=None):
+    """Pack a (row, col) pair into the integer stored in grid_cell columns"""
+    size = size or cell_size_deg()
+    rows, cols = _grid_dims(size)
+    return row * cols + (col % cols)
+
+
+def cell_for(lat, lon, size=None):
+    """Integer grid cell key for a point"""
+    size = size or cell_size_deg()
+    row, col = cell_coords(lat, lon, size)
+    return cell_key(row, col, size)
+
+
+def ring_cells(row, col, ring, size=None):
+    """Cell keys at exactly `ring` cells (Chebyshev distance) from (row, col)"""
+    size = size or cell_size_deg()
+    rows, cols = _grid_dims(size)
+    if ring == 0:
+        return {cell_key(row, col, size)}
+
+    cells = set()
+    for r in range(row - ring, row + ring + 1):
+        if r < 0 or r >= rows:
+            continue
+        if r in (row - ring, row + ring):
+            for c in range(col - ring, col + ring + 1):
+                cells.add(cell_key(r, c, size))
+        else:
+            cells.add(cell_key(r, col - ring, size))
+            cells.add(cell_key(r, col + ring, size))
+    return cells
+
+
+def cells_within(lat, lon, radius_km, size=None):
+    """Keys of every grid cell that a circle of radius_km around a point touches"""
+    size = size or cell_size_deg()
+    rows, _ = _grid_dims(size)
+    lat, lon = float(lat), float(lon)
+    min_lat, max_lat, min_lon, max_lon = bounding_box(lat, lon, radius_km)
+    min_row, min_col = cell_coords(min_lat, min_lon, size)
+    max_row, _ = cell_coords(max_lat, max_lon, size)
+    # Columns are counted unwrapped so boxes crossing the antimeridian work
+    max_col = min_col + int((max_lon - min_lon) // size) + 1
+
+    cells = set()
+    for row in range(min_row, min(max_row, rows - 1) + 1):
+        cell_south = row * size - 90
+        nearest_lat = min(max(lat, cell_south), cell_south + size)
+        for col in range(min_col, max_col + 1):
+            cell_west = col * size - 180
+            # Nearest point of the cell, comparing longitudes on the point's side of the antimeridian
+            offset = (lon - cell_west + 180) % 360 - 180
+            nearest_lon = lon - offset + min(max(offset, 0), size)
+            if haversine_km(lat, lon, nearest_lat, nearest_lon) <= radius_km:
+                cells.add(cell_key(row, col, size))
+    return cells
+
+
+def zoom_cell_deg(zoom, cells_per_tile=8):
+    """
+    Grid cell size (degrees) for a web-map zoom level, roughly
+    cells_per_tile bins across one 256px tile
+    """
+    zoom = min(max(int(zoom), 0), 20)
+    return 360 / (2 ** zoom * cells_per_tile)
+
+
+def cell_annotations(cell_deg):
+    """
+    Queryset annotations giving each row's grid (cell_row, cell_col) at
+    cell_deg resolution, so binning happens in the database
+    """
+    from decimal import Decimal
+    from django.db.models import F, IntegerField
+    from django.db.models.functions import Cast, Floor
+
+    size = Decimal(repr(cell_deg))
+    return {
+        'cell_row': Cast(Floor(F('latitude') / size), IntegerField()),
+        'cell_col': Cast(Floor(F('longitude') / size), IntegerField()),
+    }
+
+
+def parse_bbox(value):
+    """'min_lon,min_lat,max_lon,max_lat' -> tuple of floats, or None if invalid"""
+    try:
+        min_lon, min_lat, max_lon, max_lat = (float(part) for part in value.split(','))
+    except (AttributeError, ValueError):
+        return None
+    if min_lat > max_lat or min_lon > max_lon:
+        return None
+    return min_lon, min_lat, max_lon, max_lat
+
+
+def bounding_box(lat, lon, radius_km):
+    """
+    (min_lat, max_lat, min_lon, max_lon) enclosing a circle, for cheap
+    indexed prefiltering before an exact haversine check
+    """
+    lat, lon = float(lat), float(lon)
+    dlat = radius_km / KM_PER_DEGREE
+    cos_lat = math.cos(math.radians(min(abs(lat) + dlat, 89.9)))
+    dlon = min(radius_km / (KM_PER_DEGREE * cos_lat), 180)
+    return lat - dlat, lat + dlat, lon - dlon, lon + dlon
+
+
+def _min_cell_km(lat, radius_km, size):
+    """Smallest cell edge (km) anywhere inside the search radius"""
+    max_lat = min(abs(float(lat)) + radius_km / KM_PER_DEGREE + size, 89.9)
+    return size * KM_PER_DEGREE * math.cos(math.radians(max_lat))
+
+
+def nearest_responders(lat, lon, k=None, radius_km=None, queryset=None, accept=None):
+    """
+    Find the k closest responder locations within radius_km.
+
+    Searches grid cells in expanding rings around the point and refines
+    each candidate with an exact haversine distance, stopping as soon as
+    no unsearched cell can hold anything closer than the current k-th hit.
+
+    `queryset` narrows the candidates (e.g. available volunteers only) and
+    `accept(location, distance_km)` can reject rows after refinement.
+    Returns a list of (distance_km, ResponderLocation) sorted by distance.
+    """
+    from .models import ResponderLocation
+
+    if k is None:
+        k = getattr(settings, 'MAX_RESPONDERS_TO_NOTIFY', 10)
+    if radius_km is None:
+        radius_km = getattr(settings, 'EMERGENCY_RADIUS_KM', 5)
+    if queryset is None:
+        queryset = ResponderLocation.objects.all()
+
+    size = cell_size_deg()
+    row, col = cell_coords(lat, lon, size)
+    min_cell_km = _min_cell_km(lat, radius_km, size)
+    max_ring = int(math.ceil(radius_km / min_cell_km)) + 1
+
+    found = []
+    for ring in range(max_ring + 1):
+        cells = ring_cells(row, col, ring, size)
+        for location in queryset.filter(grid_cell__in=cells):
+            distance = haversine_km(lat, lon, location.latitude, location.longitude)
+            if distance > radius_km:
+                continue
+            if accept is not None and not accept(location, distance):
+                continue
+            found.append((distance, location))
+
+        # Everything outside rings 0..ring is at least this far away
+        searched_km = ring * min_cell_km
+        if searched_km >= radius_km:
+            break
+        if k and len(found) >= k:
+            found.sort(key=lambda item: item[0])
+            if found[k - 1][0] <= searched_km:
+                break
+
+    found.sort(key=lambda item: item[0])
+    return found[:k] if k else found
@@ -0,0 +1,219 @@
+"""
+Write-behind buffer for responder GPS updates
+A ping only replaces the latest fix held in memory and in the cache. A
+background thread writes the coalesced fixes to ResponderLocation / User
+in one batch every LOCATION_FLUSH_SECONDS, so a responder pinging every
+few seconds costs one row write per flush interval instead of one per
+ping.
+
+Other workers see a fix before it is flushed only through a shared cache
+(REDIS_URL, see settings.CACHES). With the default per-process memory
+cache they read ResponderLocation, up to LOCATION_FLUSH_SECONDS old.
+Buffered fixes are flushed on a clean exit; a killed process loses at
+most one interval of them, which the responder's next ping replaces.
+
+LOCATION_FLUSH_SECONDS = 0 writes through on every ping (tests, debugging).
+"""
+
+import atexit
+import logging
+import threading
+from collections import namedtuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections
+from django.utils import timezone
+
+from .geo import cell_for
+
+logger = logging.getLogger(__name__)
+
+Fix = namedtuple('Fix', ['latitude', 'longitude', 'accuracy', 'recorded_at'])
+
+FIX_CACHE_SECONDS = 15 * 60
+RESPONDER_LOCATION_FIELDS = ['latitude', 'longitude', 'accuracy', 'grid_cell', 'updated_at']
+USER_LOCATION_FIELDS = ['latitude', 'longitude', 'location_updated_at']
+
+
+def fix_cache_key(responder_id):
+    return f'emergencies:responder_fix:{responder_id}'
+
+
+def parse_fix(data):
+    """Fix from a JSON ping body; raises ValueError if the coordinates are missing or invalid"""
+    latitude = float(data['latitude'])
+    longitude = float(data['longitude'])
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        raise ValueError('Coordinates out of range')
+    accuracy = data.get('accuracy')
+    return Fix(latitude, longitude, float(accuracy) if accuracy is not None else None, timezone.now())
+
+
+def write_responder_fixes(fixes):
+    """Upsert {responder_id: Fix} into ResponderLocation in batched statements"""
+    from .models import ResponderLocation
+
+    now = timezone.now()
+    rows = [
+        ResponderLocation(
+            responder_id=responder_id,
+            latitude=round(fix.latitude, 6),
+            longitude=round(fix.longitude, 6),
+            accuracy=fix.accuracy,
+            # Bulk writes skip save(), so keep the spatial index in sync here
+            grid_cell=cell_for(fix.latitude, fix.longitude),
+            updated_at=now,
+        )
+        for responder_id, fix in fixes.items()
+    ]
+    ResponderLocation.objects.bulk_create(
+        rows,
+        update_conflicts=True,
+        unique_fields=['responder'],
+        update_fields=RESPONDER_LOCATION_FIELDS,
+        batch_size=500,
+    )
+
+
+def write_user_fixes(fixes):
+    """Store {user_id: Fix} as each user's last known location"""
+    from django.contrib.auth import get_user_model
+
+    User = get_user_model()
+    users = [
+        User(
+            pk=user_id,
+            latitude=round(fix.latitude, 6),
+            longitude=round(fix.longitude, 6),
+            location_updated_at=fix.recorded_at,
+        )
+        for user_id, fix in fixes.items()
+    ]
+    User.objects.bulk_update(users, USER_LOCATION_FIELDS, batch_size=500)
+
+    from responders.rankings import follow_users as follow_leaderboard_areas
+    from .subscriptions import follow_users
+
+    # Push notification areas and leaderboard areas follow their owner
+    follow_users(fixes)
+    follow_leaderboard_areas(fixes)
+
+
+class LocationBuffer:
+    """Latest unflushed fix per responder / user"""
+
+    def __init__(self, flush_seconds):
+        self.flush_seconds = flush_seconds
+        self._lock = threading.Lock()
+        self._responders = {}
+        self._users = {}
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def record_responder(self, responder_id, fix):
+        cache.set(fix_cache_key(responder_id), fix, FIX_CACHE_SECONDS)
+        with self._lock:
+            self._responders[responder_id] = fix
+        self._recorded()
+
+    def record_user(self, user_id, fix):
+        with self._lock:
+            self._users[user_id] = fix
+        self._recorded()
+
+    def pending_fix(self, responder_id):
+        with self._lock:
+            return self._responders.get(responder_id)
+
+    def flush(self):
+        """Write everything buffered so far; returns the number of rows written"""
+        with self._lock:
+            responders, self._responders = self._responders, {}
+            users, self._users = self._users, {}
+        try:
+            if responders:
+                write_responder_fixes(responders)
+            if users:
+                write_user_fixes(users)
+        except Exception:
+            # Put the batch back unless a newer fix arrived meanwhile
+            with self._lock:
+                for responder_id, fix in responders.items():
+                    self._responders.setdefault(responder_id, fix)
+                for user_id, fix in users.items():
+                    self._users.setdefault(user_id, fix)
+            raise
+        return len(responders) + len(users)
+
+    def _recorded(self):
+        if not self.flush_seconds:
+            self.flush()
+            return
+        if self._thread is None or not self._thread.is_alive():
+            with self._lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(target=self._run, name='location-flush', daemon=True)
+                    self._thread.start()
+                    atexit.register(self.flush)
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_seconds)
+            self._wakeup.clear()
+            try:
+                close_old_connections()
+                written = self.flush()
+                if written:
+                    logger.debug("Flushed %d buffered locations", written)
+            except Exception:
+                logger.exception("Location flush failed, retrying next interval")
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_buffer():
+    """Process-wide location buffer"""
+    global _buffer
+    if _buffer is None:
+        with _buffer_lock:
+            if _buffer is None:
+                _buffer = LocationBuffer(getattr(settings, 'LOCATION_FLUSH_SECONDS', 5))
+    return _buffer
+
+
+def record_responder_fix(responder_id, fix):
+    from .tracks import get_store
+
+    get_buffer().record_responder(responder_id, fix)
+    try:
+        get_store().record(responder_id, fix)
+    except Exception:
+        # The route history must never cost the live location
+        logger.exception("Failed to record track point for responder %s", responder_id)
+
+
+def record_user_fix(user_id, fix):
+    get_buffer().record_user(user_id, fix)
+
+
+def latest_fix(responder_id):
+    """
+    Most recent known Fix for a responder: this process's buffer, then the
+    cache, then ResponderLocation. None if never located.
+    """
+    fix = get_buffer().pending_fix(responder_id) or cache.get(fix_cache_key(responder_id))
+    if fix is not None:
+        return fix
+
+    from .models import ResponderLocation
+
+    row = ResponderLocation.objects.filter(responder_id=responder_id).values_list(
+        'latitude', 'longitude', 'accuracy', 'updated_at',
+    ).first()
+    if row is None:
+        return None
+    latitude, longitude, accuracy, updated_at = row
+    return Fix(float(latitude), float(longitude), accuracy, updated_at)
@@ -1,12 +1,15 @@
 """
 Management command to auto-activate bystander mode for unresponded emergencies
 Run: python manage.py activate_bystander_mode
+Deadlines normally fire on time from the escalation scheduler (emergencies.escalation);
+this is a manual catch-up pass.
 """
 
 from django.core.management.base import BaseCommand
 from django.utils import timezone
 from datetime import timedelta
-from emergencies.models import Emergency, EmergencyTimeline
+from emergencies.escalation import activate_bystander
+from emergencies.models import Emergency
 
 class Command(BaseCommand):
     help = 'Activate bystander mode for emergencies without responders after timeout'
@@ -29,15 +32,9 @@ class Command(BaseCommand):
         activated_count = 0
         
         for emergency in emergencies:
-            # Activate bystander mode
-            emergency.activate_bystander_mode()
-            
-            # Create timeline event
-            EmergencyTimeline.objects.create(
-                emergency=emergency,
-                event_type='bystander_mode_activated',
-                description=f'Bystander mode activated after {timeout_minutes} minutes with no responder'
-            )
+            # Activate bystander mode (and record it) unless a responder got there first
+            if not activate_bystander(emergency.pk):
+                continue
             
             activated_count += 1
             self.stdout.write(
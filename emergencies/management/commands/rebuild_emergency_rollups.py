@@ -0,0 +1,15 @@
+"""
+Management command to rebuild the analytics rollups from scratch
+Run: python manage.py rebuild_emergency_rollups
+"""
+
+from django.core.management.base import BaseCommand
+from emergencies import rollups
+
+
+class Command(BaseCommand):
+    help = 'Recompute EmergencyRollup rows from the Emergency table (backfill or drift repair)'
+
+    def handle(self, *args, **options):
+        rows = rollups.rebuild()
+        self.stdout.write(self.style.SUCCESS(f'✓ Rebuilt {rows} rollup rows'))
@@ -0,0 +1,50 @@
+"""
+Management command to run the escalation scheduler as its own process
+Run: python manage.py run_escalation_worker
+Use with ESCALATION_IN_PROCESS = False (or alongside it, duplicates are harmless)
+"""
+
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from emergencies import routing
+from emergencies.escalation import EscalationScheduler
+
+
+class Command(BaseCommand):
+    help = 'Fire bystander-mode escalations on time from a dedicated worker process'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once', action='store_true',
+            help='Fire everything already overdue and exit (cron fallback)',
+        )
+
+    def handle(self, *args, **options):
+        scheduler = EscalationScheduler(getattr(settings, 'ESCALATION_TICK_SECONDS', 1), threaded=False)
+        rescan_seconds = getattr(settings, 'ESCALATION_RESCAN_SECONDS', 15)
+        # Escalation stages rank by road: load the graph before the first one
+        routing.warm_up()
+
+        if options['once']:
+            scheduler.recover()
+            # Recovered timers are due on the next tick at the earliest
+            fired = scheduler.run_due(time.time() + scheduler.wheel.tick_seconds)
+            self.stdout.write(self.style.SUCCESS(f'✓ Fired {fired} overdue escalations'))
+            return
+
+        self.stdout.write(self.style.SUCCESS('✓ Escalation worker running'))
+        next_scan = 0
+        while True:
+            if time.monotonic() >= next_scan:
+                # Pick up emergencies triggered in the web processes since the last scan
+                close_old_connections()
+                scheduler.recover()
+                next_scan = time.monotonic() + rescan_seconds
+            fired = scheduler.run_due()
+            if fired:
+                self.stdout.write(f'🚨 Fired {fired} escalations ({len(scheduler.wheel)} pending)')
+            tick = scheduler.wheel.tick_seconds
+            time.sleep(tick - time.time() % tick + 0.01)
@@ -0,0 +1,45 @@
+"""
+Management command to deliver outbox events from a dedicated process
+Run: python manage.py run_outbox_dispatcher
+Use with OUTBOX_IN_PROCESS = False (or alongside it, events are claimed once)
+"""
+
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from emergencies import routing
+from emergencies.models import OutboxEvent
+from emergencies.outbox import Dispatcher
+
+
+class Command(BaseCommand):
+    help = 'Deliver emergency lifecycle events from the outbox to their consumers'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once', action='store_true',
+            help='Deliver everything due and exit (cron fallback)',
+        )
+
+    def handle(self, *args, **options):
+        dispatcher = Dispatcher(getattr(settings, 'OUTBOX_POLL_SECONDS', 5), threaded=False)
+        # SOS dispatches rank by road: load the graph before the first one
+        routing.warm_up()
+
+        if options['once']:
+            delivered = dispatcher.run_once()
+            pending = OutboxEvent.objects.filter(dispatched_at__isnull=True).count()
+            self.stdout.write(self.style.SUCCESS(f'✓ Delivered {delivered} events ({pending} pending)'))
+            return
+
+        self.stdout.write(self.style.SUCCESS('✓ Outbox dispatcher running'))
+        # Poll a little faster than the web processes: nothing wakes this one on commit
+        poll_seconds = min(dispatcher.poll_seconds, 1)
+        while True:
+            delivered = dispatcher.run_once()
+            if delivered:
+                self.stdout.write(f'📤 Delivered {delivered} events')
+            close_old_connections()
+            time.sleep(poll_seconds)
@@ -0,0 +1,37 @@
+# Generated by Django 5.1.4 on 2026-10-18 15:14
+
+import math
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_grid_cells(apps, schema_editor):
+    # emergencies.geo.cell_for as of this migration, kept here so later
+    # changes to the app code can't change what it writes
+    size = getattr(settings, "RESPONDER_GRID_CELL_DEG", 0.01)
+    rows, cols = int(math.ceil(180 / size)), int(math.ceil(360 / size))
+
+    ResponderLocation = apps.get_model("emergencies", "ResponderLocation")
+    locations = list(ResponderLocation.objects.all())
+    for location in locations:
+        row = min(max(int((float(location.latitude) + 90) // size), 0), rows - 1)
+        col = int((float(location.longitude) + 180) // size) % cols
+        location.grid_cell = row * cols + col
+    ResponderLocation.objects.bulk_update(locations, ["grid_cell"], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("emergencies", "0003_alter_bystanderguidance_options_and_more"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="responderlocation",
+            name="grid_cell",
+            field=models.BigIntegerField(blank=True, db_index=True, null=True),
+        ),
+        migrations.RunPython(backfill_grid_cells, migrations.RunPython.noop),
+    ]
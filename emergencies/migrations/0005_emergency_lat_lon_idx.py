@@ -0,0 +1,21 @@
+# Generated by Django 5.1.4 on 2026-10-18 15:17
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("emergencies", "0004_responderlocation_grid_cell"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="emergency",
+            index=models.Index(
+                fields=["latitude", "longitude"], name="emergency_lat_lon_idx"
+            ),
+        ),
+    ]
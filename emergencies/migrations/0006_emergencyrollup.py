@@ -0,0 +1,113 @@
+# Generated by Django 5.1.4 on 2026-10-18 15:23
+
+from collections import Counter
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def backfill_rollups(apps, schema_editor):
+    Emergency = apps.get_model("emergencies", "Emergency")
+    EmergencyRollup = apps.get_model("emergencies", "EmergencyRollup")
+
+    counts = Counter()
+    rows = Emergency.objects.values_list("triggered_at", "emergency_type", "severity", "status")
+    for triggered_at, emergency_type, severity, status in rows.iterator(chunk_size=5000):
+        local = timezone.localtime(triggered_at)
+        counts[(local.date(), local.hour, emergency_type, severity, status)] += 1
+
+    EmergencyRollup.objects.bulk_create(
+        [
+            EmergencyRollup(
+                bucket_date=key[0],
+                bucket_hour=key[1],
+                emergency_type=key[2],
+                severity=key[3],
+                status=key[4],
+                count=count,
+            )
+            for key, count in counts.items()
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("emergencies", "0005_emergency_lat_lon_idx"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="EmergencyRollup",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("bucket_date", models.DateField()),
+                ("bucket_hour", models.PositiveSmallIntegerField()),
+                (
+                    "emergency_type",
+                    models.CharField(
+                        choices=[
+                            ("accident", "Accident"),
+                            ("medical", "Medical"),
+                            ("fire", "Fire"),
+                            ("personal_safety", "Personal Safety"),
+                            ("disaster", "Disaster"),
+                        ],
+                        max_length=20,
+                    ),
+                ),
+                (
+                    "severity",
+                    models.CharField(
+                        choices=[
+                            ("critical", "Critical"),
+                            ("high", "High"),
+                            ("moderate", "Moderate"),
+                            ("low", "Low"),
+                        ],
+                        max_length=20,
+                    ),
+                ),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("active", "Active"),
+                            ("responder_assigned", "Responder Assigned"),
+                            ("responder_en_route", "Responder En Route"),
+                            ("responder_arrived", "Responder Arrived"),
+                            ("resolved", "Resolved"),
+                            ("cancelled", "Cancelled"),
+                        ],
+                        max_length=30,
+                    ),
+                ),
+                ("count", models.IntegerField(default=0)),
+            ],
+            options={
+                "indexes": [
+                    models.Index(fields=["bucket_date"], name="rollup_bucket_date_idx")
+                ],
+                "unique_together": {
+                    (
+                        "bucket_date",
+                        "bucket_hour",
+                        "emergency_type",
+                        "severity",
+                        "status",
+                    )
+                },
+            },
+        ),
+        migrations.RunPython(backfill_rollups, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 5.1.4 on 2026-10-18 15:26
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("emergencies", "0006_emergencyrollup"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="emergency",
+            index=models.Index(
+                fields=["status", "-triggered_at"], name="emergency_status_trig_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="emergency",
+            index=models.Index(
+                fields=["-triggered_at"], name="emergency_triggered_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="emergency",
+            index=models.Index(
+                fields=["primary_responder", "status"],
+                name="emergency_responder_status_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="emergency",
+            index=models.Index(
+                fields=["status", "bystander_mode_active", "triggered_at"],
+                name="emergency_bystander_scan_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="emergency",
+            index=models.Index(
+                condition=models.Q(
+                    ("primary_responder__isnull", True), ("status", "active")
+                ),
+                fields=["bystander_mode_active", "triggered_at"],
+                name="emergency_active_unassign_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="emergencyresponse",
+            index=models.Index(
+                fields=["responder", "status"], name="response_responder_status_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 5.1.4 on 2026-10-18 15:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("emergencies", "0008_changecounter"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="emergency",
+            name="change_seq",
+            field=models.BigIntegerField(
+                blank=True, db_index=True, editable=False, null=True
+            ),
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 5.1.4 on 2026-10-18 15:35
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("emergencies", "0009_emergency_change_seq"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ResponseTrack",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("points", models.BinaryField(default=b"")),
+                ("point_count", models.PositiveIntegerField(default=0)),
+                (
+                    "raw_point_count",
+                    models.PositiveIntegerField(
+                        default=0, help_text="GPS fixes received before simplification"
+                    ),
+                ),
+                ("distance_km", models.FloatField(default=0.0)),
+                ("started_at", models.DateTimeField(blank=True, null=True)),
+                ("ended_at", models.DateTimeField(blank=True, null=True)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+                (
+                    "response",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="track",
+                        to="emergencies.emergencyresponse",
+                    ),
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,138 @@
+# Generated by Django 5.1.4 on 2026-10-18 15:43
+
+import math
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+# emergencies.geo / emergencies.subscriptions as of this migration, kept
+# here so later changes to the app code can't change what it writes
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEGREE = 2 * math.pi * EARTH_RADIUS_KM / 360
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = (
+        math.sin((lat2 - lat1) / 2) ** 2
+        + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def cells_within(lat, lon, radius_km, size):
+    rows, cols = int(math.ceil(180 / size)), int(math.ceil(360 / size))
+
+    def cell_coords(lat, lon):
+        row = min(max(int((lat + 90) // size), 0), rows - 1)
+        return row, int((lon + 180) // size) % cols
+
+    dlat = radius_km / KM_PER_DEGREE
+    cos_lat = math.cos(math.radians(min(abs(lat) + dlat, 89.9)))
+    dlon = min(radius_km / (KM_PER_DEGREE * cos_lat), 180)
+    min_lat, max_lat, min_lon, max_lon = lat - dlat, lat + dlat, lon - dlon, lon + dlon
+    min_row, min_col = cell_coords(min_lat, min_lon)
+    max_row, _ = cell_coords(max_lat, max_lon)
+    # Columns are counted unwrapped so boxes crossing the antimeridian work
+    max_col = min_col + int((max_lon - min_lon) // size) + 1
+
+    cells = set()
+    for row in range(min_row, min(max_row, rows - 1) + 1):
+        cell_south = row * size - 90
+        nearest_lat = min(max(lat, cell_south), cell_south + size)
+        for col in range(min_col, max_col + 1):
+            cell_west = col * size - 180
+            offset = (lon - cell_west + 180) % 360 - 180
+            nearest_lon = lon - offset + min(max(offset, 0), size)
+            if haversine_km(lat, lon, nearest_lat, nearest_lon) <= radius_km:
+                cells.add(row * cols + col % cols)
+    return cells
+
+
+def coverage_cells(latitude, longitude, radius_km, size):
+    row_lat = (math.floor((float(latitude) + 90) / size) + 0.5) * size - 90
+    col_lon = (math.floor((float(longitude) + 180) / size) + 0.5) * size - 180
+    half_diagonal_km = size * KM_PER_DEGREE * math.sqrt(2) / 2
+    return cells_within(row_lat, col_lon, radius_km + half_diagonal_km, size)
+
+
+def backfill_subscription_areas(apps, schema_editor):
+    size = getattr(settings, "PUSH_GRID_CELL_DEG", 0.05)
+    PushSubscription = apps.get_model("emergencies", "PushSubscription")
+    PushSubscriptionCell = apps.get_model("emergencies", "PushSubscriptionCell")
+    subscriptions = list(
+        PushSubscription.objects.filter(user__latitude__isnull=False, user__longitude__isnull=False).select_related("user")
+    )
+    cells = []
+    for subscription in subscriptions:
+        subscription.latitude = subscription.user.latitude
+        subscription.longitude = subscription.user.longitude
+        cells.extend(
+            PushSubscriptionCell(subscription=subscription, cell=cell)
+            for cell in coverage_cells(
+                subscription.latitude, subscription.longitude, subscription.notification_radius_km, size
+            )
+        )
+    PushSubscription.objects.bulk_update(subscriptions, ["latitude", "longitude"], batch_size=1000)
+    PushSubscriptionCell.objects.bulk_create(cells, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("emergencies", "0010_responsetrack"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="pushsubscription",
+            name="latitude",
+            field=models.DecimalField(
+                blank=True,
+                decimal_places=6,
+                help_text="Centre of the notification area",
+                max_digits=9,
+                null=True,
+            ),
+        ),
+        migrations.AddField(
+            model_name="pushsubscription",
+            name="longitude",
+            field=models.DecimalField(
+                blank=True, decimal_places=6, max_digits=9, null=True
+            ),
+        ),
+        migrations.CreateModel(
+            name="PushSubscriptionCell",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("cell", models.BigIntegerField()),
+                (
+                    "subscription",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="cells",
+                        to="emergencies.pushsubscription",
+                    ),
+                ),
+            ],
+            options={
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("cell", "subscription"),
+                        name="push_subscription_cell_unique",
+                    )
+                ],
+            },
+        ),
+        migrations.RunPython(backfill_subscription_areas, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.1.4 on 2026-10-18 15:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("emergencies", "0011_push_subscription_cells"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="emergency",
+            name="escalation_stage",
+            field=models.PositiveSmallIntegerField(default=0, editable=False),
+        ),
+        migrations.AlterField(
+            model_name="emergencytimeline",
+            name="event_type",
+            field=models.CharField(
+                choices=[
+                    ("sos_triggered", "SOS Triggered"),
+                    ("responder_notified", "Responder Notified"),
+                    ("escalated", "Escalated"),
+                    ("responder_accepted", "Responder Accepted"),
+                    ("responder_declined", "Responder Declined"),
+                    ("responder_en_route", "Responder En Route"),
+                    ("responder_arrived", "Responder Arrived"),
+                    ("bystander_mode_activated", "Bystander Mode Activated"),
+                    ("status_updated", "Status Updated"),
+                    ("resolved", "Resolved"),
+                    ("cancelled", "Cancelled"),
+                ],
+                max_length=30,
+            ),
+        ),
+    ]
@@ -0,0 +1,116 @@
+# Generated by Django 5.1.4 on 2026-10-18 16:25
+
+from collections import Counter
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def recount_rollups(apps, schema_editor):
+    Emergency = apps.get_model("emergencies", "Emergency")
+    EmergencyRollup = apps.get_model("emergencies", "EmergencyRollup")
+
+    counts = Counter()
+    rows = Emergency.objects.values_list(
+        "triggered_at",
+        "emergency_type",
+        "severity",
+        "status",
+        "responder_accepted_at",
+        "responder_arrived_at",
+    )
+    for triggered_at, emergency_type, severity, status, accepted_at, arrived_at in rows.iterator(
+        chunk_size=5000
+    ):
+        local = timezone.localtime(triggered_at)
+        counts[
+            (
+                local.date(),
+                local.hour,
+                emergency_type,
+                severity,
+                status,
+                accepted_at is not None,
+                arrived_at is not None,
+            )
+        ] += 1
+
+    EmergencyRollup.objects.all().delete()
+    EmergencyRollup.objects.bulk_create(
+        [
+            EmergencyRollup(
+                bucket_date=key[0],
+                bucket_hour=key[1],
+                emergency_type=key[2],
+                severity=key[3],
+                status=key[4],
+                accepted=key[5],
+                arrived=key[6],
+                count=count,
+            )
+            for key, count in counts.items()
+        ],
+        batch_size=1000,
+    )
+
+
+def merge_rollups(apps, schema_editor):
+    EmergencyRollup = apps.get_model("emergencies", "EmergencyRollup")
+
+    counts = Counter()
+    rows = EmergencyRollup.objects.values_list(
+        "bucket_date", "bucket_hour", "emergency_type", "severity", "status", "count"
+    )
+    for *key, count in rows.iterator(chunk_size=5000):
+        counts[tuple(key)] += count
+
+    EmergencyRollup.objects.all().delete()
+    EmergencyRollup.objects.bulk_create(
+        [
+            EmergencyRollup(
+                bucket_date=key[0],
+                bucket_hour=key[1],
+                emergency_type=key[2],
+                severity=key[3],
+                status=key[4],
+                count=count,
+            )
+            for key, count in counts.items()
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("emergencies", "0013_outboxevent"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="emergencyrollup",
+            name="accepted",
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name="emergencyrollup",
+            name="arrived",
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AlterUniqueTogether(
+            name="emergencyrollup",
+            unique_together={
+                (
+                    "bucket_date",
+                    "bucket_hour",
+                    "emergency_type",
+                    "severity",
+                    "status",
+                    "accepted",
+                    "arrived",
+                )
+            },
+        ),
+        migrations.RunPython(recount_rollups, merge_rollups),
+    ]
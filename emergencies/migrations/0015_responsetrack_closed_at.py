@@ -0,0 +1,18 @@
+# Generated by Django 5.1.4 on 2026-10-18 16:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("emergencies", "0014_emergencyrollup_accepted_arrived"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="responsetrack",
+            name="closed_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
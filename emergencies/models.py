@@ -72,9 +72,28 @@ class Emergency(models.Model):
     bystander_mode_active = models.BooleanField(default=False)
     bystander_mode_activated_at = models.DateTimeField(null=True, blank=True)
     
+    # Last ESCALATION_POLICY stage run for this emergency (0 = initial dispatch)
+    escalation_stage = models.PositiveSmallIntegerField(default=0, editable=False)
+    
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    # Live map change sequence ('active_emergencies' ChangeCounter value of the
+    # last change that affected the map), for delta sync
+    change_seq = models.BigIntegerField(null=True, blank=True, db_index=True, editable=False)
+    
+    def save(self, *args, **kwargs):
+        from django.db import transaction
+        from . import snapshots
+        
+        # The map stamp is queued for after the commit, so it must be queued
+        # inside a transaction: outside one it would run before the write
+        with transaction.atomic():
+            if not self._state.adding and getattr(self, '_rollup_key', None) is None:
+                self._rollup_key = self.stored_rollup_key()
+            snapshots.stamp_change(self)
+            super().save(*args, **kwargs)
+    
     def calculate_severity(self):
         """
         AI-inspired (rule-based) severity classification
@@ -104,6 +123,37 @@ class Emergency(models.Model):
             return True
         return False
     
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the stored analytics key so a status change can be rolled
+        # up. Reading a deferred field here would load it through from_db
+        # again, so rows loaded without every key field look it up on save.
+        if set(cls.ROLLUP_FIELDS).issubset(field_names):
+            instance._rollup_key = instance.rollup_key()
+        else:
+            instance._rollup_key = None
+        return instance
+    
+    # Fields behind rollup_key(), in order
+    ROLLUP_FIELDS = ('emergency_type', 'severity', 'status', 'responder_accepted_at', 'responder_arrived_at')
+    
+    @staticmethod
+    def make_rollup_key(emergency_type, severity, status, responder_accepted_at, responder_arrived_at):
+        return (
+            emergency_type, severity, status,
+            responder_accepted_at is not None, responder_arrived_at is not None,
+        )
+    
+    def rollup_key(self):
+        """(emergency_type, severity, status, accepted, arrived) this emergency is counted under in EmergencyRollup"""
+        return self.make_rollup_key(*(getattr(self, field) for field in self.ROLLUP_FIELDS))
+    
+    def stored_rollup_key(self):
+        """rollup_key() of the row as stored, or None if there is none"""
+        row = Emergency.objects.filter(pk=self.pk).values_list(*self.ROLLUP_FIELDS).first()
+        return self.make_rollup_key(*row) if row else None
+    
     def get_response_time_minutes(self):
         """
         Calculate response time from trigger to responder acceptance
@@ -119,6 +169,88 @@ class Emergency(models.Model):
     class Meta:
         ordering = ['-triggered_at']
         verbose_name_plural = "Emergencies"
+        indexes = [
+            # Bounding-box prefilter for nearby-emergency lookups
+            models.Index(fields=['latitude', 'longitude'], name='emergency_lat_lon_idx'),
+            # Status filters (map, lists, alerts) returned newest first
+            models.Index(fields=['status', '-triggered_at'], name='emergency_status_trig_idx'),
+            # Admin list and analytics time windows
+            models.Index(fields=['-triggered_at'], name='emergency_triggered_idx'),
+            # A responder's assigned / completed emergencies
+            models.Index(fields=['primary_responder', 'status'], name='emergency_responder_status_idx'),
+            # Bystander escalation scan; partial where supported (PostgreSQL, SQLite)
+            models.Index(
+                fields=['status', 'bystander_mode_active', 'triggered_at'],
+                name='emergency_bystander_scan_idx',
+            ),
+            models.Index(
+                fields=['bystander_mode_active', 'triggered_at'],
+                name='emergency_active_unassign_idx',
+                condition=models.Q(status='active', primary_responder__isnull=True),
+            ),
+        ]
+
+
+class EmergencyRollup(models.Model):
+    """
+    Pre-aggregated emergency counts for the analytics dashboard
+    One row per local hour of triggering, type, severity, current status and
+    whether a responder accepted / arrived, kept current incrementally as
+    emergencies change state
+    """
+    bucket_date = models.DateField()
+    bucket_hour = models.PositiveSmallIntegerField()
+    emergency_type = models.CharField(max_length=20, choices=Emergency.EMERGENCY_TYPE_CHOICES)
+    severity = models.CharField(max_length=20, choices=Emergency.SEVERITY_CHOICES)
+    status = models.CharField(max_length=30, choices=Emergency.STATUS_CHOICES)
+    # responder_accepted_at / responder_arrived_at set: an emergency resolved
+    # without a responder (e.g. from the admin) counts as neither
+    accepted = models.BooleanField(default=False)
+    arrived = models.BooleanField(default=False)
+    
+    count = models.IntegerField(default=0)
+    
+    def __str__(self):
+        return f"{self.bucket_date} {self.bucket_hour:02d}:00 {self.emergency_type}/{self.severity}/{self.status}: {self.count}"
+    
+    class Meta:
+        unique_together = ['bucket_date', 'bucket_hour', 'emergency_type', 'severity', 'status', 'accepted', 'arrived']
+        indexes = [
+            models.Index(fields=['bucket_date'], name='rollup_bucket_date_idx'),
+        ]
+
+
+class ChangeCounter(models.Model):
+    """
+    Named counters shared by every worker process
+    Bumped whenever the data behind a cached view changes, so the counter
+    value doubles as that view's version
+    """
+    name = models.CharField(max_length=50, primary_key=True)
+    value = models.BigIntegerField(default=0)
+    
+    @classmethod
+    def current(cls, name):
+        """Current value of a counter (0 if it was never bumped)"""
+        return cls.objects.filter(name=name).values_list('value', flat=True).first() or 0
+    
+    @classmethod
+    def bump(cls, name):
+        """Atomically increment a counter and return the new value"""
+        from django.db import IntegrityError, transaction
+        
+        with transaction.atomic():
+            if not cls.objects.filter(name=name).update(value=models.F('value') + 1):
+                try:
+                    with transaction.atomic():
+                        cls.objects.create(name=name, value=1)
+                except IntegrityError:
+                    # Someone created it first
+                    cls.objects.filter(name=name).update(value=models.F('value') + 1)
+            return cls.objects.get(name=name).value
+    
+    def __str__(self):
+        return f"{self.name} = {self.value}"
 
 
 class EmergencyResponse(models.Model):
@@ -159,6 +291,35 @@ class EmergencyResponse(models.Model):
     class Meta:
         ordering = ['distance_km', '-notified_at']
         unique_together = ['emergency', 'responder']
+        indexes = [
+            # A responder's responses by status (alerts, stats)
+            models.Index(fields=['responder', 'status'], name='response_responder_status_idx'),
+        ]
+
+
+class ResponseTrack(models.Model):
+    """
+    Route a responder travelled for one EmergencyResponse
+    Simplified points packed into a single blob (see emergencies.tracks)
+    """
+    response = models.OneToOneField(EmergencyResponse, on_delete=models.CASCADE, related_name='track')
+    points = models.BinaryField(default=b'')
+    point_count = models.PositiveIntegerField(default=0)
+    raw_point_count = models.PositiveIntegerField(default=0, help_text="GPS fixes received before simplification")
+    distance_km = models.FloatField(default=0.0)
+    started_at = models.DateTimeField(null=True, blank=True)
+    ended_at = models.DateTimeField(null=True, blank=True)
+    # Set when the response ended; later fixes from other workers are dropped
+    closed_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def decoded_points(self):
+        """(timestamp, latitude, longitude, accuracy) tuples, oldest first"""
+        from .tracks import unpack
+        return unpack(self.points)
+    
+    def __str__(self):
+        return f"Track for {self.response_id} ({self.point_count} points)"
 
 
 class EmergencyTimeline(models.Model):
@@ -169,6 +330,7 @@ class EmergencyTimeline(models.Model):
     EVENT_TYPE_CHOICES = [
         ('sos_triggered', 'SOS Triggered'),
         ('responder_notified', 'Responder Notified'),
+        ('escalated', 'Escalated'),
         ('responder_accepted', 'Responder Accepted'),
         ('responder_declined', 'Responder Declined'),
         ('responder_en_route', 'Responder En Route'),
@@ -195,6 +357,41 @@ class EmergencyTimeline(models.Model):
         ordering = ['timestamp']
 
 
+class OutboxEvent(models.Model):
+    """
+    Lifecycle event written in the same transaction as the state change,
+    delivered afterwards to the registered consumers (see emergencies.outbox)
+    """
+    topic = models.CharField(max_length=50)
+    emergency = models.ForeignKey(Emergency, on_delete=models.CASCADE, null=True, blank=True, related_name='outbox_events')
+    actor = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True)
+    payload = models.JSONField(default=dict, blank=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    # Not delivered before this (retry backoff, or claimed by a dispatcher)
+    available_at = models.DateTimeField(default=timezone.now)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    dispatched_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        state = 'delivered' if self.dispatched_at else f'pending ({self.attempts} attempts)'
+        return f"{self.topic} #{self.pk} {state}"
+
+    class Meta:
+        ordering = ['id']
+        indexes = [
+            # Dispatcher scan: only undelivered rows are indexed
+            models.Index(
+                fields=['available_at', 'id'],
+                name='outbox_pending_idx',
+                condition=models.Q(dispatched_at__isnull=True),
+            ),
+            # Retention cleanup
+            models.Index(fields=['dispatched_at'], name='outbox_dispatched_idx'),
+        ]
+
+
 class BystanderGuidance(models.Model):
     """
     Guided instructions for bystanders
@@ -235,11 +432,48 @@ class PushSubscription(models.Model):
     
     # Location preferences for notifications
     notification_radius_km = models.FloatField(default=5.0, help_text="Radius in km for emergency notifications")
+    latitude = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True, help_text="Centre of the notification area")
+    longitude = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
     
     is_active = models.BooleanField(default=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    # Fields behind area_key()
+    AREA_FIELDS = ('latitude', 'longitude', 'notification_radius_km')
+    
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the stored area so save() only rewrites the cells when it
+        # changes; unknown (rewritten on save) when a field was deferred
+        if set(cls.AREA_FIELDS).issubset(field_names):
+            instance._area_key = instance.area_key()
+        else:
+            instance._area_key = None
+        return instance
+    
+    def area_key(self):
+        """(centre cell, radius) the registered cells depend on"""
+        from .geo import cell_for
+        from .subscriptions import push_cell_deg
+        
+        cell = None
+        if self.latitude is not None and self.longitude is not None:
+            cell = cell_for(self.latitude, self.longitude, push_cell_deg())
+        return cell, float(self.notification_radius_km)
+    
+    def save(self, *args, **kwargs):
+        from django.db import transaction
+        from .subscriptions import register_cells
+        
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            area_key = self.area_key()
+            if area_key != getattr(self, '_area_key', None):
+                register_cells(self)
+                self._area_key = area_key
+    
     def __str__(self):
         return f"{self.user.username} - Push Subscription"
     
@@ -247,6 +481,24 @@ class PushSubscription(models.Model):
         ordering = ['-created_at']
 
 
+class PushSubscriptionCell(models.Model):
+    """
+    One grid cell (PUSH_GRID_CELL_DEG) touched by a subscription's
+    notification area, so an emergency finds its subscribers with a single
+    cell lookup (see emergencies.subscriptions)
+    """
+    subscription = models.ForeignKey(PushSubscription, on_delete=models.CASCADE, related_name='cells')
+    cell = models.BigIntegerField()
+    
+    def __str__(self):
+        return f"{self.subscription_id} @ {self.cell}"
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['cell', 'subscription'], name='push_subscription_cell_unique'),
+        ]
+
+
 class ResponderLocation(models.Model):
     """
     Store real-time GPS locations of responders for ETA calculation
@@ -260,8 +512,23 @@ class ResponderLocation(models.Model):
     longitude = models.DecimalField(max_digits=9, decimal_places=6)
     accuracy = models.FloatField(null=True, blank=True, help_text="GPS accuracy in meters")
     
+    # Spatial index cell (see emergencies.geo), kept in sync on every write
+    grid_cell = models.BigIntegerField(null=True, blank=True, db_index=True)
+    
     updated_at = models.DateTimeField(auto_now=True)
     
+    def save(self, *args, **kwargs):
+        from .geo import cell_for
+        
+        if self.latitude is not None and self.longitude is not None:
+            self.grid_cell = cell_for(self.latitude, self.longitude)
+        
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and {'latitude', 'longitude'} & set(update_fields):
+            kwargs['update_fields'] = set(update_fields) | {'grid_cell'}
+        
+        super().save(*args, **kwargs)
+    
     def __str__(self):
         return f"{self.responder.username} - Location ({self.latitude}, {self.longitude})"
     
@@ -0,0 +1,50 @@
+"""
+Notification pipeline for dispatched responders
+Dispatch hands every batch of freshly created EmergencyResponse rows here
+"""
+
+import logging
+
+from django.db import transaction
+
+from .realtime import publish_emergency_alert
+from .webpush import push_emergency
+
+logger = logging.getLogger(__name__)
+
+
+def notify_responders(emergency, responses, announce=True):
+    """
+    Deliver a dispatch decision to the selected responders.
+    `responses` are the EmergencyResponse objects from bulk_create, with
+    responder_id and distance_km populated. With announce, everyone
+    following the area (live connections, push subscribers) is alerted too.
+    Nothing is sent until the surrounding transaction commits, so a
+    dispatch that rolls back (and is retried) alerts nobody.
+    """
+    transaction.on_commit(lambda: send_notifications(emergency, responses, announce))
+
+
+def send_notifications(emergency, responses, announce):
+    # Connected volunteers whose area covers the emergency get it live
+    if announce:
+        publish_emergency_alert(emergency)
+
+    # Phones in a pocket get a web push (dispatched responders and anyone
+    # subscribed to the area); sends happen on the push pool
+    try:
+        push_emergency(
+            emergency,
+            {response.responder_id: response.distance_km for response in responses},
+            nearby=announce,
+        )
+    except Exception:
+        logger.exception("Failed to queue web pushes for %s", emergency.emergency_id)
+
+    if not responses:
+        return
+
+    logger.info(
+        "Notifying %d responders for emergency %s",
+        len(responses), emergency.emergency_id,
+    )
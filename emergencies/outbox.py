@@ -0,0 +1,252 @@
+"""
+Transactional outbox for emergency lifecycle events
+A lifecycle view records what happened with emit(), inside the same
+transaction as the state change and its timeline row, and returns after
+that single commit. Work that follows from the change (dispatching
+volunteers, push, live alerts, responder stats) runs in consumers
+registered per topic with @consumer, called by a dispatcher that drains
+the outbox in batches.
+
+Delivery is at least once. Each event is claimed with a conditional
+UPDATE that commits on its own and hides the event from other
+dispatchers for OUTBOX_CLAIM_SECONDS, so consumers never run under the
+claim's write lock. The consumers then run in one transaction that also
+marks the event delivered, so their database writes land exactly once:
+a consumer that raises rolls them back and the event is retried with
+backoff (up to OUTBOX_MAX_ATTEMPTS), and a dispatcher whose claim ran out
+while another delivered the event rolls its own writes back. Effects
+outside the database (pushes, broker messages) must be sent with
+transaction.on_commit, so they go out once, after the writes they
+announce are visible (and not at all if the process dies in between).
+Events are delivered roughly in the order they were emitted; consumers
+must not depend on it.
+
+With OUTBOX_IN_PROCESS each serving process (see golden_minutes.wsgi)
+runs a dispatcher thread that is woken as soon as an emit() commits, and
+polls every OUTBOX_POLL_SECONDS for leftovers and retries. The test
+runner and other management commands never start one. Otherwise run
+`manage.py run_outbox_dispatcher`.
+"""
+
+import logging
+import threading
+import time
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import F
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+MAX_BACKOFF_SECONDS = 300
+PRUNE_INTERVAL_SECONDS = 60 * 60
+
+_consumers = defaultdict(list)
+
+
+class Superseded(Exception):
+    """Another dispatcher delivered the event first; roll this delivery back"""
+
+
+def consumer(topic):
+    """Register the decorated function(event) to receive every event of topic"""
+    def register(func):
+        if func not in _consumers[topic]:
+            _consumers[topic].append(func)
+        return func
+    return register
+
+
+def consumers_for(topic):
+    return list(_consumers.get(topic, ()))
+
+
+def in_process():
+    return getattr(settings, 'OUTBOX_IN_PROCESS', True)
+
+
+def emit(topic, emergency=None, actor=None, **payload):
+    """
+    Record a lifecycle event. Call inside the transaction that makes the
+    change; the event is only delivered if that transaction commits.
+    """
+    from .models import OutboxEvent
+
+    event = OutboxEvent.objects.create(topic=topic, emergency=emergency, actor=actor, payload=payload)
+    if in_process():
+        transaction.on_commit(wake)
+    return event
+
+
+def max_attempts():
+    return getattr(settings, 'OUTBOX_MAX_ATTEMPTS', 10)
+
+
+def claim_seconds():
+    return getattr(settings, 'OUTBOX_CLAIM_SECONDS', 60)
+
+
+def backoff_seconds(attempts):
+    return min(2 ** attempts, MAX_BACKOFF_SECONDS)
+
+
+def deliver(event):
+    """
+    Claim one event and run its consumers. Returns True if this call
+    delivered it, False if it was already taken or a consumer failed.
+    """
+    from .models import OutboxEvent
+
+    # The claim commits by itself: the consumers' work must not hold its lock
+    now = timezone.now()
+    claimed = OutboxEvent.objects.filter(
+        pk=event.pk, dispatched_at__isnull=True, available_at__lte=now,
+    ).update(
+        available_at=now + timedelta(seconds=claim_seconds()),
+        attempts=F('attempts') + 1,
+    )
+    if not claimed:
+        return False
+    attempts = event.attempts = event.attempts + 1
+
+    try:
+        with transaction.atomic():
+            for func in consumers_for(event.topic):
+                func(event)
+            delivered = OutboxEvent.objects.filter(pk=event.pk, dispatched_at__isnull=True).update(
+                dispatched_at=timezone.now(),
+            )
+            if not delivered:
+                raise Superseded
+    except Superseded:
+        return False
+    except Exception as exc:
+        OutboxEvent.objects.filter(pk=event.pk, dispatched_at__isnull=True).update(
+            available_at=timezone.now() + timedelta(seconds=backoff_seconds(attempts)),
+            last_error=repr(exc)[:1000],
+        )
+        if attempts >= max_attempts():
+            logger.exception("Outbox event %s (%s) failed %d times, giving up", event.pk, event.topic, attempts)
+        else:
+            logger.warning("Outbox event %s (%s) failed, will retry", event.pk, event.topic, exc_info=True)
+        return False
+    return True
+
+
+def due_events(limit):
+    """Oldest undelivered events whose retry time has come"""
+    from .models import OutboxEvent
+
+    return list(
+        OutboxEvent.objects.filter(
+            dispatched_at__isnull=True,
+            available_at__lte=timezone.now(),
+            attempts__lt=max_attempts(),
+        ).select_related('emergency').order_by('available_at', 'id')[:limit]
+    )
+
+
+def dispatch_pending(batch_size=None):
+    """Deliver everything due, one batch query at a time; returns how many were delivered"""
+    batch_size = batch_size or getattr(settings, 'OUTBOX_BATCH_SIZE', 100)
+    delivered = 0
+    while True:
+        events = due_events(batch_size)
+        progressed = False
+        for event in events:
+            if deliver(event):
+                delivered += 1
+                progressed = True
+        # Stop on a short batch, or when every event in it failed or was taken elsewhere
+        if len(events) < batch_size or not progressed:
+            return delivered
+
+
+def prune(days=None):
+    """Delete events delivered more than OUTBOX_RETENTION_DAYS ago"""
+    from .models import OutboxEvent
+
+    days = getattr(settings, 'OUTBOX_RETENTION_DAYS', 7) if days is None else days
+    deleted, _ = OutboxEvent.objects.filter(dispatched_at__lt=timezone.now() - timedelta(days=days)).delete()
+    return deleted
+
+
+class Dispatcher:
+    """Drains the outbox when woken, and every poll interval"""
+
+    def __init__(self, poll_seconds, threaded=True):
+        self.poll_seconds = poll_seconds
+        self.threaded = threaded
+        self._wakeup = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._started = False
+        self._pruned_at = 0.0
+
+    def wake(self):
+        self._wakeup.set()
+        if self._started:
+            self._ensure_thread()
+
+    def start(self):
+        self._started = True
+        self._ensure_thread()
+
+    def run_once(self):
+        """Deliver everything due and prune old rows when it's time"""
+        delivered = dispatch_pending()
+        if time.monotonic() - self._pruned_at >= PRUNE_INTERVAL_SECONDS:
+            self._pruned_at = time.monotonic()
+            prune()
+        return delivered
+
+    def _ensure_thread(self):
+        if not self.threaded or (self._thread is not None and self._thread.is_alive()):
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='outbox', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            # A wake() that lands while draining triggers another pass right away
+            self._wakeup.clear()
+            try:
+                self.run_once()
+            except Exception:
+                logger.exception("Outbox dispatch failed")
+            finally:
+                close_old_connections()
+            self._wakeup.wait(self.poll_seconds)
+
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+
+def get_dispatcher():
+    """Process-wide outbox dispatcher"""
+    global _dispatcher
+    if _dispatcher is None:
+        with _dispatcher_lock:
+            if _dispatcher is None:
+                _dispatcher = Dispatcher(getattr(settings, 'OUTBOX_POLL_SECONDS', 5))
+    return _dispatcher
+
+
+def wake():
+    """on_commit hook: deliver freshly committed events now, if this process dispatches"""
+    if _dispatcher is not None:
+        _dispatcher.wake()
+
+
+def start():
+    """Run this serving process's dispatcher thread, draining any leftovers first"""
+    try:
+        get_dispatcher().start()
+    except Exception:
+        logger.exception("Outbox dispatcher failed to start")
@@ -0,0 +1,175 @@
+"""
+Real-time alert broker
+Fans new-emergency events out to connected volunteers (SSE / long-poll)
+whose coverage area contains the emergency.
+
+REALTIME_BROKER = 'memory' keeps everything inside one process, which is
+enough for a single web worker. With several workers set it to 'redis'
+(REALTIME_REDIS_URL) so an event published by one worker reaches
+subscribers connected to any other.
+"""
+
+import itertools
+import json
+import logging
+import queue
+import threading
+
+from django.conf import settings
+
+from .geo import haversine_km
+
+logger = logging.getLogger(__name__)
+
+
+class Subscription:
+    """One connected client and the area it wants alerts for"""
+
+    def __init__(self, broker, latitude=None, longitude=None, radius_km=None, max_queued=50):
+        self.broker = broker
+        self.latitude = latitude
+        self.longitude = longitude
+        self.radius_km = radius_km
+        self.events = queue.Queue(maxsize=max_queued)
+
+    def covers(self, event):
+        """True if the event falls inside this subscriber's area"""
+        if self.latitude is None or self.longitude is None or self.radius_km is None:
+            return True
+        distance = haversine_km(self.latitude, self.longitude, event['latitude'], event['longitude'])
+        return distance <= self.radius_km
+
+    def offer(self, event):
+        try:
+            self.events.put_nowait(event)
+        except queue.Full:
+            # Slow client: drop rather than block the publisher
+            pass
+
+    def get(self, timeout):
+        """Next matching event, or None after timeout seconds"""
+        try:
+            return self.events.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class InProcessBroker:
+    """Pub/sub between threads of a single process"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ids = itertools.count()
+        self._subscribers = {}
+
+    def subscribe(self, latitude=None, longitude=None, radius_km=None):
+        subscription = Subscription(self, latitude, longitude, radius_km)
+        with self._lock:
+            subscription.id = next(self._ids)
+            self._subscribers[subscription.id] = subscription
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.pop(getattr(subscription, 'id', None), None)
+
+    def publish(self, event):
+        self.deliver(event)
+
+    def deliver(self, event):
+        """Hand an event to every local subscriber whose area covers it"""
+        with self._lock:
+            subscribers = list(self._subscribers.values())
+        for subscription in subscribers:
+            if subscription.covers(event):
+                subscription.offer(event)
+
+
+class RedisBroker(InProcessBroker):
+    """
+    Redis-backed broker: publishes go through a Redis channel and one
+    listener thread per process relays them to local subscribers
+    """
+
+    def __init__(self, url, channel='golden_minutes:alerts'):
+        super().__init__()
+        import redis
+
+        self.channel = channel
+        self._redis = redis.Redis.from_url(url)
+        self._listener = None
+
+    def subscribe(self, *args, **kwargs):
+        self._ensure_listener()
+        return super().subscribe(*args, **kwargs)
+
+    def publish(self, event):
+        self._redis.publish(self.channel, json.dumps(event))
+
+    def _ensure_listener(self):
+        if self._listener is not None and self._listener.is_alive():
+            return
+        with self._lock:
+            if self._listener is not None and self._listener.is_alive():
+                return
+            self._listener = threading.Thread(target=self._listen, name='realtime-redis', daemon=True)
+            self._listener.start()
+
+    def _listen(self):
+        pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(self.channel)
+        for message in pubsub.listen():
+            try:
+                self.deliver(json.loads(message['data']))
+            except (TypeError, ValueError):
+                logger.warning("Dropping malformed realtime message")
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    """Process-wide broker configured by REALTIME_BROKER"""
+    global _broker
+    if _broker is None:
+        with _broker_lock:
+            if _broker is None:
+                if getattr(settings, 'REALTIME_BROKER', 'memory') == 'redis':
+                    _broker = RedisBroker(settings.REALTIME_REDIS_URL)
+                else:
+                    _broker = InProcessBroker()
+    return _broker
+
+
+def emergency_event(emergency):
+    """Broker event describing a new emergency"""
+    return {
+        'id': str(emergency.emergency_id),
+        'latitude': float(emergency.latitude),
+        'longitude': float(emergency.longitude),
+        'location': emergency.location_address or f"{emergency.latitude}, {emergency.longitude}",
+        'type': emergency.get_emergency_type_display(),
+        'severity': emergency.severity,
+        'victim_id': emergency.victim_id,
+        'timestamp': emergency.created_at.isoformat(),
+    }
+
+
+def publish_emergency_alert(emergency):
+    """Announce a new emergency to volunteers whose area covers it"""
+    event = emergency_event(emergency)
+    try:
+        get_broker().publish(event)
+    except Exception:
+        # Real-time delivery is best effort, polling still picks it up
+        logger.exception("Failed to publish alert for %s", emergency.emergency_id)
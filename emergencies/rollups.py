@@ -0,0 +1,72 @@
+"""
+Incremental maintenance of EmergencyRollup
+Every emergency is counted once, under the local hour it was triggered in
+and its current Emergency.rollup_key(): type, severity, status and whether
+a responder accepted and arrived. A state change moves one unit
+between two rows, so the analytics dashboard never has to aggregate the
+Emergency table itself.
+"""
+
+from collections import Counter
+
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Emergency, EmergencyRollup
+
+
+def bucket_for(triggered_at):
+    """(date, hour) of the local-time hour bucket"""
+    local = timezone.localtime(triggered_at)
+    return local.date(), local.hour
+
+
+def adjust(triggered_at, key, delta):
+    """Add delta to the rollup row for (bucket of triggered_at, key)"""
+    bucket_date, bucket_hour = bucket_for(triggered_at)
+    emergency_type, severity, status, accepted, arrived = key
+    lookup = dict(
+        bucket_date=bucket_date, bucket_hour=bucket_hour,
+        emergency_type=emergency_type, severity=severity, status=status,
+        accepted=accepted, arrived=arrived,
+    )
+    if EmergencyRollup.objects.filter(**lookup).update(count=F('count') + delta):
+        return
+    try:
+        with transaction.atomic():
+            EmergencyRollup.objects.create(count=delta, **lookup)
+    except IntegrityError:
+        # Someone created the row first
+        EmergencyRollup.objects.filter(**lookup).update(count=F('count') + delta)
+
+
+def record_change(triggered_at, old_key, new_key):
+    """Move one emergency from old_key to new_key (either may be None)"""
+    if old_key == new_key:
+        return
+    if old_key is not None:
+        adjust(triggered_at, old_key, -1)
+    if new_key is not None:
+        adjust(triggered_at, new_key, 1)
+
+
+def rebuild():
+    """Recompute every rollup row from the Emergency table (repair / backfill)"""
+    counts = Counter()
+    rows = Emergency.objects.values_list('triggered_at', *Emergency.ROLLUP_FIELDS)
+    for triggered_at, *fields in rows.iterator(chunk_size=5000):
+        counts[bucket_for(triggered_at) + Emergency.make_rollup_key(*fields)] += 1
+
+    with transaction.atomic():
+        EmergencyRollup.objects.all().delete()
+        EmergencyRollup.objects.bulk_create([
+            EmergencyRollup(
+                bucket_date=bucket_date, bucket_hour=bucket_hour,
+                emergency_type=emergency_type, severity=severity, status=status,
+                accepted=accepted, arrived=arrived, count=count,
+            )
+            for (bucket_date, bucket_hour, emergency_type, severity, status, accepted, arrived), count
+            in counts.items()
+        ], batch_size=1000)
+    return len(counts)
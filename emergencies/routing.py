@@ -0,0 +1,479 @@
+"""
+Offline road-network routing
+Loads a road graph prepared by `manage.py build_road_graph` (from a local
+OSM extract) into compact CSR arrays: node coordinates, per-node edge
+offsets, and per-edge target / travel seconds / metres. Point-to-point
+queries run A* with ALT landmarks (precomputed travel times to and from a
+few far-apart nodes give a tight lower bound on the remaining time), so a
+citywide query settles a small fraction of the graph. Dispatch ranks many
+candidates at once with a single reverse Dijkstra from the emergency.
+
+Routing is optional: without ROUTING_GRAPH_PATH, or when a point can't be
+snapped to the graph, callers fall back to haversine distances.
+
+Loading a graph is a one-off cost per process, paid at startup: serving
+processes call warm_up() from golden_minutes.wsgi and the standalone
+workers when they start. Dispatch only ever uses loaded_graph(), so an
+SOS never waits for the load.
+"""
+
+import heapq
+import logging
+import math
+import struct
+import sys
+import threading
+import time
+from array import array
+
+from django.conf import settings
+
+from .geo import cell_coords, haversine_km
+
+logger = logging.getLogger(__name__)
+
+GRAPH_MAGIC = b'GMRG'
+GRAPH_VERSION = 1
+GRAPH_HEADER = struct.Struct('<4sHIIH')  # magic, version, nodes, edges, landmarks
+
+# Nodes are bucketed on this grid (degrees) for snapping points to the graph
+SNAP_CELL_DEG = 0.005
+# Speed assumed for the leg between a point and its snapped node
+SNAP_SPEED_KMH = 20
+
+
+def _write(handle, column):
+    if sys.byteorder != 'little':
+        column = array(column.typecode, column)
+        column.byteswap()
+    column.tofile(handle)
+
+
+def _read(handle, typecode, count):
+    column = array(typecode)
+    column.fromfile(handle, count)
+    if sys.byteorder != 'little':
+        column.byteswap()
+    return column
+
+
+def dijkstra(offsets, targets, weights, source):
+    """Travel time from source to every node (inf where unreachable)"""
+    # Plain floats while searching; float32 rounding would break the stale-entry check
+    times = [math.inf] * (len(offsets) - 1)
+    times[source] = 0.0
+    heap = [(0.0, source)]
+    while heap:
+        time_s, node = heapq.heappop(heap)
+        if time_s > times[node]:
+            continue
+        for edge in range(offsets[node], offsets[node + 1]):
+            target = targets[edge]
+            candidate = time_s + weights[edge]
+            if candidate < times[target]:
+                times[target] = candidate
+                heapq.heappush(heap, (candidate, target))
+    return array('f', times)
+
+
+def reverse_csr(offsets, targets, *columns):
+    """CSR of the reversed graph, carrying each per-edge column along"""
+    node_count = len(offsets) - 1
+    reverse_offsets = array('q', [0]) * (node_count + 1)
+    for target in targets:
+        reverse_offsets[target + 1] += 1
+    for node in range(node_count):
+        reverse_offsets[node + 1] += reverse_offsets[node]
+    position = reverse_offsets[:-1]
+    reverse_targets = array(targets.typecode, bytes(targets.itemsize * len(targets)))
+    reverse_columns = [array(column.typecode, bytes(column.itemsize * len(column))) for column in columns]
+    for source in range(node_count):
+        for edge in range(offsets[source], offsets[source + 1]):
+            target = targets[edge]
+            slot = position[target]
+            position[target] += 1
+            reverse_targets[slot] = source
+            for reverse_column, column in zip(reverse_columns, columns):
+                reverse_column[slot] = column[edge]
+    return (reverse_offsets, reverse_targets, *reverse_columns)
+
+
+def choose_landmarks(offsets, targets, seconds, latitudes, longitudes, count):
+    """
+    Farthest-first landmark selection: start from the node farthest from
+    the graph's centre, then repeatedly take the node farthest (in travel
+    time) from every landmark chosen so far
+    """
+    if count <= 0 or not latitudes:
+        return []
+    centre_lat = sum(latitudes) / len(latitudes)
+    centre_lon = sum(longitudes) / len(longitudes)
+    first = max(range(len(latitudes)), key=lambda node: haversine_km(centre_lat, centre_lon, latitudes[node], longitudes[node]))
+    landmarks = [first]
+    nearest = list(dijkstra(offsets, targets, seconds, first))
+    while len(landmarks) < count:
+        candidate = max(
+            (node for node in range(len(nearest)) if not math.isinf(nearest[node])),
+            key=lambda node: nearest[node], default=None,
+        )
+        if candidate is None or nearest[candidate] == 0:
+            break
+        landmarks.append(candidate)
+        times = dijkstra(offsets, targets, seconds, candidate)
+        nearest = [min(a, b) for a, b in zip(nearest, times)]
+    return landmarks
+
+
+class RoadGraph:
+    """Directed road graph in CSR form with ALT landmark tables"""
+
+    def __init__(self, latitudes, longitudes, offsets, targets, seconds, meters,
+                 landmark_from=(), landmark_to=()):
+        self.latitudes = latitudes
+        self.longitudes = longitudes
+        self.offsets = offsets
+        self.targets = targets
+        self.seconds = seconds
+        self.meters = meters
+        # landmark_from[i][v]: time landmark i -> v; landmark_to[i][v]: time v -> landmark i
+        self.landmark_from = list(landmark_from)
+        self.landmark_to = list(landmark_to)
+        self.reverse_offsets, self.reverse_targets, self.reverse_seconds, self.reverse_meters = reverse_csr(
+            offsets, targets, seconds, meters,
+        )
+        self.max_speed_mps = max(
+            (meters[edge] / seconds[edge] for edge in range(len(targets)) if seconds[edge] > 0),
+            default=1.0,
+        )
+        self._buckets = {}
+        for node in range(len(latitudes)):
+            if offsets[node + 1] > offsets[node] or self.reverse_offsets[node + 1] > self.reverse_offsets[node]:
+                key = cell_coords(latitudes[node], longitudes[node], SNAP_CELL_DEG)
+                self._buckets.setdefault(key, []).append(node)
+
+    @property
+    def node_count(self):
+        return len(self.latitudes)
+
+    @classmethod
+    def build(cls, latitudes, longitudes, edges, landmarks=8):
+        """Graph from node coordinates and (source, target, seconds, metres) edges"""
+        node_count = len(latitudes)
+        edges = sorted(edges)
+        offsets = array('q', [0]) * (node_count + 1)
+        targets, seconds, meters = array('q'), array('f'), array('f')
+        for source, target, time_s, length_m in edges:
+            offsets[source + 1] += 1
+            targets.append(target)
+            seconds.append(time_s)
+            meters.append(length_m)
+        for node in range(node_count):
+            offsets[node + 1] += offsets[node]
+
+        latitudes, longitudes = array('d', latitudes), array('d', longitudes)
+        graph = cls(latitudes, longitudes, offsets, targets, seconds, meters)
+        for landmark in choose_landmarks(offsets, targets, seconds, latitudes, longitudes, landmarks):
+            graph.landmark_from.append(dijkstra(offsets, targets, seconds, landmark))
+            graph.landmark_to.append(dijkstra(graph.reverse_offsets, graph.reverse_targets, graph.reverse_seconds, landmark))
+        return graph
+
+    def save(self, path):
+        with open(path, 'wb') as handle:
+            handle.write(GRAPH_HEADER.pack(
+                GRAPH_MAGIC, GRAPH_VERSION, self.node_count, len(self.targets), len(self.landmark_from),
+            ))
+            for column in (self.latitudes, self.longitudes, self.offsets, self.targets, self.seconds, self.meters):
+                _write(handle, column)
+            for column in self.landmark_from + self.landmark_to:
+                _write(handle, column)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as handle:
+            magic, version, node_count, edge_count, landmark_count = GRAPH_HEADER.unpack(
+                handle.read(GRAPH_HEADER.size)
+            )
+            if magic != GRAPH_MAGIC or version != GRAPH_VERSION:
+                raise ValueError(f'{path} is not a road graph (version {GRAPH_VERSION})')
+            latitudes = _read(handle, 'd', node_count)
+            longitudes = _read(handle, 'd', node_count)
+            offsets = _read(handle, 'q', node_count + 1)
+            targets = _read(handle, 'q', edge_count)
+            seconds = _read(handle, 'f', edge_count)
+            meters = _read(handle, 'f', edge_count)
+            landmark_from = [_read(handle, 'f', node_count) for _ in range(landmark_count)]
+            landmark_to = [_read(handle, 'f', node_count) for _ in range(landmark_count)]
+        return cls(latitudes, longitudes, offsets, targets, seconds, meters, landmark_from, landmark_to)
+
+    def nearest_node(self, latitude, longitude, max_km=None):
+        """(node, snap distance km) of the closest routable node, or None"""
+        if max_km is None:
+            max_km = getattr(settings, 'ROUTING_MAX_SNAP_KM', 0.5)
+        row, col = cell_coords(latitude, longitude, SNAP_CELL_DEG)
+        best, best_km = None, max_km
+        ring_count = int(math.ceil(max_km / (SNAP_CELL_DEG * 111 * max(math.cos(math.radians(latitude)), 0.1)))) + 1
+        for ring in range(ring_count + 1):
+            for r in range(row - ring, row + ring + 1):
+                for c in range(col - ring, col + ring + 1):
+                    if max(abs(r - row), abs(c - col)) != ring:
+                        continue
+                    for node in self._buckets.get((r, c), ()):
+                        distance = haversine_km(latitude, longitude, self.latitudes[node], self.longitudes[node])
+                        if distance <= best_km:
+                            best, best_km = node, distance
+            if best is not None and ring >= 1:
+                break
+        return (best, best_km) if best is not None else None
+
+    def _heuristic(self, target):
+        """Lower bound on travel seconds from any node to target"""
+        target_lat, target_lon = self.latitudes[target], self.longitudes[target]
+        speed = self.max_speed_mps
+        tables = [
+            (to_table, to_table[target], from_table, from_table[target])
+            for from_table, to_table in zip(self.landmark_from, self.landmark_to)
+            if not math.isinf(to_table[target]) and not math.isinf(from_table[target])
+        ]
+        latitudes, longitudes = self.latitudes, self.longitudes
+
+        def estimate(node):
+            bound = haversine_km(latitudes[node], longitudes[node], target_lat, target_lon) * 1000 / speed
+            for to_table, to_target, from_table, from_target in tables:
+                # d(v,t) >= d(v,L) - d(t,L) and d(v,t) >= d(L,t) - d(L,v)
+                to_node = to_table[node]
+                if to_node - to_target > bound and not math.isinf(to_node):
+                    bound = to_node - to_target
+                from_node = from_table[node]
+                if from_target - from_node > bound:
+                    bound = from_target - from_node
+            return bound
+
+        return estimate
+
+    def route(self, source, target):
+        """(seconds, metres) of the fastest path between two nodes, or None"""
+        if source == target:
+            return 0.0, 0.0
+        heuristic = self._heuristic(target)
+        offsets, targets, seconds, meters = self.offsets, self.targets, self.seconds, self.meters
+        best = {source: 0.0}
+        lengths = {source: 0.0}
+        settled = set()
+        heap = [(heuristic(source), 0.0, source)]
+        while heap:
+            _, time_s, node = heapq.heappop(heap)
+            if node == target:
+                return time_s, lengths[node]
+            if node in settled:
+                continue
+            settled.add(node)
+            for edge in range(offsets[node], offsets[node + 1]):
+                neighbour = targets[edge]
+                candidate = time_s + seconds[edge]
+                if candidate < best.get(neighbour, math.inf):
+                    best[neighbour] = candidate
+                    lengths[neighbour] = lengths[node] + meters[edge]
+                    heapq.heappush(heap, (candidate + heuristic(neighbour), candidate, neighbour))
+        return None
+
+    def times_to(self, target, sources, max_seconds=math.inf, deadline=None):
+        """
+        {source node: (seconds, metres)} to reach target, for every source
+        reachable within max_seconds. One reverse Dijkstra from the target.
+        With a time.perf_counter() deadline the search stops there; sources
+        not reached by then are left out, and are no faster than any found.
+        """
+        remaining = set(sources)
+        found = {}
+        best = {target: 0.0}
+        lengths = {target: 0.0}
+        heap = [(0.0, target)]
+        offsets, targets = self.reverse_offsets, self.reverse_targets
+        seconds, meters = self.reverse_seconds, self.reverse_meters
+        popped = 0
+        while heap and remaining:
+            popped += 1
+            if deadline is not None and popped % 1024 == 0 and time.perf_counter() > deadline:
+                break
+            time_s, node = heapq.heappop(heap)
+            if time_s > best.get(node, math.inf) or time_s > max_seconds:
+                continue
+            if node in remaining:
+                remaining.discard(node)
+                found[node] = (time_s, lengths[node])
+            for edge in range(offsets[node], offsets[node + 1]):
+                neighbour = targets[edge]
+                candidate = time_s + seconds[edge]
+                if candidate < best.get(neighbour, math.inf):
+                    best[neighbour] = candidate
+                    lengths[neighbour] = lengths[node] + meters[edge]
+                    heapq.heappush(heap, (candidate, neighbour))
+        return found
+
+
+# Free-flow speeds (km/h) for routable OSM highway types; *_link roads share their parent's
+HIGHWAY_SPEEDS_KMH = {
+    'motorway': 90, 'trunk': 70, 'primary': 50, 'secondary': 40, 'tertiary': 35,
+    'unclassified': 30, 'residential': 25, 'living_street': 10, 'service': 15, 'road': 25,
+}
+ONEWAY_BY_DEFAULT = {'motorway'}
+
+
+def _parse_maxspeed(value):
+    """km/h from an OSM maxspeed tag ('50', '50 km/h', '30 mph'), or None"""
+    if not value:
+        return None
+    number = value.split()[0]
+    try:
+        speed = float(number)
+    except ValueError:
+        return None
+    return speed * 1.609 if 'mph' in value else speed
+
+
+def read_osm(path):
+    """
+    (latitudes, longitudes, edges) from an OSM XML extract (.osm, .osm.gz or
+    .osm.bz2). Edges are (source, target, seconds, metres) between
+    consecutive nodes of every routable way, honouring oneway tags.
+    """
+    import bz2
+    import gzip
+    from xml.etree.ElementTree import iterparse
+
+    opener = gzip.open if path.endswith('.gz') else bz2.open if path.endswith('.bz2') else open
+    coordinates = {}
+    ways = []
+    with opener(path, 'rb') as handle:
+        for _, element in iterparse(handle):
+            if element.tag == 'node':
+                coordinates[element.get('id')] = (float(element.get('lat')), float(element.get('lon')))
+            elif element.tag == 'way':
+                tags = {tag.get('k'): tag.get('v') for tag in element.iter('tag')}
+                highway = tags.get('highway', '').removesuffix('_link')
+                if highway in HIGHWAY_SPEEDS_KMH and tags.get('access') not in ('no', 'private'):
+                    speed = _parse_maxspeed(tags.get('maxspeed')) or HIGHWAY_SPEEDS_KMH[highway]
+                    oneway = tags.get('oneway')
+                    if oneway is None and (highway in ONEWAY_BY_DEFAULT or tags.get('junction') == 'roundabout'):
+                        oneway = 'yes'
+                    refs = [nd.get('ref') for nd in element.iter('nd')]
+                    ways.append((refs, speed, oneway))
+            if element.tag in ('node', 'way', 'relation'):
+                element.clear()
+
+    index = {}
+    latitudes, longitudes, edges = [], [], []
+
+    def node_index(ref):
+        if ref not in index:
+            index[ref] = len(latitudes)
+            latitudes.append(coordinates[ref][0])
+            longitudes.append(coordinates[ref][1])
+        return index[ref]
+
+    for refs, speed, oneway in ways:
+        refs = [ref for ref in refs if ref in coordinates]
+        metres_per_second = speed / 3.6
+        for a, b in zip(refs, refs[1:]):
+            source, target = node_index(a), node_index(b)
+            metres = haversine_km(latitudes[source], longitudes[source], latitudes[target], longitudes[target]) * 1000
+            seconds = metres / metres_per_second
+            if oneway != '-1':
+                edges.append((source, target, seconds, metres))
+            if oneway not in ('yes', 'true', '1'):
+                edges.append((target, source, seconds, metres))
+    return latitudes, longitudes, edges
+
+
+_graph = None
+_graph_loaded = False
+_graph_lock = threading.Lock()
+# Separate from _graph_lock, which is held for the whole load
+_loader_lock = threading.Lock()
+_loader = None
+
+
+def get_graph():
+    """The configured RoadGraph, loaded once per process, or None"""
+    global _graph, _graph_loaded
+    if not _graph_loaded:
+        with _graph_lock:
+            if not _graph_loaded:
+                path = getattr(settings, 'ROUTING_GRAPH_PATH', None)
+                if path:
+                    try:
+                        _graph = RoadGraph.load(path)
+                        logger.info("Loaded road graph %s (%d nodes)", path, _graph.node_count)
+                    except (OSError, ValueError, EOFError):
+                        logger.exception("Could not load road graph %s, using straight-line distances", path)
+                _graph_loaded = True
+    return _graph
+
+
+def warm_up():
+    """Load the graph now, at process start, so no request pays for it"""
+    get_graph()
+
+
+def loaded_graph():
+    """
+    The graph if this process has loaded it, else None without waiting.
+    A process that was never warmed up starts loading it in the background.
+    """
+    global _loader
+    if _graph_loaded:
+        return _graph
+    with _loader_lock:
+        if _loader is None and not _graph_loaded:
+            _loader = threading.Thread(target=get_graph, name='routing-load', daemon=True)
+            _loader.start()
+    return None
+
+
+def _snap_leg_seconds(km):
+    return km / SNAP_SPEED_KMH * 3600
+
+
+def travel(from_lat, from_lon, to_lat, to_lon):
+    """(seconds, km) by road between two points, or None to fall back to haversine"""
+    graph = get_graph()
+    if graph is None:
+        return None
+    start = graph.nearest_node(float(from_lat), float(from_lon))
+    end = graph.nearest_node(float(to_lat), float(to_lon))
+    if start is None or end is None:
+        return None
+    result = graph.route(start[0], end[0])
+    if result is None:
+        return None
+    seconds, meters = result
+    snap_km = start[1] + end[1]
+    return seconds + _snap_leg_seconds(snap_km), meters / 1000 + snap_km
+
+
+def travel_to(to_lat, to_lon, origins, max_seconds=math.inf, deadline=None):
+    """
+    {key: (seconds, km)} by road from each origin to one point, where
+    origins is {key: (lat, lon)}. Origins that can't be routed (or weren't
+    reached by `deadline`, see RoadGraph.times_to) are left out; None if
+    routing isn't available at all.
+    """
+    graph = get_graph()
+    if graph is None:
+        return None
+    end = graph.nearest_node(float(to_lat), float(to_lon))
+    if end is None:
+        return None
+    snapped = {}
+    for key, (latitude, longitude) in origins.items():
+        start = graph.nearest_node(float(latitude), float(longitude))
+        if start is not None:
+            snapped[key] = start
+    times = graph.times_to(end[0], {node for node, _ in snapped.values()}, max_seconds, deadline)
+    result = {}
+    for key, (node, snap_km) in snapped.items():
+        if node in times:
+            seconds, meters = times[node]
+            leg_km = snap_km + end[1]
+            result[key] = (seconds + _snap_leg_seconds(leg_km), meters / 1000 + leg_km)
+    return result
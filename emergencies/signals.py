@@ -0,0 +1,29 @@
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+from .models import Emergency
+from . import rollups, snapshots
+
+
+@receiver(post_save, sender=Emergency)
+def update_emergency_rollup(sender, instance, created, **kwargs):
+    """
+    Keep analytics rollups current whenever an emergency changes state
+    """
+    new_key = instance.rollup_key()
+    old_key = None if created else getattr(instance, '_rollup_key', new_key)
+    rollups.record_change(instance.triggered_at, old_key, new_key)
+    instance._rollup_key = new_key
+
+
+@receiver(pre_delete, sender=Emergency)
+def look_up_rollup_key(sender, instance, **kwargs):
+    """Read the stored key of rows loaded with a key field deferred"""
+    if getattr(instance, '_rollup_key', None) is None:
+        instance._rollup_key = instance.stored_rollup_key()
+
+
+@receiver(post_delete, sender=Emergency)
+def remove_emergency_rollup(sender, instance, **kwargs):
+    """Stop counting deleted emergencies and drop them from the live map"""
+    rollups.record_change(instance.triggered_at, instance._rollup_key, None)
+    snapshots.record_delete(instance)
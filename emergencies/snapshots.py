@@ -0,0 +1,254 @@
+"""
+Shared snapshot of the active emergencies shown on the live map
+The JSON body is encoded once per change, not once per viewer per poll.
+Snapshots are keyed by the 'active_emergencies' ChangeCounter, which is
+bumped whenever an emergency enters, changes on or leaves the map, so a
+cached body is never stale and old versions simply expire.
+
+Every such change also stamps the emergency's change_seq with the new
+counter value. The counter value is the client's cursor: rows with
+change_seq above it are exactly what changed since, which lets pollers
+fetch deltas instead of the whole set.
+
+The counter is one row every map change writes, so it is never bumped
+inside the writer's transaction, where its lock would be held until that
+transaction commits. The change is announced after the commit instead,
+in a short transaction that bumps the counter and stamps the rows. A
+process that dies in between leaves the change unannounced until the
+row changes again; full snapshots built after the next bump include it.
+
+Viewports: with a bbox only the emergencies inside it are sent, and
+below CLUSTER_MAX_ZOOM they are grouped into spatial-grid clusters
+(count, centroid, worst severity) instead of individual points. Bounding
+boxes are snapped outward to the grid so nearby viewports share cache
+entries.
+"""
+
+import hashlib
+import json
+import math
+import threading
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Avg, Case, Count, IntegerField, Min, Value, When
+
+from .geo import cell_annotations, zoom_cell_deg
+from .models import ChangeCounter, Emergency
+
+ACTIVE_MAP_STATUSES = ['active', 'responder_assigned', 'responder_en_route']
+SNAPSHOT_COUNTER = 'active_emergencies'
+# Cursor value at the last hard delete; older cursors must resync in full
+RESET_COUNTER = 'active_emergencies_reset'
+SNAPSHOT_CACHE_SECONDS = 300
+
+# Zoom levels below this get clusters instead of individual points
+CLUSTER_MAX_ZOOM = 13
+# Grid that point-mode bounding boxes are snapped to (degrees)
+BBOX_SNAP_DEG = 0.01
+
+EMERGENCY_TYPE_DISPLAY = dict(Emergency.EMERGENCY_TYPE_CHOICES)
+STATUS_DISPLAY = dict(Emergency.STATUS_CHOICES)
+# Most severe first
+SEVERITY_ORDER = [severity for severity, _ in Emergency.SEVERITY_CHOICES]
+MAP_FIELDS = ['emergency_id', 'emergency_type', 'severity', 'status', 'latitude', 'longitude', 'triggered_at']
+
+_build_lock = threading.Lock()
+
+
+def serialize_emergency(emergency):
+    """Map marker data for one emergency"""
+    return {
+        'emergency_id': str(emergency.emergency_id),
+        'emergency_type': emergency.emergency_type,
+        'emergency_type_display': EMERGENCY_TYPE_DISPLAY.get(emergency.emergency_type, emergency.emergency_type),
+        'severity': emergency.severity,
+        'status': emergency.status,
+        'status_display': STATUS_DISPLAY.get(emergency.status, emergency.status),
+        'latitude': float(emergency.latitude),
+        'longitude': float(emergency.longitude),
+        'triggered_at': emergency.triggered_at.isoformat(),
+    }
+
+
+def snap_bbox(bbox, size):
+    """Grow (min_lon, min_lat, max_lon, max_lat) outward to multiples of size"""
+    # Round first so float noise (18.49 / 0.01 = 1848.999...) doesn't grow the box
+    min_lon, min_lat, max_lon, max_lat = (round(value / size, 6) for value in bbox)
+    return (
+        round(math.floor(min_lon) * size, 6),
+        round(math.floor(min_lat) * size, 6),
+        round(math.ceil(max_lon) * size, 6),
+        round(math.ceil(max_lat) * size, 6),
+    )
+
+
+def bbox_key(bbox):
+    return 'all' if bbox is None else ','.join(str(value) for value in bbox)
+
+
+def on_map(bbox=None):
+    """Emergencies currently on the map, optionally inside bbox"""
+    emergencies = Emergency.objects.filter(status__in=ACTIVE_MAP_STATUSES)
+    if bbox is not None:
+        min_lon, min_lat, max_lon, max_lat = bbox
+        emergencies = emergencies.filter(
+            latitude__range=(min_lat, max_lat),
+            longitude__range=(min_lon, max_lon),
+        )
+    return emergencies
+
+
+def encode(data):
+    return json.dumps(data, separators=(',', ':')).encode()
+
+
+def _cached(key, version, build):
+    """(strong ETag, body) for key at version, building it at most once per process"""
+    key = f'emergencies:{key}:{version}'
+    snapshot = cache.get(key)
+    if snapshot is None:
+        # One build per process per version, however many viewers are waiting
+        with _build_lock:
+            snapshot = cache.get(key)
+            if snapshot is None:
+                body = build()
+                etag = '"%d-%s"' % (version, hashlib.sha1(body).hexdigest()[:16])
+                snapshot = (etag, body)
+                cache.set(key, snapshot, SNAPSHOT_CACHE_SECONDS)
+    return snapshot
+
+
+def active_snapshot(bbox=None):
+    """
+    (strong ETag, encoded JSON body) for the current version of the active
+    set, optionally limited to a viewport
+    """
+    version = ChangeCounter.current(SNAPSHOT_COUNTER)
+    if bbox is not None:
+        bbox = snap_bbox(bbox, BBOX_SNAP_DEG)
+
+    def build():
+        emergencies = on_map(bbox).only(*MAP_FIELDS)
+        return encode({
+            'cursor': version,
+            'emergencies': [serialize_emergency(emergency) for emergency in emergencies],
+        })
+
+    return _cached(f'active_snapshot:{bbox_key(bbox)}', version, build)
+
+
+def active_clusters(bbox, zoom):
+    """
+    (strong ETag, encoded JSON body) of grid clusters inside a viewport:
+    {'cursor', 'zoom', 'cell_deg', 'clusters': [{latitude, longitude,
+    count, severity}]} where severity is the worst in the cluster
+    """
+    version = ChangeCounter.current(SNAPSHOT_COUNTER)
+    cell_deg = zoom_cell_deg(zoom)
+    bbox = snap_bbox(bbox, cell_deg)
+
+    def build():
+        severity_rank = Case(
+            *[When(severity=severity, then=Value(rank)) for rank, severity in enumerate(SEVERITY_ORDER)],
+            default=Value(len(SEVERITY_ORDER) - 1),
+            output_field=IntegerField(),
+        )
+        cells = on_map(bbox).annotate(**cell_annotations(cell_deg)).values('cell_row', 'cell_col').annotate(
+            count=Count('id'),
+            centroid_lat=Avg('latitude'),
+            centroid_lon=Avg('longitude'),
+            worst=Min(severity_rank),
+        ).order_by()
+        return encode({
+            'cursor': version,
+            'zoom': zoom,
+            'cell_deg': cell_deg,
+            'clusters': [
+                {
+                    'latitude': round(float(cell['centroid_lat']), 6),
+                    'longitude': round(float(cell['centroid_lon']), 6),
+                    'count': cell['count'],
+                    'severity': SEVERITY_ORDER[cell['worst']],
+                }
+                for cell in cells
+            ],
+        })
+
+    return _cached(f'active_clusters:{zoom}:{bbox_key(bbox)}', version, build)
+
+
+def active_delta(since, bbox=None):
+    """
+    Emergencies that changed on the map after cursor `since` (inside bbox
+    if given): {'cursor', 'changed': [added or updated], 'removed': [ids]}.
+    None if the cursor can't be served incrementally and the client must
+    take a full snapshot instead.
+    """
+    counters = dict(
+        ChangeCounter.objects.filter(name__in=[SNAPSHOT_COUNTER, RESET_COUNTER]).values_list('name', 'value')
+    )
+    version = counters.get(SNAPSHOT_COUNTER, 0)
+    if since > version or since < counters.get(RESET_COUNTER, 0):
+        return None
+    
+    changed = []
+    removed = []
+    if since < version:
+        rows = Emergency.objects.filter(change_seq__gt=since)
+        if bbox is not None:
+            # Same snapped area the client's snapshot covered
+            min_lon, min_lat, max_lon, max_lat = snap_bbox(bbox, BBOX_SNAP_DEG)
+            rows = rows.filter(latitude__range=(min_lat, max_lat), longitude__range=(min_lon, max_lon))
+        rows = rows.only(*MAP_FIELDS)
+        for emergency in rows:
+            if emergency.status in ACTIVE_MAP_STATUSES:
+                changed.append(serialize_emergency(emergency))
+            else:
+                removed.append(str(emergency.emergency_id))
+    return {'cursor': version, 'changed': changed, 'removed': removed}
+
+
+def publish_change(pks=(), reset=False):
+    """
+    Start a new snapshot version and stamp the emergencies in pks with it,
+    in a short transaction of its own. With reset, cursors from before it
+    must resync in full. Returns the new version.
+    """
+    with transaction.atomic():
+        if pks:
+            # Row locks first, so the counter's lock is only held for the bump
+            list(Emergency.objects.select_for_update().filter(pk__in=pks).values_list('pk', flat=True))
+        version = ChangeCounter.bump(SNAPSHOT_COUNTER)
+        if pks:
+            Emergency.objects.filter(pk__in=pks).update(change_seq=version)
+        if reset:
+            ChangeCounter.objects.update_or_create(name=RESET_COUNTER, defaults={'value': version})
+    return version
+
+
+def invalidate(pks=()):
+    """Announce a change to the map once the current transaction commits"""
+    pks = list(pks)
+    transaction.on_commit(lambda: publish_change(pks))
+
+
+def stamp_change(emergency):
+    """
+    Called from Emergency.save(), inside its transaction: if the emergency
+    is (or was) on the map, stamp it once the save commits. Returns True
+    if a stamp was queued.
+    """
+    old_key = getattr(emergency, '_rollup_key', None)
+    old_status = old_key[2] if old_key else None
+    if old_status in ACTIVE_MAP_STATUSES or emergency.status in ACTIVE_MAP_STATUSES:
+        # The pk of a new row is only known once it is inserted
+        transaction.on_commit(lambda: publish_change([emergency.pk]))
+        return True
+    return False
+
+
+def record_delete(emergency):
+    """A deleted row can't be reported as a delta, so cursors before it resync"""
+    if emergency.status in ACTIVE_MAP_STATUSES:
+        transaction.on_commit(lambda: publish_change(reset=True))
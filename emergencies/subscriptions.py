@@ -0,0 +1,101 @@
+"""
+Geographic index of push subscriptions
+Every subscription registers in each PUSH_GRID_CELL_DEG grid cell its
+notification area (notification_radius_km around its centre) can touch.
+Finding who to push for an emergency is then one indexed lookup of the
+emergency's cell plus an exact distance check on those rows, so the cost
+follows local subscriber density rather than the total number of
+subscriptions.
+
+Coverage is registered for the centre's whole cell, so a subscriber moving
+around inside one cell only updates the centre; the cells are rewritten
+when the centre moves to another cell.
+"""
+
+import math
+
+from django.conf import settings
+
+from .geo import KM_PER_DEGREE, cell_for, cells_within, haversine_km
+
+# Largest notification radius accepted; each area registers O(radius^2) cells
+MAX_RADIUS_KM = 100
+
+
+def push_cell_deg():
+    return getattr(settings, 'PUSH_GRID_CELL_DEG', 0.05)
+
+
+def coverage_cells(latitude, longitude, radius_km, size=None):
+    """Cells reachable within radius_km from anywhere in the centre's cell"""
+    size = size or push_cell_deg()
+    row_lat = (math.floor((float(latitude) + 90) / size) + 0.5) * size - 90
+    col_lon = (math.floor((float(longitude) + 180) / size) + 0.5) * size - 180
+    half_diagonal_km = size * KM_PER_DEGREE * math.sqrt(2) / 2
+    return cells_within(row_lat, col_lon, radius_km + half_diagonal_km, size)
+
+
+def register_cells(subscription):
+    """Bring a subscription's PushSubscriptionCell rows in line with its area"""
+    from .models import PushSubscriptionCell
+
+    cells = set()
+    if subscription.latitude is not None and subscription.longitude is not None:
+        cells = coverage_cells(subscription.latitude, subscription.longitude, subscription.notification_radius_km)
+    existing = set(subscription.cells.values_list('cell', flat=True))
+    if existing - cells:
+        subscription.cells.filter(cell__in=existing - cells).delete()
+    PushSubscriptionCell.objects.bulk_create(
+        [PushSubscriptionCell(subscription=subscription, cell=cell) for cell in cells - existing],
+        ignore_conflicts=True,
+    )
+
+
+def follow_users(fixes):
+    """
+    Move the notification area of the users in fixes ({user_id: Fix}) to
+    their new location. Called with each batch of buffered user fixes.
+    """
+    from .models import PushSubscription
+
+    size = push_cell_deg()
+    subscriptions = list(
+        PushSubscription.objects.filter(user_id__in=list(fixes)).only(
+            'id', 'user_id', 'latitude', 'longitude', 'notification_radius_km',
+        )
+    )
+    moved_cell = []
+    for subscription in subscriptions:
+        fix = fixes[subscription.user_id]
+        if subscription.latitude is None or subscription.longitude is None or (
+            cell_for(subscription.latitude, subscription.longitude, size) != cell_for(fix.latitude, fix.longitude, size)
+        ):
+            moved_cell.append(subscription)
+        subscription.latitude = round(fix.latitude, 6)
+        subscription.longitude = round(fix.longitude, 6)
+    if subscriptions:
+        PushSubscription.objects.bulk_update(subscriptions, ['latitude', 'longitude'], batch_size=500)
+    for subscription in moved_cell:
+        register_cells(subscription)
+
+
+def subscribers_near(latitude, longitude):
+    """
+    Active subscriptions whose notification area covers a point, as
+    (subscription_id, subscription_info, user_id, distance_km)
+    """
+    from .models import PushSubscriptionCell
+
+    rows = PushSubscriptionCell.objects.filter(
+        cell=cell_for(latitude, longitude, push_cell_deg()),
+        subscription__is_active=True,
+    ).values_list(
+        'subscription_id', 'subscription__subscription_info', 'subscription__user_id',
+        'subscription__latitude', 'subscription__longitude', 'subscription__notification_radius_km',
+    )
+    result = []
+    for subscription_id, info, user_id, sub_lat, sub_lon, radius_km in rows:
+        distance = haversine_km(latitude, longitude, sub_lat, sub_lon)
+        if distance <= radius_km:
+            result.append((subscription_id, info, user_id, distance))
+    return result
@@ -1,3 +1,941 @@
-from django.test import TestCase
+import io
+import json
+import math
+import os
+import random
+import re
+import tempfile
+import time
+from datetime import timedelta
+from types import SimpleNamespace
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import DatabaseError, connection, transaction
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from responders.models import VolunteerProfile
+
+from . import escalation, eta, outbox, routing, snapshots, subscriptions, tracks, webpush
+from .dispatch import dispatch_emergency, find_candidates
+from .geo import KM_PER_DEGREE, bounding_box, cell_for, cells_within, haversine_km, nearest_responders
+from .locations import Fix, LocationBuffer
+from .models import (
+    ChangeCounter, Emergency, EmergencyResponse, EmergencyTimeline, OutboxEvent, PushSubscription,
+    ResponderLocation, ResponseTrack,
+)
+
+User = get_user_model()
+
+# Plan lines meaning "read every row of the emergencies table"
+FULL_SCAN_PATTERNS = [
+    re.compile(r'\bSCAN emergencies_emergency\b(?! USING)'),  # SQLite
+    re.compile(r'Seq Scan on emergencies_emergency\b'),  # PostgreSQL
+]
+
+
+class HotPathQueryPlanTests(TestCase):
+    """
+    The emergency hot paths must stay index-backed. Seeds a realistically
+    skewed table (mostly resolved, few active) and fails if any query a
+    hot path issues against emergencies_emergency plans a full table scan.
+    """
+    EMERGENCY_COUNT = 20000
+
+    @classmethod
+    def setUpTestData(cls):
+        rng = random.Random(42)
+        cls.volunteer = User.objects.create_user(
+            username='plan_volunteer', password='x', role='volunteer',
+            latitude=18.52, longitude=73.85,
+        )
+        victims = [
+            User(username=f'plan_victim_{i}', role='citizen') for i in range(50)
+        ]
+        responders = [
+            User(username=f'plan_responder_{i}', role='volunteer') for i in range(50)
+        ]
+        User.objects.bulk_create(victims + responders)
+        victims = list(User.objects.filter(username__startswith='plan_victim_'))
+        responders = list(User.objects.filter(username__startswith='plan_responder_'))
+
+        now = timezone.now()
+        emergencies = []
+        for i in range(cls.EMERGENCY_COUNT):
+            status = 'active' if i % 100 == 0 else 'resolved'
+            emergencies.append(Emergency(
+                victim=rng.choice(victims),
+                emergency_type=rng.choice(['medical', 'accident', 'fire']),
+                severity=rng.choice(['critical', 'high', 'moderate', 'low']),
+                status=status,
+                primary_responder=None if status == 'active' else rng.choice(responders),
+                latitude=round(18.5 + rng.uniform(-2, 2), 6),
+                longitude=round(73.8 + rng.uniform(-2, 2), 6),
+            ))
+        Emergency.objects.bulk_create(emergencies, batch_size=2000)
+
+        # Spread the trigger times over a year so time filters are selective
+        for offset, pk in enumerate(Emergency.objects.values_list('pk', flat=True)):
+            if offset % 20 == 0:
+                Emergency.objects.filter(pk__range=(pk, pk + 19)).update(
+                    triggered_at=now - timedelta(hours=offset // 20 * 9)
+                )
+
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def setUp(self):
+        self.client.force_login(self.volunteer)
+
+    def full_scans(self, queries):
+        scans = []
+        for query in queries:
+            sql = query['sql']
+            if not sql.startswith('SELECT') or 'emergencies_emergency' not in sql:
+                continue
+            prefix = 'EXPLAIN QUERY PLAN ' if connection.vendor == 'sqlite' else 'EXPLAIN '
+            with connection.cursor() as cursor:
+                cursor.execute(prefix + sql)
+                plan = '\n'.join(' '.join(str(col) for col in row) for row in cursor.fetchall())
+            if any(pattern.search(plan) for pattern in FULL_SCAN_PATTERNS):
+                scans.append(f'{sql}\n{plan}')
+        return scans
+
+    def assertIndexed(self, run):
+        with CaptureQueriesContext(connection) as captured:
+            result = run()
+        self.assertTrue(captured.captured_queries, 'Nothing was queried')
+        scans = self.full_scans(captured.captured_queries)
+        self.assertFalse(scans, 'Full table scan on emergencies:\n\n' + '\n\n'.join(scans))
+        return result
+
+    def test_api_active_emergencies(self):
+        self.assertIndexed(lambda: self.client.get(reverse('emergencies:api_active_emergencies')))
+
+    def test_emergency_list(self):
+        # Volunteer branch of emergency_list, as rendered
+        response = self.assertIndexed(lambda: self.client.get(reverse('emergencies:emergency_list')))
+        self.assertEqual(response.status_code, 200)
+
+    def test_emergency_list_citizen(self):
+        self.client.force_login(User.objects.get(username='plan_victim_0'))
+        response = self.assertIndexed(lambda: self.client.get(reverse('emergencies:emergency_list')))
+        self.assertEqual(response.status_code, 200)
+
+    def test_check_new_emergencies(self):
+        self.assertIndexed(lambda: self.client.get(reverse('responders:check_new_emergencies')))
+
+    def test_responder_stats_recalculate(self):
+        from responders.models import ResponderStats
+
+        stats, _ = ResponderStats.objects.get_or_create(
+            responder=User.objects.get(username='plan_responder_0')
+        )
+        self.assertIndexed(stats.recalculate)
+
+    def test_activate_bystander_mode(self):
+        self.assertIndexed(lambda: call_command('activate_bystander_mode', stdout=io.StringIO()))
+
+
+class NearestResponderTests(TestCase):
+    """The grid search must return exactly what checking every responder would"""
+    RESPONDER_COUNT = 3000
+    QUERY_COUNT = 50
+
+    @classmethod
+    def setUpTestData(cls):
+        rng = random.Random(7)
+        User.objects.bulk_create([
+            User(username=f'grid_responder_{i}', role='volunteer') for i in range(cls.RESPONDER_COUNT)
+        ])
+        locations = []
+        for i, user in enumerate(User.objects.filter(username__startswith='grid_responder_')):
+            # A dense city centre and a sparse surrounding region
+            spread = 0.05 if i % 3 == 0 else 0.6
+            latitude = round(18.52 + rng.uniform(-spread, spread), 6)
+            longitude = round(73.85 + rng.uniform(-spread, spread), 6)
+            locations.append(ResponderLocation(
+                responder=user, latitude=latitude, longitude=longitude, grid_cell=cell_for(latitude, longitude),
+            ))
+        ResponderLocation.objects.bulk_create(locations, batch_size=1000)
+        cls.points = [
+            (float(lat), float(lon)) for lat, lon in ResponderLocation.objects.values_list('latitude', 'longitude')
+        ]
+
+    def test_matches_brute_force(self):
+        rng = random.Random(11)
+        for _ in range(self.QUERY_COUNT):
+            lat, lon = 18.52 + rng.uniform(-0.7, 0.7), 73.85 + rng.uniform(-0.7, 0.7)
+            k = rng.choice([1, 5, 10, 0])
+            radius_km = rng.choice([0.5, 2, 5, 15])
+
+            found = [distance for distance, _ in nearest_responders(lat, lon, k=k, radius_km=radius_km)]
+            expected = sorted(
+                distance for distance in (haversine_km(lat, lon, *point) for point in self.points)
+                if distance <= radius_km
+            )
+            expected = expected[:k] if k else expected
+            self.assertEqual(len(found), len(expected), (lat, lon, k, radius_km))
+            for got, want in zip(found, expected):
+                self.assertAlmostEqual(got, want, places=9)
+
+    def test_cells_within_covers_circle(self):
+        rng = random.Random(13)
+        # Ordinary, high-latitude and antimeridian centres
+        for lat, lon in [(18.52, 73.85), (64.1, -21.9), (-16.5, 179.98), (51.5, -0.01)]:
+            for radius_km in (0.5, 3, 12):
+                cells = cells_within(lat, lon, radius_km)
+                min_lat, max_lat, min_lon, max_lon = bounding_box(lat, lon, radius_km)
+                for _ in range(2000):
+                    point_lat = rng.uniform(min_lat, max_lat)
+                    point_lon = (rng.uniform(min_lon, max_lon) + 180) % 360 - 180
+                    if haversine_km(lat, lon, point_lat, point_lon) <= radius_km:
+                        self.assertIn(cell_for(point_lat, point_lon), cells, (lat, lon, radius_km))
+
+
+class DispatchTests(TestCase):
+    """Dispatch notifies the nearest suitable volunteers it actually recorded"""
+
+    def setUp(self):
+        victim = User.objects.create_user(username='dispatch_victim', password=None, role='citizen')
+        self.emergency = Emergency.objects.create(
+            victim=victim, emergency_type='medical', severity='critical', latitude=18.52, longitude=73.85,
+        )
+
+    def volunteer(self, name, role_level, km_north):
+        user = User.objects.create_user(username=f'dispatch_{name}', password=None, role='volunteer')
+        VolunteerProfile.objects.create(user=user, role_level=role_level)
+        ResponderLocation.objects.create(responder=user, latitude=18.52 + km_north / KM_PER_DEGREE, longitude=73.85)
+        return user
+
+    def notified(self, responses):
+        return [response.responder.username for response in responses]
+
+    def test_trained_volunteers_first(self):
+        self.volunteer('general', 'general', 0.2)
+        self.volunteer('far_medic', 'medical', 2)
+        self.volunteer('medic', 'first_aid', 1)
+
+        responses = dispatch_emergency(self.emergency, k=5)
+
+        # Critical needs first aid: the closer untrained volunteer is skipped
+        self.assertEqual(self.notified(responses), ['dispatch_medic', 'dispatch_far_medic'])
+        self.assertTrue(all(response.pk for response in responses))
+        self.assertEqual(
+            EmergencyTimeline.objects.get(emergency=self.emergency, event_type='responder_notified').description,
+            '2 nearby responders notified',
+        )
+
+    def test_falls_back_to_any_volunteer(self):
+        self.volunteer('general', 'general', 0.5)
+        responses = dispatch_emergency(self.emergency)
+        self.assertEqual(self.notified(responses), ['dispatch_general'])
+
+    def test_existing_responses_not_counted(self):
+        taken = self.volunteer('taken', 'medical', 0.5)
+        self.volunteer('medic', 'medical', 1)
+        hits = find_candidates(self.emergency)
+        # Recorded by a concurrent dispatch after the candidates were picked
+        EmergencyResponse.objects.create(emergency=self.emergency, responder=taken, status='declined')
+
+        with mock.patch('emergencies.dispatch.find_candidates', return_value=hits):
+            responses = dispatch_emergency(self.emergency)
+
+        self.assertEqual(self.notified(responses), ['dispatch_medic'])
+        self.assertEqual(EmergencyResponse.objects.get(responder=taken).status, 'declined')
+        self.assertIn('1 nearby responders', EmergencyTimeline.objects.get(event_type='responder_notified').description)
+
+    def test_budget_spent_skips_road_ranking(self):
+        self.volunteer('medic', 'medical', 1)
+        late = time.perf_counter() - settings.DISPATCH_LATENCY_BUDGET_MS / 1000
+        with mock.patch('emergencies.routing.loaded_graph', return_value=object()), \
+                mock.patch('emergencies.dispatch.rank_by_road') as rank_by_road, \
+                self.assertLogs('emergencies.dispatch', 'WARNING'):
+            responses = dispatch_emergency(self.emergency, started=late)
+
+        rank_by_road.assert_not_called()
+        self.assertEqual(self.notified(responses), ['dispatch_medic'])
+
+
+class PushSubscriptionTests(TestCase):
+    """Subscriptions register the cells of their area and are found from any point inside it"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='push_user', password=None, role='volunteer', latitude=18.52, longitude=73.85,
+        )
+        self.client.force_login(self.user)
+        self.url = reverse('emergencies:api_push_subscribe')
+
+    def subscribe(self, **data):
+        data.setdefault('subscription', {'endpoint': 'https://push.example.com/1'})
+        return self.client.post(self.url, json.dumps(data), content_type='application/json')
+
+    def test_subscribe_registers_area(self):
+        # Explicit nulls fall back to the user's location too
+        self.assertEqual(self.subscribe(latitude=None, longitude=None, radius_km=3).status_code, 200)
+        subscription = PushSubscription.objects.get(user=self.user)
+        self.assertEqual((float(subscription.latitude), float(subscription.longitude)), (18.52, 73.85))
+        self.assertEqual(
+            set(subscription.cells.values_list('cell', flat=True)),
+            subscriptions.coverage_cells(18.52, 73.85, 3),
+        )
+        near = 18.52 + 2.5 / KM_PER_DEGREE
+        far = 18.52 + 3.5 / KM_PER_DEGREE
+        self.assertEqual([row[0] for row in subscriptions.subscribers_near(near, 73.85)], [subscription.pk])
+        self.assertEqual(subscriptions.subscribers_near(far, 73.85), [])
+
+    def test_bad_radius_rejected(self):
+        for radius_km in ['far', -1, 0, 1e9]:
+            self.assertEqual(self.subscribe(radius_km=radius_km).status_code, 400, radius_km)
+        self.assertFalse(PushSubscription.objects.exists())
+
+    def test_cells_rewritten_only_when_area_changes(self):
+        self.subscribe(radius_km=3)
+        subscription = PushSubscription.objects.get(user=self.user)
+        with CaptureQueriesContext(connection) as captured:
+            self.subscribe(radius_km=3, user_agent='Firefox')
+        self.assertFalse([query for query in captured if 'pushsubscriptioncell' in query['sql']])
+
+        self.subscribe(radius_km=8)
+        self.assertEqual(
+            set(subscription.cells.values_list('cell', flat=True)),
+            subscriptions.coverage_cells(18.52, 73.85, 8),
+        )
+
+    def test_subscribers_near_matches_brute_force(self):
+        rng = random.Random(5)
+        areas = {}
+        for i in range(40):
+            user = User.objects.create_user(username=f'push_{i}', password=None, role='citizen')
+            subscription = PushSubscription.objects.create(
+                user=user, subscription_info={}, notification_radius_km=rng.choice([1, 3, 10]),
+                latitude=round(18.52 + rng.uniform(-0.2, 0.2), 6),
+                longitude=round(73.85 + rng.uniform(-0.2, 0.2), 6),
+            )
+            areas[subscription.pk] = (
+                float(subscription.latitude), float(subscription.longitude), subscription.notification_radius_km,
+            )
+
+        for _ in range(100):
+            lat, lon = 18.52 + rng.uniform(-0.3, 0.3), 73.85 + rng.uniform(-0.3, 0.3)
+            expected = {
+                pk for pk, (sub_lat, sub_lon, radius) in areas.items()
+                if haversine_km(lat, lon, sub_lat, sub_lon) <= radius
+            }
+            self.assertEqual({row[0] for row in subscriptions.subscribers_near(lat, lon)}, expected)
+
+
+@mock.patch('emergencies.webpush.requests', create=True)
+# Pool threads close their connection after deactivating; the test's must stay open
+@mock.patch('emergencies.webpush.connection')
+class WebPushTests(TestCase):
+    """Subscriptions the push service reports as gone are deactivated, others kept"""
+
+    def setUp(self):
+        user = User.objects.create_user(username='webpush_user', password=None, role='volunteer')
+        self.subscription = PushSubscription.objects.create(
+            user=user, subscription_info={'endpoint': 'https://push.example.com/abc'},
+        )
+        self.sender = webpush.PushSender(mock.Mock(), max_workers=1, timeout=5, ttl=60)
+        self.addCleanup(self.sender._executor.shutdown)
+
+    def send(self, status_code):
+        response = mock.Mock(status_code=status_code, text='')
+        with mock.patch('emergencies.webpush.WebPusher') as pusher:
+            pusher.return_value.send.return_value = response
+            delivered = self.sender._send_one(self.subscription.pk, self.subscription.subscription_info, '{}')
+        self.subscription.refresh_from_db()
+        return delivered
+
+    def test_gone_subscriptions_deactivated(self, connection, requests):
+        for status_code in webpush.GONE_STATUSES:
+            PushSubscription.objects.filter(pk=self.subscription.pk).update(is_active=True)
+            with self.assertLogs('emergencies.webpush', 'INFO'):
+                self.assertFalse(self.send(status_code))
+            self.assertFalse(self.subscription.is_active, status_code)
+
+    def test_other_failures_keep_subscription(self, connection, requests):
+        self.assertTrue(self.send(201))
+        self.assertTrue(self.subscription.is_active)
+        with self.assertLogs('emergencies.webpush', 'WARNING'):
+            self.assertFalse(self.send(429))
+        self.assertTrue(self.subscription.is_active)
+
+
+class OutboxTests(TestCase):
+    """Delivery claims, retries and rollbacks of the lifecycle outbox"""
+
+    def setUp(self):
+        victim = User.objects.create_user(username='outbox_victim', password=None, role='citizen')
+        self.emergency = Emergency.objects.create(
+            victim=victim, emergency_type='medical', severity='high', latitude=18.52, longitude=73.85,
+        )
+        self.sent = []
+
+    def tearDown(self):
+        outbox._consumers.pop('test_event', None)
+
+    def consume(self, func):
+        outbox.consumer('test_event')(func)
+
+    def record(self, event):
+        """Consumer with a database write and an effect sent on commit"""
+        EmergencyTimeline.objects.create(emergency=event.emergency, event_type='escalated', description='consumed')
+        transaction.on_commit(lambda: self.sent.append(event.pk))
+
+    def timeline(self):
+        return EmergencyTimeline.objects.filter(description='consumed').count()
+
+    def test_delivers_once(self):
+        self.consume(self.record)
+        with self.captureOnCommitCallbacks(execute=True):
+            event = outbox.emit('test_event', emergency=self.emergency)
+        # Emitting must not start a dispatcher thread outside serving processes
+        self.assertIsNone(outbox._dispatcher)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertTrue(outbox.deliver(event))
+            self.assertFalse(outbox.deliver(event))
+        event.refresh_from_db()
+        self.assertIsNotNone(event.dispatched_at)
+        self.assertEqual(event.attempts, 1)
+        self.assertEqual(self.timeline(), 1)
+        self.assertEqual(self.sent, [event.pk])
+
+    def test_failure_rolls_back_and_retries(self):
+        def fail(event):
+            raise RuntimeError('push service down')
+
+        self.consume(self.record)
+        self.consume(fail)
+        event = outbox.emit('test_event', emergency=self.emergency)
+        with self.captureOnCommitCallbacks(execute=True), self.assertLogs('emergencies.outbox', 'WARNING'):
+            self.assertFalse(outbox.deliver(event))
+
+        event.refresh_from_db()
+        self.assertIsNone(event.dispatched_at)
+        self.assertEqual(event.attempts, 1)
+        self.assertIn('push service down', event.last_error)
+        self.assertGreater(event.available_at, timezone.now())
+        self.assertEqual(self.timeline(), 0)
+        self.assertEqual(self.sent, [])
+        self.assertEqual(outbox.due_events(10), [])
+
+    def test_expired_claim_delivered_elsewhere(self):
+        def delivered_meanwhile(event):
+            # Another dispatcher picked the event up after this claim ran out
+            OutboxEvent.objects.filter(pk=event.pk).update(dispatched_at=timezone.now())
+
+        self.consume(self.record)
+        self.consume(delivered_meanwhile)
+        event = outbox.emit('test_event', emergency=self.emergency)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertFalse(outbox.deliver(event))
+        self.assertEqual(self.timeline(), 0)
+        self.assertEqual(self.sent, [])
+
+    def test_claim_hides_event(self):
+        event = outbox.emit('test_event', emergency=self.emergency)
+        OutboxEvent.objects.filter(pk=event.pk).update(available_at=timezone.now() + timedelta(seconds=60))
+        self.assertFalse(outbox.deliver(event))
+        self.assertEqual(outbox.dispatch_pending(), 0)
+
+
+class RoutingTests(SimpleTestCase):
+    """Road graph queries against plain Dijkstra, and loading off the SOS path"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        # 12 x 12 street grid (~110 m blocks) with random travel times, some one-way
+        rng = random.Random(7)
+        size = 12
+        latitudes = [18.5 + row * 0.001 for row in range(size) for col in range(size)]
+        longitudes = [73.8 + col * 0.001 for row in range(size) for col in range(size)]
+        edges = []
+        for node in range(size * size):
+            row, col = divmod(node, size)
+            for neighbour in ([node + 1] if col + 1 < size else []) + ([node + size] if row + 1 < size else []):
+                seconds = rng.uniform(5, 30)
+                edges.append((node, neighbour, seconds, 110.0))
+                if rng.random() < 0.8:
+                    edges.append((neighbour, node, seconds * rng.uniform(0.8, 1.5), 110.0))
+        cls.graph = routing.RoadGraph.build(latitudes, longitudes, edges, landmarks=4)
+        handle, cls.path = tempfile.mkstemp(suffix='.graph')
+        os.close(handle)
+        cls.graph.save(cls.path)
+
+    @classmethod
+    def tearDownClass(cls):
+        os.remove(cls.path)
+        super().tearDownClass()
+
+    def test_queries_match_dijkstra(self):
+        graph = routing.RoadGraph.load(self.path)
+        rng = random.Random(11)
+        for _ in range(30):
+            source, target = rng.randrange(graph.node_count), rng.randrange(graph.node_count)
+            expected = routing.dijkstra(graph.offsets, graph.targets, graph.seconds, source)[target]
+            result = graph.route(source, target)
+            if math.isinf(expected):
+                self.assertIsNone(result)
+                continue
+            self.assertAlmostEqual(result[0], expected, places=3)
+            self.assertAlmostEqual(graph.times_to(target, {source})[source][0], expected, places=3)
+
+    def test_dispatch_never_waits_for_the_graph(self):
+        with override_settings(ROUTING_GRAPH_PATH=self.path), \
+                mock.patch.multiple(routing, _graph=None, _graph_loaded=False, _loader=None):
+            # Not warmed up: no graph yet, loading moves to the background
+            self.assertIsNone(routing.loaded_graph())
+            routing._loader.join(10)
+            self.assertEqual(routing.loaded_graph().node_count, self.graph.node_count)
+
+        with override_settings(ROUTING_GRAPH_PATH=self.path), \
+                mock.patch.multiple(routing, _graph=None, _graph_loaded=False, _loader=None):
+            routing.warm_up()
+            self.assertIsNotNone(routing.loaded_graph())
+            self.assertIsNone(routing._loader)
+
+    def test_eta_never_waits_for_the_graph(self):
+        emergency = SimpleNamespace(latitude=self.graph.latitudes[-1], longitude=self.graph.longitudes[-1])
+        start = (self.graph.latitudes[0], self.graph.longitudes[0])
+        with override_settings(ROUTING_GRAPH_PATH=self.path), \
+                mock.patch.multiple(routing, _graph=None, _graph_loaded=False, _loader=None):
+            # Another thread is in the middle of loading it
+            with routing._graph_lock:
+                self.assertFalse(eta.route_to(*start, emergency)[2])
+            routing._loader.join(10)
+            self.assertIsNotNone(routing.loaded_graph())
+
+
+class LocationBufferTests(TestCase):
+    """GPS pings are coalesced in memory and upserted in one flush"""
+
+    def setUp(self):
+        cache.clear()
+        self.responder, self.other = [
+            User.objects.create_user(username=f'buffer_{name}', password=None, role='volunteer')
+            for name in ('responder', 'other')
+        ]
+        ResponderLocation.objects.create(responder=self.responder, latitude=18.0, longitude=73.0)
+        # No background thread: the test flushes by hand
+        patcher = mock.patch.object(LocationBuffer, '_recorded')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.buffer = LocationBuffer(flush_seconds=60)
+
+    def fix(self, latitude, longitude):
+        return Fix(latitude, longitude, 5.0, timezone.now())
+
+    def test_flush_upserts_latest_fix(self):
+        self.buffer.record_responder(self.responder.pk, self.fix(18.51, 73.84))
+        self.buffer.record_responder(self.responder.pk, self.fix(18.52, 73.85))
+        self.buffer.record_responder(self.other.pk, self.fix(18.6, 73.9))
+        self.buffer.record_user(self.other.pk, self.fix(18.6, 73.9))
+        self.assertEqual(self.buffer.pending_fix(self.responder.pk).latitude, 18.52)
+        self.assertEqual(float(ResponderLocation.objects.get(responder=self.responder).latitude), 18.0)
+
+        self.assertEqual(self.buffer.flush(), 3)
+        rows = {
+            row.responder_id: (float(row.latitude), float(row.longitude), row.grid_cell)
+            for row in ResponderLocation.objects.all()
+        }
+        self.assertEqual(rows, {
+            self.responder.pk: (18.52, 73.85, cell_for(18.52, 73.85)),
+            self.other.pk: (18.6, 73.9, cell_for(18.6, 73.9)),
+        })
+        self.other.refresh_from_db()
+        self.assertEqual((float(self.other.latitude), float(self.other.longitude)), (18.6, 73.9))
+        self.assertEqual(self.buffer.flush(), 0)
+
+    def test_failed_flush_keeps_newer_fix(self):
+        self.buffer.record_responder(self.responder.pk, self.fix(18.51, 73.84))
+
+        def ping_then_fail(fixes):
+            # A newer ping lands while the failing batch is being written
+            self.buffer.record_responder(self.responder.pk, self.fix(18.52, 73.85))
+            raise DatabaseError('connection lost')
+
+        with mock.patch('emergencies.locations.write_responder_fixes', side_effect=ping_then_fail), \
+                self.assertRaises(DatabaseError):
+            self.buffer.flush()
+        self.assertEqual(self.buffer.pending_fix(self.responder.pk).latitude, 18.52)
+
+        self.assertEqual(self.buffer.flush(), 1)
+        self.assertEqual(float(ResponderLocation.objects.get(responder=self.responder).latitude), 18.52)
+
+
+class TrackTests(TestCase):
+    """Route tracks: ring buffer, blob layout, simplification and storage"""
+
+    def setUp(self):
+        victim = User.objects.create_user(username='track_victim', password=None, role='citizen')
+        self.volunteer = User.objects.create_user(username='track_volunteer', password=None, role='volunteer')
+        emergency = Emergency.objects.create(
+            victim=victim, emergency_type='medical', severity='high', latitude=18.522, longitude=73.862,
+            status='responder_assigned', primary_responder=self.volunteer,
+        )
+        self.response = EmergencyResponse.objects.create(
+            emergency=emergency, responder=self.volunteer, status='accepted', responded_at=timezone.now(),
+        )
+        tracks.start_tracking(self.volunteer.id, self.response.id)
+
+    def route(self):
+        """East along one street, then north after a corner, with ~2 m of GPS jitter"""
+        rng = random.Random(5)
+        started = timezone.now() - timedelta(minutes=5)
+        fixes = []
+        for i in range(41):
+            east, north = min(i, 20), max(0, i - 20)
+            fixes.append(Fix(
+                18.52 + north * 0.0001 + rng.uniform(-2e-5, 2e-5),
+                73.86 + east * 0.0001 + rng.uniform(-2e-5, 2e-5),
+                5.0,
+                started + timedelta(seconds=5 * i),
+            ))
+        return fixes
+
+    def assertWithinTolerance(self, points, simplified, tolerance_m):
+        for point in points:
+            nearest = min(
+                tracks._segment_distance_m(point, start, end)
+                for start, end in zip(simplified, simplified[1:])
+            )
+            self.assertLessEqual(nearest, tolerance_m)
+
+    def test_buffer_keeps_latest(self):
+        buffer = tracks.TrackBuffer(4)
+        for i in range(6):
+            buffer.append(float(i), 18.5, 73.8, None if i % 2 else 5.0)
+        self.assertTrue(buffer.full())
+        self.assertEqual([point[0] for point in buffer.points()], [2.0, 3.0, 4.0, 5.0])
+        self.assertEqual([point[3] for point in buffer.points()], [5.0, None, 5.0, None])
+
+    def test_pack_round_trip(self):
+        points = [(1700000000.25, 18.520001, 73.860002, 4.5), (1700000005.5, 18.52011, 73.86013, None)]
+        self.assertEqual(tracks.unpack(tracks.pack(points)), points)
+        self.assertEqual(tracks.unpack(b''), [])
+        with self.assertRaises(ValueError):
+            tracks.unpack(b'JUNK' + bytes(4))
+
+    def test_simplify_keeps_the_corner(self):
+        points = [(fix.recorded_at.timestamp(), fix.latitude, fix.longitude, fix.accuracy) for fix in self.route()]
+        simplified = tracks.simplify(points, 10)
+        self.assertLess(len(simplified), 6)
+        self.assertEqual((simplified[0], simplified[-1]), (points[0], points[-1]))
+        self.assertIn(points[20], simplified)
+        self.assertWithinTolerance(points, simplified, 10)
+
+    def test_store_flushes_off_the_request_path(self):
+        store = tracks.TrackStore(capacity=8, persist_seconds=60, threaded=False)
+        fixes = self.route()
+        for fix in fixes:
+            store.record(self.volunteer.id, fix)
+        # Pings never write the track themselves
+        self.assertFalse(ResponseTrack.objects.exists())
+        self.assertEqual(len(store.buffered_points(self.response.id)), len(fixes))
+
+        self.assertEqual(store.flush(), len(fixes))
+        track = ResponseTrack.objects.get(response=self.response)
+        self.assertEqual(track.raw_point_count, len(fixes))
+        points = track.decoded_points()
+        self.assertEqual(track.point_count, len(points))
+        self.assertEqual(track.started_at, fixes[0].recorded_at)
+        self.assertEqual(track.ended_at, fixes[-1].recorded_at)
+        # Two 20-block legs of ~11 m
+        self.assertAlmostEqual(track.distance_km, 40 * 0.0001 * KM_PER_DEGREE, delta=0.02)
+        # Nothing new since: the buffer expires
+        self.assertEqual(store.flush(), 0)
+        self.assertFalse(store._buffers)
+
+    def test_stored_points_kept_across_flushes(self):
+        store = tracks.TrackStore(capacity=256, persist_seconds=60, threaded=False)
+        fixes = self.route()
+        stored = []
+        for start in range(0, len(fixes), 6):
+            for fix in fixes[start:start + 6]:
+                store.record(self.volunteer.id, fix)
+            store.flush()
+            points = ResponseTrack.objects.get(response=self.response).decoded_points()
+            # Earlier points are never simplified away again
+            self.assertTrue(set(stored) <= set(points))
+            stored = points
+        raw = [(fix.recorded_at.timestamp(), fix.latitude, fix.longitude, fix.accuracy) for fix in fixes]
+        self.assertWithinTolerance(raw, stored, 10)
+
+    def test_other_worker_flushes_after_finish(self):
+        # Pings of one responder spread over two workers
+        handled, other = (tracks.TrackStore(capacity=256, persist_seconds=60, threaded=False) for _ in range(2))
+        fixes = self.route()
+        for index, fix in enumerate(fixes[:-1]):
+            (handled if index % 2 else other).record(self.volunteer.id, fix)
+        track = handled.finish(self.response.id)
+        self.assertIsNotNone(track.closed_at)
+        self.assertEqual(track.raw_point_count, len(fixes) // 2)
+        # The other worker still records until its cached flag expires
+        late = fixes[-1]._replace(recorded_at=track.closed_at + timedelta(seconds=5))
+        other.record(self.volunteer.id, late)
+
+        other.flush()
+        track.refresh_from_db()
+        self.assertEqual(track.raw_point_count, len(fixes) - 1)
+        self.assertEqual(track.ended_at, fixes[-2].recorded_at)
+        other.flush()
+        self.assertFalse(other._buffers)
+
+    def test_untracked_responder_ignored(self):
+        other = User.objects.create_user(username='track_other', password=None, role='volunteer')
+        cache.delete(tracks.tracked_response_key(other.id))
+        store = tracks.TrackStore(capacity=8, persist_seconds=0, threaded=False)
+        store.record(other.id, self.route()[0])
+        self.assertFalse(store._buffers)
+        self.assertFalse(ResponseTrack.objects.exists())
+
+
+class TimerWheelTests(SimpleTestCase):
+    def test_fires_every_timer_once_on_time(self):
+        rng = random.Random(3)
+        wheel = escalation.TimerWheel(tick_seconds=0.5, slots=16, start=0)
+        # Deadlines span several turns of the wheel
+        deadlines = {key: rng.uniform(0, 40) for key in range(200)}
+        for key, deadline in deadlines.items():
+            wheel.schedule(key, deadline, deadline)
+        for key in range(0, 200, 7):
+            self.assertTrue(wheel.cancel(key))
+            del deadlines[key]
+        self.assertFalse(wheel.cancel(0))
+
+        fired = []
+        now = 0
+        while now < 45:
+            previous, now = now, now + rng.uniform(0.1, 3)
+            for key, deadline in wheel.advance(now):
+                self.assertLessEqual(deadline, now)
+                self.assertGreater(deadline, previous - 2 * wheel.tick_seconds)
+                fired.append(key)
+        self.assertEqual(sorted(fired), sorted(deadlines))
+        self.assertEqual(len(wheel), 0)
+
+    def test_past_deadline_fires_next_tick(self):
+        wheel = escalation.TimerWheel(tick_seconds=1, slots=8, start=0)
+        wheel.schedule('later', 14, 'later')
+        self.assertEqual(wheel.advance(10), [])
+        wheel.schedule('overdue', 3, 'overdue')
+        self.assertEqual(wheel.advance(11), [('overdue', 'overdue')])
+        # A long stall still fires what's due, earliest first
+        wheel.schedule('soon', 11.5, 'soon')
+        self.assertEqual(wheel.advance(100), [('soon', 'soon'), ('later', 'later')])
+
+
+@override_settings(ESCALATION_POLICY={
+    'high': [{'after': 0}, {'after': 60, 'k': 10, 'radius_km': 6}, {'after': 120, 'bystander': True}],
+})
+class EscalationLadderTests(TestCase):
+    """Every ladder stage runs at most once, and never after an acceptance"""
+
+    def setUp(self):
+        victim = User.objects.create_user(username='ladder_victim', password=None, role='citizen')
+        self.emergency = Emergency.objects.create(
+            victim=victim, emergency_type='medical', severity='high', latitude=18.52, longitude=73.85,
+        )
+        self.triggered = self.emergency.triggered_at.timestamp()
+
+    def process(self):
+        """A scheduler as a freshly started process would hold it"""
+        scheduler = escalation.EscalationScheduler(1, threaded=False)
+        scheduler.recover()
+        return scheduler
+
+    def events(self, event_type):
+        return EmergencyTimeline.objects.filter(emergency=self.emergency, event_type=event_type).count()
+
+    def test_stages_run_once_across_processes(self):
+        first, second = self.process(), self.process()
+        self.assertEqual(first.run_due(self.triggered + 30), 0)
+        self.assertEqual(first.run_due(self.triggered + 61), 1)
+        # The other process fires the same deadline but loses the claim
+        self.assertEqual(second.run_due(self.triggered + 61), 1)
+        self.emergency.refresh_from_db()
+        self.assertEqual(self.emergency.escalation_stage, 1)
+        self.assertEqual(self.events('escalated'), 1)
+
+        # Started after stage 1 ran: only the rest is pending
+        late = self.process()
+        self.assertEqual(len(late.wheel), 1)
+        for scheduler in (first, second, late):
+            scheduler.run_due(self.triggered + 121)
+        self.emergency.refresh_from_db()
+        self.assertTrue(self.emergency.bystander_mode_active)
+        self.assertEqual(self.emergency.escalation_stage, 2)
+        self.assertEqual(self.events('bystander_mode_activated'), 1)
+        self.assertEqual(len(self.process().wheel), 0)
+
+    def test_acceptance_elsewhere_stops_the_ladder(self):
+        scheduler = self.process()
+        self.assertEqual(len(scheduler.wheel), 2)
+        # Accepted in another process: this one still holds the deadlines
+        volunteer = User.objects.create_user(username='ladder_volunteer', password=None, role='volunteer')
+        Emergency.objects.filter(pk=self.emergency.pk).update(
+            status='responder_assigned', primary_responder=volunteer,
+        )
+        self.assertEqual(scheduler.run_due(self.triggered + 121), 2)
+        self.emergency.refresh_from_db()
+        self.assertEqual(self.emergency.escalation_stage, 0)
+        self.assertFalse(self.emergency.bystander_mode_active)
+        self.assertEqual(self.events('escalated'), 0)
+        self.assertEqual(len(self.process().wheel), 0)
+
+    def test_failed_stage_rolls_back_and_retries(self):
+        scheduler = self.process()
+        with mock.patch('emergencies.dispatch.dispatch_emergency', side_effect=RuntimeError('routing down')), \
+                self.assertLogs('emergencies.escalation', 'ERROR'):
+            self.assertEqual(scheduler.run_due(self.triggered + 61), 1)
+        self.emergency.refresh_from_db()
+        self.assertEqual(self.emergency.escalation_stage, 0)
+        self.assertEqual(self.events('escalated'), 0)
+
+        # Within a tick of the retry delay
+        self.assertEqual(scheduler.run_due(self.triggered + 62 + settings.ESCALATION_RETRY_SECONDS), 1)
+        self.emergency.refresh_from_db()
+        self.assertEqual(self.emergency.escalation_stage, 1)
+        self.assertEqual(self.events('escalated'), 1)
+
+    @override_settings(ESCALATION_POLICY={'high': [{'after': 0}, {'after': 60, 'min_role_level': 'medical'}]})
+    def test_medical_stage_never_falls_back(self):
+        general = User.objects.create_user(username='ladder_general', password=None, role='volunteer')
+        VolunteerProfile.objects.create(user=general, role_level='general')
+        ResponderLocation.objects.create(responder=general, latitude=18.521, longitude=73.851)
+
+        with self.assertLogs('emergencies.dispatch', 'INFO') as logs:
+            self.assertTrue(escalation.run_stage(self.emergency.pk, 'high', 1))
+        self.assertIn('No medical-level volunteers', '\n'.join(logs.output))
+        self.assertFalse(EmergencyResponse.objects.filter(emergency=self.emergency).exists())
+
+    def test_cancel_ladder(self):
+        scheduler = self.process()
+        scheduler.cancel_ladder(self.emergency.pk, self.emergency.severity)
+        self.assertEqual(len(scheduler.wheel), 0)
+        self.assertEqual(scheduler.run_due(self.triggered + 121), 0)
+
+
+class LiveMapTests(TestCase):
+    """Map changes are stamped after their commit and served as deltas"""
+
+    def setUp(self):
+        # Snapshots are cached by version, and versions restart in every test
+        cache.clear()
+        self.victim = User.objects.create_user(username='map_victim', password=None, role='citizen')
+        self.emergency = self.trigger(18.52, 73.85)
+        self.url = reverse('emergencies:api_active_emergencies')
+
+    def trigger(self, latitude, longitude, severity='high'):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Emergency.objects.create(
+                victim=self.victim, emergency_type='medical', severity=severity,
+                latitude=latitude, longitude=longitude,
+            )
+
+    def change(self, emergency, **fields):
+        with self.captureOnCommitCallbacks(execute=True):
+            for name, value in fields.items():
+                setattr(emergency, name, value)
+            emergency.save()
+
+    def version(self):
+        return ChangeCounter.current(snapshots.SNAPSHOT_COUNTER)
+
+    def test_counter_bumped_after_commit(self):
+        before = self.version()
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.emergency.severity = 'critical'
+            self.emergency.save()
+            # Not written inside the saving transaction
+            self.assertEqual(self.version(), before)
+
+        for callback in callbacks:
+            callback()
+        self.assertEqual(self.version(), before + 1)
+        self.emergency.refresh_from_db()
+        self.assertEqual(self.emergency.change_seq, before + 1)
+
+    def test_etag_revalidation(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(json.loads(response.content)['emergencies']), 1)
+        etag = response['ETag']
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+        self.change(self.emergency, severity='critical')
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(json.loads(response.content)['emergencies'][0]['severity'], 'critical')
+
+    def test_delta_since_cursor(self):
+        leaving = self.trigger(18.53, 73.86)
+        cursor = json.loads(self.client.get(self.url).content)['cursor']
+        self.assertEqual(self.client.get(self.url, {'since': cursor}).json(), {
+            'cursor': cursor, 'changed': [], 'removed': [],
+        })
+
+        self.change(self.emergency, severity='critical')
+        added = self.trigger(18.54, 73.87)
+        self.change(leaving, status='resolved')
+
+        delta = self.client.get(self.url, {'since': cursor}).json()
+        self.assertEqual(delta['cursor'], self.version())
+        self.assertEqual(
+            {row['emergency_id']: row['severity'] for row in delta['changed']},
+            {str(self.emergency.emergency_id): 'critical', str(added.emergency_id): 'high'},
+        )
+        self.assertEqual(delta['removed'], [str(leaving.emergency_id)])
+
+        # Outside the viewport: nothing to report there
+        delta = self.client.get(self.url, {'since': cursor, 'bbox': '70,10,71,11'}).json()
+        self.assertEqual((delta['changed'], delta['removed']), ([], []))
+
+    def test_hard_delete_resets_cursors(self):
+        cursor = json.loads(self.client.get(self.url).content)['cursor']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.emergency.delete()
+
+        # A delete can't be sent as a delta: older cursors get a full snapshot
+        body = json.loads(self.client.get(self.url, {'since': cursor}).content)
+        self.assertEqual(body['emergencies'], [])
+        self.assertEqual(body['cursor'], self.version())
+        self.assertEqual(self.client.get(self.url, {'since': body['cursor']}).json()['changed'], [])
+
+        # So do cursors from the future
+        body = json.loads(self.client.get(self.url, {'since': self.version() + 5}).content)
+        self.assertIn('emergencies', body)
+
+    def test_clusters_by_zoom(self):
+        self.trigger(18.53, 73.86, severity='critical')
+        self.trigger(18.9, 73.5, severity='moderate')
+        self.trigger(20.5, 75.0)  # Outside the viewport
+        self.change(self.trigger(18.54, 73.87), status='resolved')
+        bbox = '73,18,74.5,19.5'
+
+        body = json.loads(self.client.get(self.url, {'bbox': bbox, 'zoom': 8}).content)
+        self.assertEqual(body['zoom'], 8)
+        self.assertEqual(body['cursor'], self.version())
+        clusters = sorted(body['clusters'], key=lambda cluster: cluster['count'])
+        self.assertEqual(clusters, [
+            {'latitude': 18.9, 'longitude': 73.5, 'count': 1, 'severity': 'moderate'},
+            {'latitude': 18.525, 'longitude': 73.855, 'count': 2, 'severity': 'critical'},
+        ])
+
+        # Zoomed in far enough, the viewport gets individual emergencies
+        body = json.loads(self.client.get(self.url, {'bbox': bbox, 'zoom': snapshots.CLUSTER_MAX_ZOOM}).content)
+        self.assertEqual(len(body['emergencies']), 3)
 
-# Create your tests here.
@@ -0,0 +1,378 @@
+"""
+Responder route tracks
+While a responder is heading to an emergency, every GPS fix also goes
+into a fixed-size ring buffer of packed arrays (timestamp, lat, lon,
+accuracy) in the worker that received it. A background thread in each
+worker stores its buffered points every TRACK_PERSIST_SECONDS (sooner
+when a buffer fills up) into a single ResponseTrack blob per
+EmergencyResponse, and drops buffers that saw no fix for a whole
+interval. Only the newly stored points are simplified with
+Douglas-Peucker, so stored points never drift further from the route.
+One small row per response replaces thousands of point rows and still
+allows route replay and arrival analytics afterwards.
+
+When the response ends (arrival, decline) the worker handling it stores
+its own points and closes the track. Points other workers still hold are
+stored by their next flush; fixes taken after the close are dropped.
+"""
+
+import atexit
+import logging
+import math
+import struct
+import sys
+import threading
+import time
+from array import array
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+from .geo import KM_PER_DEGREE, haversine_km
+
+logger = logging.getLogger(__name__)
+
+# Blob layout: header, then count doubles of each of t/lat/lon, then count floats of accuracy
+TRACK_MAGIC = b'GMT1'
+TRACK_HEADER = struct.Struct('<4sI')
+
+# EmergencyResponse / Emergency states in which the responder is travelling
+TRACKED_RESPONSE_STATUSES = ['accepted', 'en_route']
+TRACKED_EMERGENCY_STATUSES = ['responder_assigned', 'responder_en_route']
+ACTIVE_RESPONSE_CACHE_SECONDS = 60
+
+
+class TrackBuffer:
+    """Ring buffer of the most recent fixes of one responder"""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.timestamps = array('d', bytes(8 * capacity))
+        self.latitudes = array('d', bytes(8 * capacity))
+        self.longitudes = array('d', bytes(8 * capacity))
+        self.accuracies = array('f', bytes(4 * capacity))
+        self.start = 0
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def full(self):
+        return self.count == self.capacity
+
+    def append(self, timestamp, latitude, longitude, accuracy=None):
+        index = (self.start + self.count) % self.capacity
+        if self.count == self.capacity:
+            # Overwrite the oldest point
+            self.start = (self.start + 1) % self.capacity
+        else:
+            self.count += 1
+        self.timestamps[index] = timestamp
+        self.latitudes[index] = latitude
+        self.longitudes[index] = longitude
+        self.accuracies[index] = math.nan if accuracy is None else accuracy
+
+    def points(self):
+        """Buffered (timestamp, lat, lon, accuracy) tuples, oldest first"""
+        result = []
+        for offset in range(self.count):
+            index = (self.start + offset) % self.capacity
+            accuracy = self.accuracies[index]
+            result.append((
+                self.timestamps[index], self.latitudes[index], self.longitudes[index],
+                None if math.isnan(accuracy) else accuracy,
+            ))
+        return result
+
+    def clear(self):
+        self.start = 0
+        self.count = 0
+
+
+def _offset_m(origin, point):
+    """Equirectangular (x, y) metres of point from origin; fine at street scale"""
+    cos_lat = math.cos(math.radians(origin[1]))
+    return (
+        (point[2] - origin[2]) * KM_PER_DEGREE * 1000 * cos_lat,
+        (point[1] - origin[1]) * KM_PER_DEGREE * 1000,
+    )
+
+
+def _segment_distance_m(point, start, end):
+    """Distance (metres) from point to the segment start-end"""
+    px, py = _offset_m(start, point)
+    ex, ey = _offset_m(start, end)
+    length_sq = ex * ex + ey * ey
+    if length_sq == 0:
+        return math.hypot(px, py)
+    t = max(0.0, min(1.0, (px * ex + py * ey) / length_sq))
+    return math.hypot(px - t * ex, py - t * ey)
+
+
+def simplify(points, tolerance_m):
+    """
+    Douglas-Peucker: drop points closer than tolerance_m to the line
+    through their kept neighbours. Iterative, so long tracks can't hit
+    the recursion limit. Points are (timestamp, lat, lon, accuracy).
+    """
+    if len(points) < 3:
+        return list(points)
+    keep = bytearray(len(points))
+    keep[0] = keep[-1] = 1
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        farthest, farthest_m = None, tolerance_m
+        for index in range(first + 1, last):
+            distance = _segment_distance_m(points[index], points[first], points[last])
+            if distance > farthest_m:
+                farthest, farthest_m = index, distance
+        if farthest is not None:
+            keep[farthest] = 1
+            stack.append((first, farthest))
+            stack.append((farthest, last))
+    return [point for point, kept in zip(points, keep) if kept]
+
+
+def pack(points):
+    """Encode points into the compact little-endian track blob"""
+    columns = [array('d'), array('d'), array('d'), array('f')]
+    for timestamp, latitude, longitude, accuracy in points:
+        columns[0].append(timestamp)
+        columns[1].append(latitude)
+        columns[2].append(longitude)
+        columns[3].append(math.nan if accuracy is None else accuracy)
+    if sys.byteorder != 'little':
+        for column in columns:
+            column.byteswap()
+    return TRACK_HEADER.pack(TRACK_MAGIC, len(points)) + b''.join(column.tobytes() for column in columns)
+
+
+def unpack(blob):
+    """Decode a track blob back into (timestamp, lat, lon, accuracy) tuples"""
+    if not blob:
+        return []
+    blob = bytes(blob)
+    magic, count = TRACK_HEADER.unpack_from(blob)
+    if magic != TRACK_MAGIC:
+        raise ValueError('Not a track blob')
+    offset = TRACK_HEADER.size
+    columns = []
+    for typecode in ('d', 'd', 'd', 'f'):
+        column = array(typecode)
+        size = column.itemsize * count
+        column.frombytes(blob[offset:offset + size])
+        offset += size
+        if sys.byteorder != 'little':
+            column.byteswap()
+        columns.append(column)
+    return [
+        (timestamp, latitude, longitude, None if math.isnan(accuracy) else accuracy)
+        for timestamp, latitude, longitude, accuracy in zip(*columns)
+    ]
+
+
+def path_length_km(points):
+    return sum(
+        haversine_km(a[1], a[2], b[1], b[2])
+        for a, b in zip(points, points[1:])
+    )
+
+
+def tracked_response_key(responder_id):
+    return f'emergencies:tracked_response:{responder_id}'
+
+
+def active_response_id(responder_id):
+    """EmergencyResponse the responder is currently travelling to, or None (cached)"""
+    key = tracked_response_key(responder_id)
+    response_id = cache.get(key)
+    if response_id is None:
+        from .models import EmergencyResponse
+
+        response_id = EmergencyResponse.objects.filter(
+            responder_id=responder_id,
+            status__in=TRACKED_RESPONSE_STATUSES,
+            emergency__status__in=TRACKED_EMERGENCY_STATUSES,
+        ).order_by('-responded_at').values_list('id', flat=True).first() or 0
+        cache.set(key, response_id, ACTIVE_RESPONSE_CACHE_SECONDS)
+    return response_id or None
+
+
+def persist(response_id, points, close=False):
+    """
+    Simplify points and merge them into the response's stored track;
+    close=True marks the track finished. Points taken after the track
+    was closed are dropped.
+    """
+    from datetime import datetime, timezone as dt_timezone
+    from .models import ResponseTrack
+
+    if not points and not close:
+        return None
+    tolerance_m = getattr(settings, 'TRACK_SIMPLIFY_METERS', 10)
+    with transaction.atomic():
+        track, _ = ResponseTrack.objects.select_for_update().get_or_create(response_id=response_id)
+        if track.closed_at is not None:
+            closed = track.closed_at.timestamp()
+            points = [point for point in points if point[0] <= closed]
+        if close and track.closed_at is None:
+            track.closed_at = timezone.now()
+        if points:
+            stored = unpack(track.points)
+            points = sorted(points, key=lambda point: point[0])
+            # Simplify the new points only, joined to the stored point before
+            # them; stored points are never simplified again
+            before = [point for point in stored if point[0] < points[0][0]]
+            segment = simplify(before[-1:] + points, tolerance_m)[len(before[-1:]):]
+            # Several workers may each hold part of a track, so merge by time
+            merged = sorted(stored + segment, key=lambda point: point[0])
+            track.points = pack(merged)
+            track.point_count = len(merged)
+            track.raw_point_count += len(points)
+            track.distance_km = path_length_km(merged)
+            track.started_at = datetime.fromtimestamp(merged[0][0], dt_timezone.utc)
+            track.ended_at = datetime.fromtimestamp(merged[-1][0], dt_timezone.utc)
+        track.save()
+    return track
+
+
+class TrackStore:
+    """
+    Per-process ring buffers keyed by EmergencyResponse id, stored by a
+    background thread. persist_seconds = 0 stores on every fix.
+    """
+
+    def __init__(self, capacity, persist_seconds, threaded=True):
+        self.capacity = capacity
+        self.persist_seconds = persist_seconds
+        self.threaded = threaded
+        self._lock = threading.Lock()
+        self._buffers = {}
+        # Points of full buffers waiting for the next flush
+        self._full = {}
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def record(self, responder_id, fix):
+        """Append a fix to the responder's active track, if they are travelling"""
+        response_id = active_response_id(responder_id)
+        if response_id is None:
+            return
+        timestamp = fix.recorded_at.timestamp() if fix.recorded_at else time.time()
+        with self._lock:
+            buffer = self._buffers.get(response_id)
+            if buffer is None:
+                buffer = self._buffers[response_id] = TrackBuffer(self.capacity)
+            buffer.append(timestamp, fix.latitude, fix.longitude, fix.accuracy)
+            if buffer.full():
+                self._full.setdefault(response_id, []).extend(buffer.points())
+                buffer.clear()
+                self._wakeup.set()
+        self._recorded()
+
+    def flush(self):
+        """
+        Store every buffered point; buffers that got no fix since the last
+        flush are dropped. Returns the number of points stored.
+        """
+        with self._lock:
+            batches, self._full = self._full, {}
+            for response_id, buffer in list(self._buffers.items()):
+                points = batches.get(response_id, []) + buffer.points()
+                if points:
+                    batches[response_id] = points
+                    buffer.clear()
+                else:
+                    # Idle for a whole interval: the response has most likely ended
+                    del self._buffers[response_id]
+        stored = 0
+        for response_id, points in batches.items():
+            try:
+                persist(response_id, points)
+                stored += len(points)
+            except Exception:
+                logger.exception("Failed to store track of response %s, retrying next flush", response_id)
+                with self._lock:
+                    self._full.setdefault(response_id, [])[:0] = points
+        return stored
+
+    def finish(self, response_id):
+        """Store whatever this process holds for a response that has ended, and close its track"""
+        with self._lock:
+            points = self._full.pop(response_id, [])
+            buffer = self._buffers.pop(response_id, None)
+            if buffer is not None:
+                points += buffer.points()
+        return persist(response_id, points, close=True)
+
+    def buffered_points(self, response_id):
+        """Points not yet persisted for a response, oldest first"""
+        with self._lock:
+            buffer = self._buffers.get(response_id)
+            return self._full.get(response_id, []) + (buffer.points() if buffer is not None else [])
+
+    def _recorded(self):
+        if not self.persist_seconds:
+            self.flush()
+            return
+        if not self.threaded or (self._thread is not None and self._thread.is_alive()):
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='track-flush', daemon=True)
+                self._thread.start()
+                atexit.register(self.flush)
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.persist_seconds)
+            self._wakeup.clear()
+            try:
+                close_old_connections()
+                self.flush()
+            except Exception:
+                logger.exception("Track flush failed, retrying next interval")
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    """Process-wide track store"""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = TrackStore(
+                    getattr(settings, 'TRACK_BUFFER_POINTS', 256),
+                    getattr(settings, 'TRACK_PERSIST_SECONDS', 60),
+                )
+    return _store
+
+
+def recent_points(response_id, since_timestamp):
+    """Track points of a response recorded at or after since_timestamp, oldest first"""
+    from .models import ResponseTrack
+
+    points = [point for point in get_store().buffered_points(response_id) if point[0] >= since_timestamp]
+    if len(points) < 2:
+        # Buffer was just drained (or lives in another worker): use the stored tail
+        blob = ResponseTrack.objects.filter(response_id=response_id).values_list('points', flat=True).first()
+        stored = [point for point in unpack(blob) if point[0] >= since_timestamp]
+        points = sorted(stored + points, key=lambda point: point[0])
+    return points
+
+
+def start_tracking(responder_id, response_id):
+    """Start recording a responder's fixes against a response (on acceptance)"""
+    cache.set(tracked_response_key(responder_id), response_id, ACTIVE_RESPONSE_CACHE_SECONDS)
+
+
+def stop_tracking(responder_id, response_id):
+    """Stop recording and persist the rest of the track (arrival, decline)"""
+    cache.delete(tracked_response_key(responder_id))
+    return get_store().finish(response_id)
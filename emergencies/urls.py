@@ -24,4 +24,5 @@ urlpatterns = [
     # Responder Location API (for ETA)
     path('api/responder-location/<int:responder_id>/', views.api_responder_location, name='api_responder_location'),
     path('api/update-location/', views.api_update_responder_location, name='api_update_responder_location'),
+    path('api/responses/<int:response_id>/track/', views.api_response_track, name='api_response_track'),
 ]
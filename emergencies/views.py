@@ -3,9 +3,11 @@ from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from django.http import JsonResponse
 from django.utils import timezone
+from django.db import transaction
 from django.db.models import Q
 import uuid
 from .models import Emergency, EmergencyResponse, EmergencyTimeline, BystanderGuidance
+from . import outbox
 
 
 @login_required
@@ -17,25 +19,28 @@ def trigger_sos(request):
         latitude = request.POST.get('latitude')
         longitude = request.POST.get('longitude')
         
-        # Create emergency
-        emergency = Emergency.objects.create(
-            victim=request.user,
-            emergency_type=emergency_type,
-            description=description,
-            latitude=latitude,
-            longitude=longitude
-        )
-        
-        # Calculate severity
-        emergency.calculate_severity()
-        
-        # Create timeline entry
-        EmergencyTimeline.objects.create(
-            emergency=emergency,
-            event_type='sos_triggered',
-            description=f'SOS triggered by {request.user.username}',
-            actor=request.user
-        )
+        # One commit: the emergency, its timeline entry and the outbox event
+        # that dispatches volunteers (emergencies.consumers) once it's stored
+        with transaction.atomic():
+            emergency = Emergency(
+                victim=request.user,
+                emergency_type=emergency_type,
+                description=description,
+                latitude=latitude,
+                longitude=longitude
+            )
+            
+            # Calculate severity (saves the new emergency)
+            emergency.calculate_severity()
+            
+            # Create timeline entry
+            EmergencyTimeline.objects.create(
+                emergency=emergency,
+                event_type='sos_triggered',
+                description=f'SOS triggered by {request.user.username}',
+                actor=request.user
+            )
+            outbox.emit('sos_triggered', emergency, request.user)
         
         messages.success(request, 'SOS triggered! Notifying nearby responders...')
         return redirect('emergencies:emergency_detail', emergency_id=emergency.emergency_id)
@@ -146,31 +151,58 @@ def bystander_guidance(request, emergency_id):
 
 
 def api_active_emergencies(request):
-    """API: Get active emergencies (for map updates)"""
-    emergencies = Emergency.objects.filter(
-        status__in=['active', 'responder_assigned', 'responder_en_route']
-    )
+    """
+    API: Get active emergencies (for map updates)
+    Serves a shared pre-encoded snapshot with a strong ETag; pollers that
+    already hold the current version get 304 Not Modified.
+    Query params:
+      bbox=min_lon,min_lat,max_lon,max_lat  only this viewport
+      zoom=<map zoom>  with bbox, below snapshots.CLUSTER_MAX_ZOOM returns
+                       grid clusters instead of individual emergencies
+      since=<cursor>   only emergencies added, changed or removed after
+                       that cursor, unless it is too old to resync from
+    """
+    from django.http import HttpResponse, HttpResponseNotModified
+    from django.utils.http import parse_etags
+    from .geo import parse_bbox
+    from . import snapshots
     
-    data = []
-    for emergency in emergencies:
-        data.append({
-            'emergency_id': str(emergency.emergency_id),
-            'emergency_type': emergency.emergency_type,
-            'emergency_type_display': emergency.get_emergency_type_display(),
-            'severity': emergency.severity,
-            'status': emergency.status,
-            'status_display': emergency.get_status_display(),
-            'latitude': float(emergency.latitude),
-            'longitude': float(emergency.longitude),
-            'triggered_at': emergency.triggered_at.isoformat()
-        })
+    bbox = None
+    if 'bbox' in request.GET:
+        bbox = parse_bbox(request.GET['bbox'])
+        if bbox is None:
+            return JsonResponse({'error': 'bbox must be min_lon,min_lat,max_lon,max_lat'}, status=400)
     
-    return JsonResponse({'emergencies': data})
+    try:
+        zoom = int(request.GET['zoom']) if 'zoom' in request.GET else None
+        since = int(request.GET['since']) if 'since' in request.GET else None
+    except ValueError:
+        return JsonResponse({'error': 'zoom and since must be integers'}, status=400)
+    
+    if bbox is not None and zoom is not None and zoom < snapshots.CLUSTER_MAX_ZOOM:
+        etag, body = snapshots.active_clusters(bbox, zoom)
+    else:
+        if since is not None:
+            delta = snapshots.active_delta(since, bbox)
+            if delta is not None:
+                return JsonResponse(delta)
+        etag, body = snapshots.active_snapshot(bbox)
+    
+    if etag in parse_etags(request.headers.get('If-None-Match', '')):
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(body, content_type='application/json')
+    response['ETag'] = etag
+    # Let browsers keep the body but revalidate on every poll
+    response['Cache-Control'] = 'no-cache'
+    return response
 
 
 def api_emergency_status(request, emergency_id):
     """API: Get emergency status"""
-    emergency = get_object_or_404(Emergency, emergency_id=emergency_id)
+    from .eta import estimate
+    
+    emergency = get_object_or_404(Emergency.objects.select_related('primary_responder'), emergency_id=emergency_id)
     
     data = {
         'emergency_id': str(emergency.emergency_id),
@@ -180,9 +212,13 @@ def api_emergency_status(request, emergency_id):
     }
     
     if emergency.primary_responder:
+        eta = estimate(emergency.primary_responder_id, emergency)
         data['primary_responder'] = {
             'name': emergency.primary_responder.username,
-            'eta': 5  # Mock ETA
+            # Minutes, None until the responder's location is known
+            'eta': eta['minutes'] if eta else None,
+            'distance_km': eta['distance_km'] if eta else None,
+            'location_updated_at': eta['fix_at'] if eta else None,
         }
     
     return JsonResponse(data)
@@ -198,20 +234,40 @@ def api_push_subscribe(request):
     
     import json
     from .models import PushSubscription
+    from .subscriptions import MAX_RADIUS_KM
     
     try:
         data = json.loads(request.body)
         subscription_info = data.get('subscription')
         user_agent = data.get('user_agent', '')
         
+        # Notification area centre: sent position, else last known location
+        latitude, longitude = data.get('latitude'), data.get('longitude')
+        if latitude is None or longitude is None:
+            latitude, longitude = request.user.latitude, request.user.longitude
+        
+        defaults = {
+            'subscription_info': subscription_info,
+            'user_agent': user_agent,
+            'is_active': True,
+            'latitude': latitude,
+            'longitude': longitude,
+        }
+        if data.get('radius_km') is not None:
+            try:
+                radius_km = float(data['radius_km'])
+            except (TypeError, ValueError):
+                radius_km = None
+            if radius_km is None or not 0 < radius_km <= MAX_RADIUS_KM:
+                return JsonResponse(
+                    {'error': f'radius_km must be a number above 0 and at most {MAX_RADIUS_KM}'}, status=400,
+                )
+            defaults['notification_radius_km'] = radius_km
+        
         # Create or update subscription
         subscription, created = PushSubscription.objects.update_or_create(
             user=request.user,
-            defaults={
-                'subscription_info': subscription_info,
-                'user_agent': user_agent,
-                'is_active': True
-            }
+            defaults=defaults
         )
         
         return JsonResponse({
@@ -226,27 +282,48 @@ def api_push_subscribe(request):
 
 def api_responder_location(request, responder_id):
     """API: Get responder's current location for ETA calculation"""
-    from .models import ResponderLocation
     from django.contrib.auth import get_user_model
+    from .locations import latest_fix
     
     User = get_user_model()
     
-    try:
-        responder = User.objects.get(id=responder_id)
-        location = ResponderLocation.objects.filter(responder=responder).first()
-        
-        if location:
-            return JsonResponse({
-                'latitude': float(location.latitude),
-                'longitude': float(location.longitude),
-                'accuracy': location.accuracy,
-                'updated_at': location.updated_at.isoformat()
-            })
-        else:
-            return JsonResponse({'error': 'Location not available'}, status=404)
-    
-    except User.DoesNotExist:
+    if not User.objects.filter(id=responder_id).exists():
         return JsonResponse({'error': 'Responder not found'}, status=404)
+    
+    # Buffered fixes are newer than the ResponderLocation row
+    fix = latest_fix(responder_id)
+    if fix is None:
+        return JsonResponse({'error': 'Location not available'}, status=404)
+    
+    return JsonResponse({
+        'latitude': fix.latitude,
+        'longitude': fix.longitude,
+        'accuracy': fix.accuracy,
+        'updated_at': fix.recorded_at.isoformat()
+    })
+
+
+@login_required
+def api_response_track(request, response_id):
+    """API: Recorded route of a responder to an emergency (post-incident replay)"""
+    from .models import ResponseTrack
+    
+    track = get_object_or_404(
+        ResponseTrack.objects.select_related('response__emergency'), response_id=response_id
+    )
+    response = track.response
+    if not (request.user.is_staff or request.user.id in (response.responder_id, response.emergency.victim_id)):
+        return JsonResponse({'error': 'Not allowed'}, status=403)
+    
+    return JsonResponse({
+        'response_id': response.id,
+        'distance_km': round(track.distance_km, 3),
+        'started_at': track.started_at.isoformat() if track.started_at else None,
+        'ended_at': track.ended_at.isoformat() if track.ended_at else None,
+        'raw_point_count': track.raw_point_count,
+        # [unix time, latitude, longitude]
+        'points': [[round(t, 1), lat, lon] for t, lat, lon, _ in track.decoded_points()],
+    })
 
 
 @login_required
@@ -255,27 +332,18 @@ def api_update_responder_location(request):
     if request.method != 'POST':
         return JsonResponse({'error': 'POST required'}, status=405)
     
-    from .models import ResponderLocation
+    from .locations import parse_fix, record_responder_fix
     import json
     
     try:
         data = json.loads(request.body)
-        latitude = data.get('latitude')
-        longitude = data.get('longitude')
-        accuracy = data.get('accuracy')
-        
-        if not latitude or not longitude:
+        try:
+            fix = parse_fix(data)
+        except (KeyError, TypeError, ValueError):
             return JsonResponse({'error': 'Latitude and longitude required'}, status=400)
         
-        # Update or create location
-        location, created = ResponderLocation.objects.update_or_create(
-            responder=request.user,
-            defaults={
-                'latitude': latitude,
-                'longitude': longitude,
-                'accuracy': accuracy
-            }
-        )
+        # Buffered; written to ResponderLocation in the next batch
+        record_responder_fix(request.user.id, fix)
         
         return JsonResponse({
             'success': True,
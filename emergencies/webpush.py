@@ -0,0 +1,198 @@
+"""
+Web push fan-out
+Sends encrypted web pushes for a dispatch decision to every active
+PushSubscription of the selected users, and to every subscription whose
+notification area covers the emergency. Sends run on a bounded thread
+pool so notify_responders never waits on push services; each worker
+keeps its own HTTP session, so connections to a push service are reused
+across pushes. VAPID headers are signed once per push-service origin and
+reused until shortly before they expire, instead of once per push.
+Subscriptions the push service reports as gone (404 / 410) are marked
+inactive.
+
+Needs pywebpush and VAPID_PRIVATE_KEY; without them pushes are skipped
+and alerts still reach volunteers over SSE / polling.
+"""
+
+import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.db import connection
+
+try:
+    import requests
+    from py_vapid import Vapid
+    from pywebpush import WebPusher
+except ImportError:  # pragma: no cover - optional dependency
+    WebPusher = None
+
+logger = logging.getLogger(__name__)
+
+VAPID_TOKEN_SECONDS = 12 * 60 * 60
+# Re-sign this long before a cached VAPID token expires
+VAPID_REFRESH_MARGIN_SECONDS = 60 * 60
+GONE_STATUSES = (404, 410)
+
+
+def endpoint_origin(endpoint):
+    parts = urlsplit(endpoint)
+    return f'{parts.scheme}://{parts.netloc}'
+
+
+class VapidSigner:
+    """VAPID Authorization headers, signed once per push-service origin"""
+
+    def __init__(self, private_key, claims):
+        self._vapid = Vapid.from_pem(private_key.encode())
+        self._claims = dict(claims)
+        self._lock = threading.Lock()
+        self._headers = {}
+
+    def headers_for(self, endpoint):
+        origin = endpoint_origin(endpoint)
+        now = time.time()
+        cached = self._headers.get(origin)
+        if cached is None or cached[1] - now < VAPID_REFRESH_MARGIN_SECONDS:
+            with self._lock:
+                cached = self._headers.get(origin)
+                if cached is None or cached[1] - now < VAPID_REFRESH_MARGIN_SECONDS:
+                    expires = int(now) + VAPID_TOKEN_SECONDS
+                    headers = self._vapid.sign(dict(self._claims, aud=origin, exp=expires))
+                    cached = self._headers[origin] = (headers, expires)
+        return dict(cached[0])
+
+
+def deactivate(subscription_id):
+    """Mark a subscription the push service no longer knows as inactive"""
+    from .models import PushSubscription
+
+    try:
+        PushSubscription.objects.filter(pk=subscription_id).update(is_active=False)
+    finally:
+        # Pool threads are long-lived, don't let them hold connections open
+        connection.close()
+
+
+class PushSender:
+    """Bounded pool that delivers pushes concurrently"""
+
+    def __init__(self, signer, max_workers, timeout, ttl):
+        self.signer = signer
+        self.timeout = timeout
+        self.ttl = ttl
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='webpush')
+        self._local = threading.local()
+
+    def _session(self):
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._local.session = requests.Session()
+        return session
+
+    def send(self, subscriptions, payloads):
+        """
+        Queue one push per (subscription_id, subscription_info, user_id)
+        with payloads[user_id]. Returns the futures (True when delivered).
+        """
+        return [
+            self._executor.submit(self._send_one, subscription_id, info, payloads[user_id])
+            for subscription_id, info, user_id in subscriptions
+        ]
+
+    def _send_one(self, subscription_id, info, data):
+        try:
+            response = WebPusher(info, requests_session=self._session()).send(
+                data,
+                headers=self.signer.headers_for(info['endpoint']),
+                ttl=self.ttl,
+                content_encoding='aes128gcm',
+                timeout=self.timeout,
+            )
+        except Exception:
+            logger.warning("Push to subscription %s failed", subscription_id, exc_info=True)
+            return False
+
+        if response.status_code in GONE_STATUSES:
+            logger.info("Push subscription %s expired, deactivating", subscription_id)
+            deactivate(subscription_id)
+            return False
+        if response.status_code >= 400:
+            logger.warning(
+                "Push service rejected subscription %s: %s %s",
+                subscription_id, response.status_code, response.text[:200],
+            )
+            return False
+        return True
+
+
+_sender = None
+_sender_ready = False
+_sender_lock = threading.Lock()
+
+
+def get_sender():
+    """Process-wide push sender, or None if web push isn't available"""
+    global _sender, _sender_ready
+    if not _sender_ready:
+        with _sender_lock:
+            if not _sender_ready:
+                if WebPusher is None or not getattr(settings, 'VAPID_PRIVATE_KEY', None):
+                    logger.info("Web push disabled: pywebpush or VAPID_PRIVATE_KEY missing")
+                else:
+                    try:
+                        signer = VapidSigner(settings.VAPID_PRIVATE_KEY, getattr(settings, 'VAPID_CLAIMS', {}))
+                    except Exception:
+                        logger.exception("Web push disabled: VAPID_PRIVATE_KEY can't be loaded")
+                    else:
+                        _sender = PushSender(
+                            signer,
+                            max_workers=getattr(settings, 'WEBPUSH_MAX_WORKERS', 64),
+                            timeout=getattr(settings, 'WEBPUSH_TIMEOUT_SECONDS', 10),
+                            ttl=getattr(settings, 'WEBPUSH_TTL_SECONDS', 300),
+                        )
+                _sender_ready = True
+    return _sender
+
+
+def emergency_payload(emergency, distance_km=None):
+    """JSON body the service worker turns into an alert notification"""
+    return json.dumps({
+        'emergency_id': str(emergency.emergency_id),
+        'emergency_type': emergency.get_emergency_type_display(),
+        'severity': emergency.get_severity_display(),
+        'distance': f'{distance_km:.1f} km away' if distance_km is not None else None,
+    })
+
+
+def push_emergency(emergency, distances=None, nearby=True):
+    """
+    Push an emergency to every active subscription of the users in
+    distances ({user_id: distance_km or None}) and, with nearby, to the
+    subscriptions whose notification area covers it. Returns the queued
+    futures.
+    """
+    from .models import PushSubscription
+    from .subscriptions import subscribers_near
+
+    sender = get_sender()
+    if sender is None:
+        return []
+    distances = dict(distances or {})
+    subscriptions = {}
+    if distances:
+        for subscription_id, info, user_id in PushSubscription.objects.filter(
+            user_id__in=list(distances), is_active=True,
+        ).values_list('id', 'subscription_info', 'user_id'):
+            subscriptions[subscription_id] = (subscription_id, info, user_id)
+    if nearby:
+        for subscription_id, info, user_id, distance in subscribers_near(emergency.latitude, emergency.longitude):
+            if user_id != emergency.victim_id:
+                subscriptions.setdefault(subscription_id, (subscription_id, info, user_id))
+                distances.setdefault(user_id, distance)
+    payloads = {user_id: emergency_payload(emergency, distance) for user_id, distance in distances.items()}
+    return sender.send(list(subscriptions.values()), payloads)
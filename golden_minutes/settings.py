@@ -104,6 +104,24 @@ else:
         }
     }
 
+# Cache
+# Latest responder fixes, tracked responses, ETAs and map snapshots are shared
+# through the cache. If REDIS_URL is set, every worker uses Redis; else each
+# process has its own memory cache, which is only right for a single worker.
+if 'REDIS_URL' in os.environ:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['REDIS_URL'],
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -196,7 +214,59 @@ CORS_ALLOW_CREDENTIALS = True
 # Emergency System Configuration
 EMERGENCY_RADIUS_KM = 5  # Search radius for nearby responders
 EMERGENCY_TIMEOUT_MINUTES = 5  # Time before activating bystander mode
+ESCALATION_POLICY = {  # Per-severity ladder; stage 0 is the SOS dispatch, 'after' is seconds since the SOS
+    'critical': [
+        {'after': 0, 'k': 5, 'radius_km': 3},
+        {'after': 30, 'k': 10, 'radius_km': 6},
+        {'after': 60, 'k': 10, 'radius_km': 10, 'min_role_level': 'medical'},
+        {'after': 120, 'bystander': True},
+    ],
+    'high': [
+        {'after': 0, 'k': 5, 'radius_km': 3},
+        {'after': 60, 'k': 10, 'radius_km': 6},
+        {'after': 120, 'k': 10, 'radius_km': 10, 'min_role_level': 'medical'},
+        {'after': 240, 'bystander': True},
+    ],
+    'moderate': [
+        {'after': 0, 'k': 5, 'radius_km': 3},
+        {'after': 120, 'k': 10, 'radius_km': 5},
+        {'after': 300, 'bystander': True},
+    ],
+}  # Severities not listed: one dispatch, bystander mode after EMERGENCY_TIMEOUT_MINUTES
+ESCALATION_IN_PROCESS = True  # Fire escalation deadlines from a thread in each web process
+ESCALATION_TICK_SECONDS = 1  # Timer wheel resolution
+ESCALATION_RETRY_SECONDS = 5  # Delay before a failed escalation stage is run again
+ESCALATION_RESCAN_SECONDS = 15  # run_escalation_worker: how often to pick up new emergencies
+OUTBOX_IN_PROCESS = True  # Deliver lifecycle events from a thread in each web process, woken on commit
+OUTBOX_POLL_SECONDS = 5  # How often dispatchers look for events left over or due for retry
+OUTBOX_BATCH_SIZE = 100  # Events fetched per dispatcher query
+OUTBOX_CLAIM_SECONDS = 60  # A claimed event not delivered within this long is picked up again
+OUTBOX_MAX_ATTEMPTS = 10  # Failed events are retried with backoff, then left for inspection
+OUTBOX_RETENTION_DAYS = 7  # Delivered events are deleted after this long
+BADGE_RULES_TTL_SECONDS = 60  # Compiled badge rules are reloaded this often, so Badge edits reach every process
+RESPONDER_RECOMPUTE_DELAY_SECONDS = 1  # Badge re-checks queued for one responder within this window run once
+LEADERBOARD_AREA_CELL_DEG = 0.1  # Area (~11 km cell) of the per-area leaderboards
 MAX_RESPONDERS_TO_NOTIFY = 10  # Maximum responders to notify per emergency
+RESPONDER_GRID_CELL_DEG = 0.01  # Spatial index cell size (~1.1 km)
+DISPATCH_LATENCY_BUDGET_MS = 500  # Trigger-to-notify budget: road ranking stops here, slower dispatches are logged
+DISPATCH_MIN_ROLE_LEVEL = {  # Minimum volunteer role level per severity
+    'critical': 'first_aid',
+}
+LOCATION_FLUSH_SECONDS = 5  # GPS pings are buffered and written in batches this often (0 = write through)
+TRACK_BUFFER_POINTS = 256  # Route points held per responder before they are simplified and stored
+TRACK_PERSIST_SECONDS = 60  # Store buffered route points at least this often
+TRACK_SIMPLIFY_METERS = 10  # Douglas-Peucker tolerance for stored routes
+ETA_DEFAULT_SPEED_KMH = 30  # Assumed travel speed until the route track gives a measured one
+ETA_SPEED_WINDOW_SECONDS = 120  # Recent track span used to measure a responder's speed
+ETA_ROUTE_FACTOR = 1.3  # Road distance / straight-line distance
+ROUTING_GRAPH_PATH = os.environ.get('ROUTING_GRAPH_PATH')  # Road graph from build_road_graph (unset = straight-line ETAs)
+ROUTING_MAX_SNAP_KM = 0.5  # Points farther than this from any road fall back to straight-line distance
+ROUTING_MAX_MINUTES = 30  # Dispatch stops road-ranking candidates beyond this travel time
+
+# Real-time alerts (SSE / long-poll). Use 'redis' when running more than one web worker
+REALTIME_BROKER = os.environ.get('REALTIME_BROKER', 'memory')
+REALTIME_REDIS_URL = os.environ.get('REDIS_URL', 'redis://localhost:6379/0')
+ALERT_MAX_HELD_CONNECTIONS = 8  # SSE streams + long-polls held open per process; keep below gunicorn --threads
 
 # Login/Logout URLs
 LOGIN_URL = '/accounts/login/'
@@ -215,3 +285,7 @@ mJ7xE0gYQxH5tQxH5tQxH5tQxH5tQxH5tQxH5tQxH5tQxH5tQxH5tQxH5tQxH5tQ
 xH5tQxH5tQxH5tQxH5tQxH5tQxH5tQxH5tQxH5tQxH5tQxH5tQxH5tQxH5tQxH5t
 -----END PRIVATE KEY-----'''
 VAPID_CLAIMS = {'sub': 'mailto:admin@goldenminutes.com'}
+WEBPUSH_MAX_WORKERS = 64  # Concurrent push sends per process
+WEBPUSH_TIMEOUT_SECONDS = 10  # Per-push HTTP timeout
+WEBPUSH_TTL_SECONDS = 300  # Push services drop undelivered alerts after this long
+PUSH_GRID_CELL_DEG = 0.05  # Cell size (~5.5 km) of the push subscription area index
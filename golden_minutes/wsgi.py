@@ -14,3 +14,19 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "golden_minutes.settings")
 
 application = get_wsgi_application()
+
+# Background work runs only in processes that serve requests (gunicorn
+# workers, runserver): the test runner and other management commands never
+# import this module. Without --preload this runs in each worker after fork.
+from emergencies import escalation, outbox, routing  # noqa: E402
+
+# Load the road graph before the first SOS needs it
+routing.warm_up()
+
+# Rebuild pending escalation deadlines and turn the timer wheel
+if escalation.in_process():
+    escalation.start()
+
+# Deliver outbox events, including any left from before a restart
+if outbox.in_process():
+    outbox.start()
@@ -0,0 +1,79 @@
+"""
+Emergency acceptance
+When several volunteers tap Accept at once exactly one may win. The claim
+is a single conditional UPDATE that only matches while the emergency is
+still active and unassigned: the database serialises the racing
+statements and every loser's UPDATE simply matches no row. Only the
+winner writes the response, timeline, live map and analytics bookkeeping
+and the outbox event (stats follow from it), inside the same short
+transaction, so losers never queue behind more than one claim.
+"""
+
+from django.db import transaction
+from django.utils import timezone
+
+from emergencies import escalation, outbox, rollups, snapshots, tracks
+from emergencies.models import Emergency, EmergencyResponse, EmergencyTimeline
+
+from . import stats as responder_stats
+
+
+def accept(emergency, responder):
+    """
+    Make responder the emergency's primary responder. Returns the accepted
+    EmergencyResponse, or None if the emergency was no longer available.
+    """
+    accepted_at = timezone.now()
+    old_key = Emergency.make_rollup_key(emergency.emergency_type, emergency.severity, 'active', None, None)
+
+    with transaction.atomic():
+        claimed = Emergency.objects.filter(
+            pk=emergency.pk, status='active', primary_responder__isnull=True,
+        ).update(
+            primary_responder=responder,
+            status='responder_assigned',
+            responder_accepted_at=accepted_at,
+            updated_at=accepted_at,
+        )
+        if not claimed:
+            return None
+
+        emergency.primary_responder = responder
+        emergency.status = 'responder_assigned'
+        emergency.responder_accepted_at = accepted_at
+        emergency.updated_at = accepted_at
+
+        # update() skips save() and its signals: stamp the live map change and
+        # move the analytics count by hand, for the winner only
+        snapshots.invalidate([emergency.pk])
+        new_key = emergency.rollup_key()
+        rollups.record_change(emergency.triggered_at, old_key, new_key)
+        emergency._rollup_key = new_key
+
+        response, created = EmergencyResponse.objects.get_or_create(
+            emergency=emergency,
+            responder=responder,
+            defaults={'status': 'accepted', 'responded_at': accepted_at},
+        )
+        if not created:
+            response.status = 'accepted'
+            response.responded_at = accepted_at
+            response.save(update_fields=['status', 'responded_at'])
+
+        EmergencyTimeline.objects.create(
+            emergency=emergency,
+            event_type='responder_accepted',
+            description=f'{responder.username} accepted the emergency',
+            actor=responder,
+        )
+        # Stats delta: response time runs from the SOS to accepting, as in
+        # ResponderStats.recalculate
+        outbox.emit(
+            'responder_accepted', emergency, responder,
+            response_minutes=responder_stats.minutes_between(emergency.triggered_at, accepted_at),
+        )
+
+    escalation.cancel_escalation(emergency)
+    # Record the route from here to the emergency
+    tracks.start_tracking(responder.id, response.id)
+    return response
@@ -0,0 +1,61 @@
+"""
+Helpers for volunteer alert delivery (polling, long-polling and SSE)
+"""
+
+import threading
+
+from django.conf import settings
+
+
+def volunteer_area(user):
+    """
+    (latitude, longitude, radius_km) a volunteer wants alerts for.
+    Uses the latest responder GPS fix when available, otherwise the last
+    known location stored on the user. Returns None if nothing is known.
+    """
+    from emergencies.locations import latest_fix
+    from .models import VolunteerProfile
+
+    try:
+        radius_km = user.volunteer_profile.availability_radius_km
+    except VolunteerProfile.DoesNotExist:
+        radius_km = getattr(settings, 'EMERGENCY_RADIUS_KM', 5)
+
+    fix = latest_fix(user.id)
+    if fix:
+        return fix.latitude, fix.longitude, radius_km
+
+    if user.latitude is not None and user.longitude is not None:
+        return float(user.latitude), float(user.longitude), radius_km
+
+    return None
+
+
+def alert_payload(event, distance_km=None):
+    """JSON body shared by check_new_emergencies and the SSE stream"""
+    return {
+        'has_new': True,
+        'id': event['id'],
+        'location': event['location'],
+        'type': event['type'],
+        'distance': f"{distance_km:.1f} km" if distance_km is not None else "Calculating...",
+        'timestamp': event['timestamp'],
+    }
+
+
+_held_slots = None
+_held_slots_lock = threading.Lock()
+
+
+def held_connection_slots():
+    """
+    Process-wide cap on alert streams and long-polls held open at once.
+    Each one pins a worker thread, so ALERT_MAX_HELD_CONNECTIONS must stay
+    below the server's thread count or open tabs starve other requests.
+    """
+    global _held_slots
+    if _held_slots is None:
+        with _held_slots_lock:
+            if _held_slots is None:
+                _held_slots = threading.BoundedSemaphore(getattr(settings, 'ALERT_MAX_HELD_CONNECTIONS', 8))
+    return _held_slots
@@ -8,3 +8,5 @@ class RespondersConfig(AppConfig):
     def ready(self):
         # Import signals to register them
         import responders.signals
+        # Register outbox consumers
+        import responders.consumers
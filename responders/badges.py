@@ -0,0 +1,171 @@
+"""
+Compiled badge rule engine
+
+Badge rows are compiled once into one sorted threshold table per stats
+metric. When a metric changes only that metric's table is consulted, and
+a bisect up to the new value yields every badge it now qualifies for.
+Awards add points, which can unlock points/level badges in turn, so
+evaluation repeats for the metrics an award changed until nothing new
+is earned. The caller saves the stats row once for the whole evaluation.
+
+Each process keeps its compiled tables for BADGE_RULES_TTL_SECONDS. A
+Badge change recompiles them at once in the process that made it; other
+processes (web workers, standalone dispatchers) pick it up when their
+copy expires.
+"""
+
+import bisect
+import logging
+import threading
+import time
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# requirement_type -> (ResponderStats attribute, higher value is better)
+BADGE_METRICS = {
+    'total_responses': ('total_responses', True),
+    'completed_responses': ('completed_responses', True),
+    'lives_saved': ('lives_saved', True),
+    'rating': ('rating', True),
+    'streak': ('current_streak', True),
+    'current_streak': ('current_streak', True),
+    'level': ('level', True),
+    'points': ('total_points', True),
+    'response_time': ('average_response_time', False),
+    'avg_response_time': ('average_response_time', False),
+    'fastest_response': ('fastest_response', False),
+}
+
+# Stats fields written when badges are awarded
+AWARD_FIELDS = ['badges', 'total_points', 'level', 'updated_at']
+
+
+class RuleTable:
+    """Badges for one metric, sorted so qualifying ones form a prefix"""
+
+    def __init__(self, higher_is_better):
+        self.higher_is_better = higher_is_better
+        self.keys = []
+        self.badges = []
+
+    def add(self, badge):
+        # Lower-is-better thresholds are negated so both kinds sort ascending
+        key = badge.requirement_value if self.higher_is_better else -badge.requirement_value
+        index = bisect.bisect_right(self.keys, key)
+        self.keys.insert(index, key)
+        self.badges.insert(index, badge)
+
+    def qualifying(self, value):
+        """Badges whose requirement is met by value"""
+        key = value if self.higher_is_better else -value
+        return self.badges[:bisect.bisect_right(self.keys, key)]
+
+
+_rules = None
+_rules_loaded_at = 0.0
+_rules_generation = 0
+_rules_lock = threading.Lock()
+
+
+def compile_rules():
+    """Metric attribute -> RuleTable for the current Badge rows"""
+    from .models import Badge
+
+    rules = {}
+    for badge in Badge.objects.only(
+        'badge_id', 'name', 'requirement_type', 'requirement_value', 'points_reward'
+    ):
+        metric = BADGE_METRICS.get(badge.requirement_type)
+        if metric is None:
+            # Awarded elsewhere (training, special events)
+            continue
+        attribute, higher_is_better = metric
+        rules.setdefault(attribute, RuleTable(higher_is_better)).add(badge)
+    return rules
+
+
+def _rules_stale():
+    ttl = getattr(settings, 'BADGE_RULES_TTL_SECONDS', 60)
+    return _rules is None or time.monotonic() - _rules_loaded_at >= ttl
+
+
+def compiled_rules():
+    """Metric attribute -> RuleTable, cached per process (see module docstring)"""
+    global _rules, _rules_loaded_at
+    rules = _rules
+    if rules is None or _rules_stale():
+        with _rules_lock:
+            rules = _rules
+            if rules is None or _rules_stale():
+                generation = _rules_generation
+                rules = compile_rules()
+                # Don't cache tables an invalidation raced past while compiling
+                if generation == _rules_generation:
+                    _rules, _rules_loaded_at = rules, time.monotonic()
+    # The local copy: an invalidation may reset _rules at any moment
+    return rules
+
+
+def invalidate_rules():
+    """Drop the compiled tables (called when Badge rows change)"""
+    global _rules, _rules_generation
+    _rules_generation += 1
+    _rules = None
+
+
+def metric_value(stats, attribute):
+    """Current value of a metric, or None while it isn't meaningful yet"""
+    if attribute == 'average_response_time' and not stats.response_time_count:
+        return None
+    return getattr(stats, attribute)
+
+
+def evaluate(stats, changed=None):
+    """
+    Award every newly earned badge to `stats` in memory.
+    `changed` is an iterable of metric attributes that moved; None checks
+    all of them. Returns the awarded Badge objects; the caller saves.
+    """
+    rules = compiled_rules()
+    pending = set(rules) if changed is None else set(changed) & set(rules)
+    earned = set(stats.badges)
+    awarded = []
+
+    while pending:
+        attribute = pending.pop()
+        value = metric_value(stats, attribute)
+        if value is None:
+            continue
+
+        points = 0
+        for badge in rules[attribute].qualifying(value):
+            if badge.badge_id in earned:
+                continue
+            earned.add(badge.badge_id)
+            stats.badges.append(badge.badge_id)
+            points += badge.points_reward
+            awarded.append(badge)
+
+        if points:
+            old_level = stats.level
+            stats.total_points += points
+            stats.level = (stats.total_points // 100) + 1
+            # Points (and maybe level) moved, so their badges need another look
+            pending.add('total_points')
+            if stats.level != old_level:
+                pending.add('level')
+            pending &= set(rules)
+
+    return awarded
+
+
+def award_badges(stats, changed=None):
+    """Evaluate and persist all awards with a single save"""
+    awarded = evaluate(stats, changed)
+    if awarded:
+        stats.save(update_fields=AWARD_FIELDS)
+        for badge in awarded:
+            logger.info("Badge earned: %s by responder %s", badge.name, stats.responder_id)
+    return awarded
@@ -0,0 +1,21 @@
+"""
+Outbox consumers that keep ResponderStats current (see emergencies.outbox)
+"""
+
+from emergencies.outbox import consumer
+
+from . import stats as responder_stats
+
+
+@consumer('responder_accepted')
+def count_acceptance(event):
+    if event.actor_id is None:
+        return
+    responder_stats.record_acceptance(event.actor_id, event.payload.get('response_minutes'))
+
+
+@consumer('responder_arrived')
+def count_arrival(event):
+    if event.actor_id is None:
+        return
+    responder_stats.record_arrival(event.actor_id, event.payload.get('arrival_minutes'))
@@ -1,89 +1,178 @@
+import time
+from concurrent.futures import ProcessPoolExecutor
+
 from django.core.management.base import BaseCommand
+from django.db import connections, transaction
+from django.utils import timezone
+from responders import rankings
+from responders.badges import AWARD_FIELDS, evaluate
 from responders.models import ResponderStats, Badge
 
+# Columns the rule engine reads, plus what is written back
+STATS_FIELDS = [
+    'responder__username', 'badges', 'total_points', 'level', 'area_cell',
+    'total_responses', 'completed_responses', 'lives_saved', 'rating', 'current_streak',
+    'average_response_time', 'response_time_count', 'fastest_response', 'updated_at',
+]
+
+
+def stats_queryset():
+    return ResponderStats.objects.select_related('responder').only(*STATS_FIELDS).order_by('pk')
+
+
+def lock_chunk(stats_rows):
+    """
+    Lock the chunk's rows for the rest of the transaction. Rows written
+    since they were read (updated_at moved) are re-read under the lock,
+    so live acceptances and resolutions are never overwritten.
+    """
+    current = dict(
+        ResponderStats.objects.select_for_update()
+        .filter(pk__in=[stats.pk for stats in stats_rows])
+        .values_list('pk', 'updated_at')
+    )
+    stale = [stats.pk for stats in stats_rows if current.get(stats.pk) != stats.updated_at]
+    if not stale:
+        return stats_rows
+    fresh = stats_queryset().in_bulk(stale)
+    return [fresh.get(stats.pk, stats) for stats in stats_rows if stats.pk in current]
+
+
+def award_chunk(stats_rows):
+    """Evaluate badge rules against the locked chunk and write it back in one batch"""
+    now = timezone.now()
+    changed = []
+    lines = []
+    awarded_total = 0
+
+    with transaction.atomic(using=ResponderStats.objects.db):
+        for stats in lock_chunk(stats_rows):
+            awarded = evaluate(stats)
+            if not awarded:
+                continue
+            stats.updated_at = now
+            changed.append(stats)
+            awarded_total += len(awarded)
+            for badge in awarded:
+                lines.append(f'  ✅ {stats.responder.username}: Earned "{badge.name}" (+{badge.points_reward} pts)')
+
+        if changed:
+            write_awards(changed)
+    return len(stats_rows), awarded_total, lines
+
+
+def write_awards(stats_rows):
+    """
+    Write awarded badges/points back in one batched statement.
+    Equivalent to bulk_update(stats_rows, AWARD_FIELDS), but executemany
+    avoids building a CASE expression per row, which dominated run time.
+    The caller holds the rows' locks (see lock_chunk). Bypasses post_save,
+    so the leaderboard trees are moved here, once the chunk commits.
+    """
+    meta = ResponderStats._meta
+    fields = [meta.get_field(name) for name in AWARD_FIELDS]
+    connection = connections[ResponderStats.objects.db]
+    quote = connection.ops.quote_name
+
+    assignments = ', '.join(f'{quote(field.column)} = %s' for field in fields)
+    sql = f'UPDATE {quote(meta.db_table)} SET {assignments} WHERE {quote(meta.pk.column)} = %s'
+    params = [
+        [field.get_db_prep_save(getattr(stats, field.attname), connection) for field in fields] + [stats.pk]
+        for stats in stats_rows
+    ]
+    changes = []
+    with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+        cursor.executemany(sql, params)
+        for stats in stats_rows:
+            new_key = stats.leaderboard_key()
+            changes.append((stats._leaderboard_key, new_key))
+            stats._leaderboard_key = new_key
+        rankings.record_change_on_commit(*changes)
+
+
+def award_pk_range(pk_range):
+    """Process-pool entry point: award badges for stats rows with pk in [first, last]"""
+    import django
+    from django.apps import apps
+
+    if not apps.ready:
+        django.setup()
+    first, last = pk_range
+    return award_chunk(list(stats_queryset().filter(pk__gte=first, pk__lte=last)))
+
 
 class Command(BaseCommand):
     help = 'Award badges to all volunteers based on their current stats'
 
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=2000,
+                            help='Stats rows read and written per batch')
+        parser.add_argument('--workers', type=int, default=1,
+                            help='Spread chunks across this many processes (use with PostgreSQL)')
+
     def handle(self, *args, **options):
         self.stdout.write(self.style.SUCCESS('🎯 Starting badge award process...'))
-        
-        # Get all responder stats
-        all_stats = ResponderStats.objects.all()
-        total_volunteers = all_stats.count()
-        
+        self.verbose = options['verbosity'] > 1
+        chunk_size = options['chunk_size']
+
+        total_volunteers = ResponderStats.objects.count()
         self.stdout.write(f'Found {total_volunteers} volunteers')
-        
-        # Get all badges
-        all_badges = Badge.objects.all()
-        total_badges = all_badges.count()
-        
-        self.stdout.write(f'Found {total_badges} badges to check')
+        self.stdout.write(f'Found {Badge.objects.count()} badges to check')
         self.stdout.write('-' * 60)
-        
-        total_awarded = 0
-        
-        # Check each volunteer
-        for stats in all_stats:
-            volunteer_name = stats.responder.username
-            badges_awarded = 0
-            
-            # Check each badge
-            for badge in all_badges:
-                # Skip if already earned
-                if badge.badge_id in stats.badges:
-                    continue
-                
-                # Check if requirements are met
-                if self.check_badge_requirement(stats, badge):
-                    # Award the badge
-                    stats.earn_badge(badge.badge_id, badge.points_reward)
-                    badges_awarded += 1
-                    total_awarded += 1
-                    
-                    self.stdout.write(
-                        self.style.SUCCESS(
-                            f'  ✅ {volunteer_name}: Earned "{badge.name}" (+{badge.points_reward} pts)'
-                        )
-                    )
-            
-            if badges_awarded == 0:
-                self.stdout.write(f'  ⏭️  {volunteer_name}: No new badges')
-        
+
+        self.started = time.monotonic()
+        self.processed = 0
+        self.total_awarded = 0
+
+        if options['workers'] > 1:
+            self.run_parallel(chunk_size, options['workers'])
+        else:
+            self.run_serial(chunk_size)
+
+        elapsed = time.monotonic() - self.started
         self.stdout.write('-' * 60)
         self.stdout.write(
             self.style.SUCCESS(
-                f'✅ Complete! Awarded {total_awarded} badges to {total_volunteers} volunteers'
+                f'✅ Complete! Awarded {self.total_awarded} badges to {self.processed} volunteers '
+                f'in {elapsed:.1f}s ({self.rate():.0f} rows/s)'
             )
         )
-    
-    def check_badge_requirement(self, stats, badge):
-        """Check if a responder meets the requirements for a badge"""
-        req_type = badge.requirement_type
-        req_value = badge.requirement_value
-        
-        if req_type == 'total_responses':
-            return stats.total_responses >= req_value
-        
-        elif req_type == 'lives_saved':
-            return stats.lives_saved >= req_value
-        
-        elif req_type == 'response_time':
-            return stats.average_response_time <= req_value
-        
-        elif req_type == 'streak':
-            return stats.current_streak >= req_value
-        
-        elif req_type == 'rating':
-            return stats.rating >= req_value
-        
-        elif req_type == 'completed_responses':
-            return stats.completed_responses >= req_value
-        
-        elif req_type == 'level':
-            return stats.level >= req_value
-        
-        elif req_type == 'points':
-            return stats.total_points >= req_value
-        
-        return False
+
+    def run_serial(self, chunk_size):
+        chunk = []
+        for stats in stats_queryset().iterator(chunk_size=chunk_size):
+            chunk.append(stats)
+            if len(chunk) >= chunk_size:
+                self.report(award_chunk(chunk))
+                chunk = []
+        if chunk:
+            self.report(award_chunk(chunk))
+
+    def run_parallel(self, chunk_size, workers):
+        pks = list(ResponderStats.objects.order_by('pk').values_list('pk', flat=True))
+        ranges = [
+            (pks[i], pks[min(i + chunk_size, len(pks)) - 1])
+            for i in range(0, len(pks), chunk_size)
+        ]
+
+        # Children must open their own database connections
+        connections.close_all()
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for result in pool.map(award_pk_range, ranges):
+                self.report(result)
+
+    def report(self, result):
+        rows, awarded, lines = result
+        self.processed += rows
+        self.total_awarded += awarded
+        if self.verbose:
+            for line in lines:
+                self.stdout.write(self.style.SUCCESS(line))
+        self.stdout.write(
+            f'  {self.processed} volunteers checked, {self.total_awarded} badges awarded '
+            f'({self.rate():.0f} rows/s)'
+        )
+
+    def rate(self):
+        elapsed = time.monotonic() - self.started
+        return self.processed / elapsed if elapsed > 0 else 0
@@ -0,0 +1,113 @@
+"""
+Management command to check emergency acceptance under contention
+Run: python manage.py benchmark_acceptance --emergencies 20 --acceptors 50
+Creates throwaway volunteers and emergencies (prefixed bench_), lets every
+volunteer accept each emergency at the same instant and reports how many
+won (must be exactly one per emergency) and how long winners and losers
+waited. The rows are removed afterwards.
+"""
+
+import threading
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from emergencies.models import Emergency
+from responders import acceptance
+from responders.models import VolunteerProfile
+
+User = get_user_model()
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+class Command(BaseCommand):
+    help = 'Race concurrent acceptors against each emergency and report winners and latency'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--emergencies', type=int, default=20)
+        parser.add_argument('--acceptors', type=int, default=50, help='Concurrent acceptors per emergency')
+
+    def handle(self, *args, **options):
+        acceptors = options['acceptors']
+        if connection.vendor == 'sqlite' and connection.settings_dict['NAME'] == ':memory:':
+            raise CommandError('Needs a database shared between threads')
+
+        self.stdout.write(f'🏁 {options["emergencies"]} emergencies x {acceptors} concurrent acceptors')
+        victim = User.objects.create_user('bench_victim', password=None, role='victim')
+        volunteers = []
+        for i in range(acceptors):
+            volunteer = User.objects.create_user(f'bench_volunteer_{i}', password=None, role='volunteer')
+            VolunteerProfile.objects.create(user=volunteer)
+            volunteers.append(volunteer)
+
+        try:
+            winners, errors = [], []
+            win_ms, lose_ms = [], []
+            started = time.monotonic()
+            for _ in range(options['emergencies']):
+                emergency = Emergency.objects.create(
+                    victim=victim, emergency_type='medical', severity='high',
+                    latitude=18.52, longitude=73.85,
+                )
+                results = self.race(emergency, volunteers, errors)
+                winners.append(sum(1 for accepted, _ in results if accepted))
+                for accepted, elapsed in results:
+                    (win_ms if accepted else lose_ms).append(elapsed * 1000)
+            total = time.monotonic() - started
+        finally:
+            Emergency.objects.filter(victim__username='bench_victim').delete()
+            User.objects.filter(username__startswith='bench_').delete()
+
+        self.stdout.write(
+            f'  {sum(winners)} accepted across {len(winners)} emergencies, {len(lose_ms)} rejected, '
+            f'{len(errors)} errors in {total:.1f}s'
+        )
+        self.stdout.write(
+            f'  Winner  p50 {percentile(win_ms, 0.5):.1f}ms  p99 {percentile(win_ms, 0.99):.1f}ms'
+        )
+        self.stdout.write(
+            f'  Loser   p50 {percentile(lose_ms, 0.5):.1f}ms  p99 {percentile(lose_ms, 0.99):.1f}ms'
+        )
+        for error in errors[:5]:
+            self.stdout.write(self.style.ERROR(f'  ❌ {error}'))
+
+        if errors or any(count != 1 for count in winners):
+            raise CommandError(f'Expected exactly one winner per emergency, got {winners}')
+        self.stdout.write(self.style.SUCCESS('✓ Exactly one winner per emergency'))
+
+    def race(self, emergency, volunteers, errors):
+        barrier = threading.Barrier(len(volunteers))
+        results = []
+        lock = threading.Lock()
+
+        def attempt(volunteer):
+            try:
+                # Each thread gets a fresh copy, as each request would
+                mine = Emergency.objects.get(pk=emergency.pk)
+                barrier.wait()
+                began = time.perf_counter()
+                accepted = acceptance.accept(mine, volunteer) is not None
+                elapsed = time.perf_counter() - began
+                with lock:
+                    results.append((accepted, elapsed))
+            except Exception as exc:
+                # Don't leave the others waiting at the barrier
+                barrier.abort()
+                with lock:
+                    errors.append(repr(exc))
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=attempt, args=(volunteer,)) for volunteer in volunteers]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
@@ -0,0 +1,15 @@
+"""
+Management command to rebuild the leaderboard from scratch
+Run: python manage.py rebuild_leaderboard
+"""
+
+from django.core.management.base import BaseCommand
+from responders import rankings
+
+
+class Command(BaseCommand):
+    help = 'Recompute leaderboard areas and rank trees from ResponderStats (backfill or drift repair)'
+
+    def handle(self, *args, **options):
+        ranked = rankings.rebuild()
+        self.stdout.write(self.style.SUCCESS(f'✓ Rebuilt leaderboard for {ranked} responders'))
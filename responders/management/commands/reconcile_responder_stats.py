@@ -0,0 +1,84 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from emergencies.models import OutboxEvent
+from responders.models import ResponderStats
+
+# Topics whose consumers move ResponderStats (see responders.consumers)
+STATS_TOPICS = ['responder_accepted', 'responder_arrived']
+
+
+class Command(BaseCommand):
+    help = 'Recompute responder statistics from history and repair any drift in the incremental counters'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=500)
+        parser.add_argument('--dry-run', action='store_true', help='Report drift without saving')
+
+    def handle(self, *args, **options):
+        self.stdout.write(self.style.SUCCESS('🔧 Reconciling responder statistics...'))
+        started = time.monotonic()
+        
+        checked = 0
+        repaired = 0
+        deferred = 0
+        
+        pks = ResponderStats.objects.order_by('pk').values_list('pk', flat=True)
+        for pk in pks.iterator(chunk_size=options['chunk_size']):
+            checked += 1
+            outcome = self.reconcile(pk, options['dry_run'])
+            if outcome == 'deferred':
+                deferred += 1
+            elif outcome == 'repaired':
+                repaired += 1
+        
+        elapsed = time.monotonic() - started
+        verb = 'Found' if options['dry_run'] else 'Repaired'
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'✅ Checked {checked} responders in {elapsed:.1f}s. {verb} {repaired} with drift.'
+            )
+        )
+        if deferred:
+            self.stdout.write(f'Deferred {deferred} with undelivered events; run again once the outbox drains.')
+    
+    def reconcile(self, pk, dry_run):
+        """
+        Recalculate one responder under its row lock, so a lifecycle delta
+        cannot land between the recount and the save. A responder with an
+        undelivered stats event is left alone: the recount already includes
+        that history, and the consumer would apply it a second time.
+        """
+        fields = ResponderStats.HISTORY_FIELDS
+        with transaction.atomic():
+            stats = ResponderStats.objects.select_for_update(of=('self',)).select_related('responder').get(pk=pk)
+            before = [getattr(stats, field) for field in fields]
+            stats.recalculate()
+            # Checked after the recount, so an event committed during it is seen
+            if OutboxEvent.objects.filter(
+                actor_id=stats.responder_id, topic__in=STATS_TOPICS, dispatched_at__isnull=True,
+            ).exists():
+                self.stdout.write(f'  ⏳ {stats.responder.username}: events pending, skipped')
+                return 'deferred'
+            after = [getattr(stats, field) for field in fields]
+            
+            if not self.has_drift(before, after):
+                return 'clean'
+            
+            self.stdout.write(f'  ⚠️  {stats.responder.username}: counters drifted, repairing')
+            if not dry_run:
+                stats.save(update_fields=fields + ['updated_at'])
+            return 'repaired'
+    
+    def has_drift(self, before, after):
+        for old, new in zip(before, after):
+            if isinstance(old, float) or isinstance(new, float):
+                if old is None or new is None:
+                    if old is not new:
+                        return True
+                elif abs(old - new) > 1e-6:
+                    return True
+            elif old != new:
+                return True
+        return False
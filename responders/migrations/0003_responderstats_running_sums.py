@@ -0,0 +1,37 @@
+# Generated by Django 5.1.4 on 2026-10-18 15:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("responders", "0002_badge_responderstats"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="responderstats",
+            name="arrival_time_count",
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="responderstats",
+            name="arrival_time_total",
+            field=models.FloatField(
+                default=0.0, help_text="Sum of arrival times (minutes)"
+            ),
+        ),
+        migrations.AddField(
+            model_name="responderstats",
+            name="response_time_count",
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="responderstats",
+            name="response_time_total",
+            field=models.FloatField(
+                default=0.0, help_text="Sum of response times (minutes)"
+            ),
+        ),
+    ]
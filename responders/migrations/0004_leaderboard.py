@@ -0,0 +1,114 @@
+# Generated by Django 5.1.4 on 2026-10-18 15:59
+
+import math
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import migrations, models
+
+# responders.rankings as of this migration, kept here so later changes to
+# the app code can't change what it writes
+GLOBAL_SCOPE = -1
+POINTS_CAPACITY = 1 << 20
+
+
+def area_for(latitude, longitude):
+    if latitude is None or longitude is None:
+        return None
+    size = getattr(settings, "LEADERBOARD_AREA_CELL_DEG", 0.1)
+    rows, cols = int(math.ceil(180 / size)), int(math.ceil(360 / size))
+    row = min(max(int((float(latitude) + 90) // size), 0), rows - 1)
+    col = int((float(longitude) + 180) // size) % cols
+    return row * cols + col
+
+
+def tree_counts(points_values):
+    """{node: count} of a Fenwick tree holding points_values"""
+    counts = defaultdict(int)
+    for points in points_values:
+        i = min(max(int(points), 0), POINTS_CAPACITY - 1) + 1
+        while i <= POINTS_CAPACITY:
+            counts[i] += 1
+            i += i & -i
+    return counts
+
+
+def build_leaderboard(apps, schema_editor):
+    ResponderStats = apps.get_model("responders", "ResponderStats")
+    LeaderboardNode = apps.get_model("responders", "LeaderboardNode")
+    all_stats = list(ResponderStats.objects.select_related("responder"))
+    points_by_scope = defaultdict(list)
+    for stats in all_stats:
+        stats.area_cell = area_for(stats.responder.latitude, stats.responder.longitude)
+        points_by_scope[GLOBAL_SCOPE].append(stats.total_points)
+        if stats.area_cell is not None:
+            points_by_scope[stats.area_cell].append(stats.total_points)
+    ResponderStats.objects.bulk_update(all_stats, ["area_cell"], batch_size=1000)
+    LeaderboardNode.objects.bulk_create(
+        [
+            LeaderboardNode(scope=scope, node=node, count=count)
+            for scope, points_values in points_by_scope.items()
+            for node, count in tree_counts(points_values).items()
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("responders", "0003_responderstats_running_sums"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="LeaderboardNode",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("scope", models.BigIntegerField()),
+                ("node", models.PositiveIntegerField()),
+                ("count", models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name="responderstats",
+            name="area_cell",
+            field=models.BigIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name="responderstats",
+            index=models.Index(
+                fields=["-total_points", "responder"], name="stats_points_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="responderstats",
+            index=models.Index(
+                fields=["area_cell", "-total_points", "responder"],
+                name="stats_area_points_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="volunteerprofile",
+            index=models.Index(
+                fields=["verification_status", "-impact_score", "-created_at"],
+                name="volunteer_leaderboard_idx",
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="leaderboardnode",
+            constraint=models.UniqueConstraint(
+                fields=("scope", "node"), name="leaderboard_node_unique"
+            ),
+        ),
+        migrations.RunPython(build_leaderboard, migrations.RunPython.noop),
+    ]
@@ -82,6 +82,13 @@ class VolunteerProfile(models.Model):
     
     class Meta:
         ordering = ['-impact_score', '-created_at']
+        indexes = [
+            # Leaderboard page: approved volunteers in ranking order, no sort
+            models.Index(
+                fields=['verification_status', '-impact_score', '-created_at'],
+                name='volunteer_leaderboard_idx',
+            ),
+        ]
 
 
 class AreaSafetyScore(models.Model):
@@ -147,6 +154,10 @@ class AreaSafetyScore(models.Model):
         ordering = ['-safety_score']
 
 
+# EmergencyResponse statuses that count as "accepted" for statistics
+ACCEPTED_RESPONSE_STATUSES = ['accepted', 'en_route', 'arrived']
+
+
 class ResponderStats(models.Model):
     """
     Track volunteer/responder performance metrics for enhanced dashboard
@@ -167,6 +178,12 @@ class ResponderStats(models.Model):
     average_arrival_time = models.FloatField(default=0.0, help_text="Average time to arrive (minutes)")
     fastest_response = models.FloatField(null=True, blank=True, help_text="Fastest response time (minutes)")
     
+    # Running sums behind the averages, so they can be updated incrementally
+    response_time_total = models.FloatField(default=0.0, help_text="Sum of response times (minutes)")
+    response_time_count = models.IntegerField(default=0)
+    arrival_time_total = models.FloatField(default=0.0, help_text="Sum of arrival times (minutes)")
+    arrival_time_count = models.IntegerField(default=0)
+    
     # Rating & Feedback
     rating = models.FloatField(default=5.0, help_text="Average rating from victims")
     total_ratings = models.IntegerField(default=0)
@@ -181,46 +198,120 @@ class ResponderStats(models.Model):
     level = models.IntegerField(default=1)
     badges = models.JSONField(default=list, help_text="List of earned badge IDs")
     
+    # Leaderboard area (see responders.rankings), follows the last known location
+    area_cell = models.BigIntegerField(null=True, blank=True, editable=False)
+    
     # Timestamps
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    # Fields derived from response history by recalculate()
+    HISTORY_FIELDS = [
+        'total_responses', 'completed_responses',
+        'response_time_total', 'response_time_count', 'average_response_time', 'fastest_response',
+        'arrival_time_total', 'arrival_time_count', 'average_arrival_time', 'level',
+    ]
+    
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the stored position so a points or area change can move it.
+        # Unknown (looked up on save) when either field was deferred: reading
+        # it here would load it through from_db again
+        if 'total_points' in field_names and 'area_cell' in field_names:
+            instance._leaderboard_key = (instance.total_points, instance.area_cell)
+        else:
+            instance._leaderboard_key = None
+        return instance
+    
+    def leaderboard_key(self):
+        """(total_points, area_cell) this responder is ranked under"""
+        return (self.total_points, self.area_cell)
+    
     def update_stats(self):
-        """Recalculate all statistics"""
+        """Recalculate all statistics from history and save"""
+        self.recalculate()
+        self.save()
+    
+    def recalculate(self):
+        """
+        Recompute history-derived fields from the full response history.
+        Only used for reconciliation; lifecycle events keep the row current
+        through record_acceptance / record_arrival / record_resolution.
+        """
         from emergencies.models import Emergency, EmergencyResponse
-        from django.utils import timezone
         
-        # Get all responses
-        responses = EmergencyResponse.objects.filter(responder=self.responder)
-        self.total_responses = responses.count()
+        # Accepted responses (including ones that went on to en route / arrived)
+        accepted = EmergencyResponse.objects.filter(
+            responder=self.responder,
+            status__in=ACCEPTED_RESPONSE_STATUSES,
+        )
+        self.total_responses = accepted.count()
         
         # Completed emergencies
-        completed = Emergency.objects.filter(
+        self.completed_responses = Emergency.objects.filter(
             primary_responder=self.responder,
             status='resolved'
-        )
-        self.completed_responses = completed.count()
+        ).count()
         
-        # Calculate average response time
-        accepted_responses = responses.filter(status='accepted')
-        if accepted_responses.exists():
-            times = []
-            for resp in accepted_responses:
-                if resp.responded_at and resp.notified_at:
-                    delta = (resp.responded_at - resp.notified_at).total_seconds() / 60
-                    times.append(delta)
-            
-            if times:
-                self.average_response_time = sum(times) / len(times)
-                self.fastest_response = min(times)
+        # Response times (SOS triggered -> accepted), the same measure the
+        # acceptance delta records
+        times = [
+            (responded_at - triggered_at).total_seconds() / 60
+            for triggered_at, responded_at in accepted.filter(
+                responded_at__isnull=False
+            ).values_list('emergency__triggered_at', 'responded_at')
+        ]
+        self.response_time_total = sum(times)
+        self.response_time_count = len(times)
+        self.average_response_time = self.response_time_total / len(times) if times else 0.0
+        self.fastest_response = min(times) if times else None
         
-        # Update streak
-        self.update_streak()
+        # Arrival times (accepted -> arrived)
+        arrivals = [
+            (arrived_at - accepted_at).total_seconds() / 60
+            for accepted_at, arrived_at in Emergency.objects.filter(
+                primary_responder=self.responder,
+                responder_accepted_at__isnull=False,
+                responder_arrived_at__isnull=False,
+            ).values_list('responder_accepted_at', 'responder_arrived_at')
+        ]
+        self.arrival_time_total = sum(arrivals)
+        self.arrival_time_count = len(arrivals)
+        self.average_arrival_time = self.arrival_time_total / len(arrivals) if arrivals else 0.0
         
         # Calculate level based on points
         self.level = (self.total_points // 100) + 1
-        
-        self.save()
+    
+    def record_acceptance(self, response_minutes=None):
+        """Lifecycle delta: the responder accepted an emergency"""
+        self.total_responses += 1
+        if response_minutes is not None:
+            self.response_time_total += response_minutes
+            self.response_time_count += 1
+            self.average_response_time = self.response_time_total / self.response_time_count
+            if self.fastest_response is None or response_minutes < self.fastest_response:
+                self.fastest_response = response_minutes
+        self.update_streak()
+        self.save(update_fields=[
+            'total_responses', 'response_time_total', 'response_time_count',
+            'average_response_time', 'fastest_response',
+            'current_streak', 'longest_streak', 'last_active', 'updated_at',
+        ])
+    
+    def record_arrival(self, arrival_minutes):
+        """Lifecycle delta: the responder arrived on scene"""
+        self.arrival_time_total += arrival_minutes
+        self.arrival_time_count += 1
+        self.average_arrival_time = self.arrival_time_total / self.arrival_time_count
+        self.save(update_fields=[
+            'arrival_time_total', 'arrival_time_count', 'average_arrival_time', 'updated_at',
+        ])
+    
+    def record_resolution(self):
+        """Lifecycle delta: an emergency this responder handled was resolved"""
+        self.completed_responses += 1
+        self.save(update_fields=['completed_responses', 'updated_at'])
     
     def update_streak(self):
         """Update activity streak"""
@@ -263,6 +354,30 @@ class ResponderStats(models.Model):
     
     class Meta:
         verbose_name_plural = "Responder Statistics"
+        indexes = [
+            # Leaderboard top-N and neighbour windows, overall and per area
+            models.Index(fields=['-total_points', 'responder'], name='stats_points_idx'),
+            models.Index(fields=['area_cell', '-total_points', 'responder'], name='stats_area_points_idx'),
+        ]
+
+
+class LeaderboardNode(models.Model):
+    """
+    One node of a leaderboard Fenwick tree: how many responders of a scope
+    (everyone, or one area) hold points in the range the node covers
+    (see responders.rankings)
+    """
+    scope = models.BigIntegerField()
+    node = models.PositiveIntegerField()
+    count = models.IntegerField(default=0)
+    
+    def __str__(self):
+        return f"{self.scope}[{self.node}] = {self.count}"
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['scope', 'node'], name='leaderboard_node_unique'),
+        ]
 
 
 class Badge(models.Model):
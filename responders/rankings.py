@@ -0,0 +1,246 @@
+"""
+Materialised responder leaderboard
+Responders are ranked by ResponderStats.total_points, overall and within
+their area (the LEADERBOARD_AREA_CELL_DEG grid cell of their last known
+location). Each scope keeps a Fenwick tree of how many responders hold
+each points value in LeaderboardNode rows, so "how many are ahead of me"
+reads at most ~21 rows with one indexed query instead of counting the
+table, and a points change rewrites as many rows. Top-N and the window
+around a responder are index range reads on ResponderStats. Responders
+with equal points share a rank and are listed by responder id.
+
+The trees follow ResponderStats saves and deletes (responders.signals);
+bulk updates must call record_change_on_commit themselves. Every change
+writes the top nodes of the global tree, so they are applied after the
+stats write commits, in a short transaction of their own, instead of
+holding those rows locked for the rest of the writer's transaction
+(an acceptance's stats update, a whole award_badges chunk). A process
+that dies in between leaves the trees off by that change until
+`manage.py rebuild_leaderboard` recomputes areas and trees from scratch.
+"""
+
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+
+from emergencies.geo import cell_for
+
+GLOBAL_SCOPE = -1
+# Points values the trees tell apart; anything higher ranks as the maximum
+POINTS_CAPACITY = 1 << 20
+
+
+def area_cell_deg():
+    return getattr(settings, 'LEADERBOARD_AREA_CELL_DEG', 0.1)
+
+
+def area_for(latitude, longitude):
+    """Leaderboard area of a location, or None if it isn't known"""
+    if latitude is None or longitude is None:
+        return None
+    return cell_for(latitude, longitude, area_cell_deg())
+
+
+def scopes_for(area_cell):
+    return [GLOBAL_SCOPE] if area_cell is None else [GLOBAL_SCOPE, area_cell]
+
+
+def _index(points):
+    """1-based tree position of a points value"""
+    return min(max(int(points), 0), POINTS_CAPACITY - 1) + 1
+
+
+def _prefix_nodes(points):
+    """Nodes whose counts sum to the responders with at most `points`"""
+    nodes = []
+    i = _index(points)
+    while i > 0:
+        nodes.append(i)
+        i -= i & -i
+    return nodes
+
+
+def _update_nodes(points):
+    """Nodes that count a responder with `points`"""
+    nodes = []
+    i = _index(points)
+    while i <= POINTS_CAPACITY:
+        nodes.append(i)
+        i += i & -i
+    return nodes
+
+
+def tree_counts(points_values):
+    """{node: count} of a tree holding points_values (one per responder)"""
+    counts = defaultdict(int)
+    for index, n in Counter(_index(points) for points in points_values).items():
+        i = index
+        while i <= POINTS_CAPACITY:
+            counts[i] += n
+            i += i & -i
+    return counts
+
+
+def adjust(scope, points, delta):
+    """Add delta responders holding `points` to a scope's tree"""
+    from .models import LeaderboardNode
+
+    nodes = _update_nodes(points)
+    # Create missing nodes first so concurrent adjusts only ever increment
+    LeaderboardNode.objects.bulk_create(
+        [LeaderboardNode(scope=scope, node=node, count=0) for node in nodes],
+        ignore_conflicts=True,
+    )
+    LeaderboardNode.objects.filter(scope=scope, node__in=nodes).update(count=F('count') + delta)
+
+
+def record_changes(changes):
+    """
+    Move responders from one (total_points, area_cell) key to another, for
+    each (old_key, new_key) in changes; None means not ranked (created /
+    deleted)
+    """
+    deltas = Counter()
+    for old_key, new_key in changes:
+        if old_key == new_key:
+            continue
+        for key, delta in ((old_key, -1), (new_key, 1)):
+            if key is not None:
+                points, area_cell = key
+                for scope in scopes_for(area_cell):
+                    deltas[(scope, _index(points))] += delta
+    # One order for every writer, so concurrent moves can't deadlock
+    for (scope, index), delta in sorted(deltas.items()):
+        if delta:
+            adjust(scope, index - 1, delta)
+
+
+def record_change_on_commit(*changes):
+    """record_changes(changes) once the current transaction commits"""
+    changes = [change for change in changes if change[0] != change[1]]
+    if not changes:
+        return
+
+    def apply():
+        with transaction.atomic():
+            record_changes(changes)
+
+    transaction.on_commit(apply)
+
+
+def ranks(points_values, scope=GLOBAL_SCOPE):
+    """{points: rank within scope} for each of points_values, with one query"""
+    from .models import LeaderboardNode
+
+    wanted = {points: _prefix_nodes(points) for points in set(points_values)}
+    nodes = {POINTS_CAPACITY}.union(*wanted.values())
+    counts = dict(
+        LeaderboardNode.objects.filter(scope=scope, node__in=nodes).values_list('node', 'count')
+    )
+    total = counts.get(POINTS_CAPACITY, 0)
+    return {
+        points: total - sum(counts.get(node, 0) for node in prefix) + 1
+        for points, prefix in wanted.items()
+    }
+
+
+def rank(stats, area=False):
+    """Rank of a ResponderStats overall, or in its area (None without one)"""
+    scope = stats.area_cell if area else GLOBAL_SCOPE
+    if scope is None:
+        return None
+    return ranks([stats.total_points], scope)[stats.total_points]
+
+
+def board(scope=GLOBAL_SCOPE):
+    from .models import ResponderStats
+
+    stats = ResponderStats.objects.select_related('responder')
+    if scope != GLOBAL_SCOPE:
+        stats = stats.filter(area_cell=scope)
+    return stats
+
+
+def top(n=10, scope=GLOBAL_SCOPE):
+    """Best n responders of a scope, each with .rank"""
+    rows = list(board(scope).order_by('-total_points', 'responder_id')[:n])
+    for position, row in enumerate(rows):
+        if position == 0 or row.total_points != rows[position - 1].total_points:
+            current = position + 1
+        row.rank = current
+    return rows
+
+
+def around(stats, window=2, scope=GLOBAL_SCOPE):
+    """
+    Up to `window` responders either side of stats in its scope's
+    ranking, stats included, best first, each with .rank
+    """
+    points, responder_id = stats.total_points, stats.responder_id
+    scoped = board(scope)
+
+    # Ties first, then the next points values, so every read is an index seek
+    ahead = list(scoped.filter(total_points=points, responder_id__lt=responder_id).order_by('-responder_id')[:window])
+    if len(ahead) < window:
+        ahead += scoped.filter(total_points__gt=points).order_by('total_points', '-responder_id')[:window - len(ahead)]
+    behind = list(scoped.filter(total_points=points, responder_id__gt=responder_id).order_by('responder_id')[:window])
+    if len(behind) < window:
+        behind += scoped.filter(total_points__lt=points).order_by('-total_points', 'responder_id')[:window - len(behind)]
+
+    rows = ahead[::-1] + [stats] + behind
+    rank_of = ranks([row.total_points for row in rows], scope)
+    for row in rows:
+        row.rank = rank_of[row.total_points]
+    return rows
+
+
+def follow_users(fixes):
+    """
+    Move the responders among fixes ({user_id: Fix}) whose location left
+    their leaderboard area. Called with each batch of buffered user fixes.
+    """
+    from .models import ResponderStats
+
+    for stats in ResponderStats.objects.filter(responder_id__in=list(fixes)).only(
+        'id', 'responder_id', 'total_points', 'area_cell',
+    ):
+        fix = fixes[stats.responder_id]
+        area_cell = area_for(fix.latitude, fix.longitude)
+        if area_cell != stats.area_cell:
+            stats.area_cell = area_cell
+            # post_save moves it between the area trees
+            stats.save(update_fields=['area_cell'])
+
+
+def rebuild():
+    """Recompute every area from user locations and every tree; returns responders ranked"""
+    from .models import LeaderboardNode, ResponderStats
+
+    with transaction.atomic():
+        all_stats = list(
+            ResponderStats.objects.only('id', 'total_points', 'area_cell', 'responder__latitude', 'responder__longitude')
+            .select_related('responder')
+        )
+        points_by_scope = defaultdict(list)
+        moved = []
+        for stats in all_stats:
+            area_cell = area_for(stats.responder.latitude, stats.responder.longitude)
+            if area_cell != stats.area_cell:
+                stats.area_cell = area_cell
+                moved.append(stats)
+            for scope in scopes_for(area_cell):
+                points_by_scope[scope].append(stats.total_points)
+        ResponderStats.objects.bulk_update(moved, ['area_cell'], batch_size=1000)
+
+        LeaderboardNode.objects.all().delete()
+        LeaderboardNode.objects.bulk_create(
+            [
+                LeaderboardNode(scope=scope, node=node, count=count)
+                for scope, points_values in points_by_scope.items()
+                for node, count in tree_counts(points_values).items()
+            ],
+            batch_size=1000,
+        )
+    return len(all_stats)
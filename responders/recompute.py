@@ -0,0 +1,90 @@
+"""
+Coalesced background badge re-checks
+Saving an EmergencyResponse only marks its responder as needing a badge
+re-check; a worker thread in each process evaluates every marked
+responder once, after RESPONDER_RECOMPUTE_DELAY_SECONDS, however many of
+their responses were saved meanwhile. Marks are kept in memory: one lost
+with its process costs nothing lasting, since evaluation looks at the
+current stats and the responder's next save checks everything again.
+"""
+
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import close_old_connections
+
+logger = logging.getLogger(__name__)
+
+
+class RecomputeQueue:
+    """Set of responder ids waiting for a badge re-check, plus its worker"""
+
+    def __init__(self, delay_seconds, threaded=True):
+        self.delay_seconds = delay_seconds
+        self.threaded = threaded
+        self._pending = set()
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def __len__(self):
+        with self._cond:
+            return len(self._pending)
+
+    def enqueue(self, responder_id):
+        with self._cond:
+            self._pending.add(responder_id)
+            self._cond.notify()
+        self._ensure_thread()
+
+    def drain(self):
+        """Re-check everyone marked so far; returns how many responders were checked"""
+        from .stats import recompute_badges
+
+        with self._cond:
+            responder_ids, self._pending = self._pending, set()
+        for responder_id in sorted(responder_ids):
+            try:
+                recompute_badges(responder_id)
+            except Exception:
+                logger.exception("Badge re-check for responder %s failed", responder_id)
+        return len(responder_ids)
+
+    def _ensure_thread(self):
+        if not self.threaded or (self._thread is not None and self._thread.is_alive()):
+            return
+        with self._cond:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='badge-recompute', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+            # Let a burst of saves for the same responders collapse into one check
+            time.sleep(self.delay_seconds)
+            try:
+                self.drain()
+            finally:
+                close_old_connections()
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_queue():
+    """Process-wide re-check queue"""
+    global _queue
+    if _queue is None:
+        with _queue_lock:
+            if _queue is None:
+                _queue = RecomputeQueue(getattr(settings, 'RESPONDER_RECOMPUTE_DELAY_SECONDS', 1))
+    return _queue
+
+
+def enqueue(responder_id):
+    get_queue().enqueue(responder_id)
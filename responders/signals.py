@@ -1,71 +1,50 @@
-from django.db.models.signals import post_save
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
 from django.dispatch import receiver
 from emergencies.models import EmergencyResponse
-from .models import ResponderStats, Badge
+from . import rankings, recompute
+from .badges import invalidate_rules
+from .models import Badge, ResponderStats
 
 
 @receiver(post_save, sender=EmergencyResponse)
 def check_and_award_badges(sender, instance, created, **kwargs):
     """
     Automatically check and award badges when emergency response is saved
+    The check itself runs in the background once the save commits, merged
+    with any other saves of the same responder (see responders.recompute)
     """
-    if not instance.responder:
+    responder_id = instance.responder_id
+    if not responder_id:
         return
     
-    # Get or create responder stats
-    stats, _ = ResponderStats.objects.get_or_create(responder=instance.responder)
-    
-    # Update stats first
-    stats.update_stats()
-    
-    # Get all badges
-    all_badges = Badge.objects.all()
-    
-    # Check each badge requirement
-    for badge in all_badges:
-        # Skip if already earned
-        if badge.badge_id in stats.badges:
-            continue
-        
-        # Check if requirements are met
-        if check_badge_requirement(stats, badge):
-            # Award the badge
-            stats.earn_badge(badge.badge_id, badge.points_reward)
-            
-            # TODO: Send notification to user
-            print(f"🎉 Badge earned: {badge.name} by {instance.responder.username}")
+    transaction.on_commit(lambda: recompute.enqueue(responder_id))
 
 
-def check_badge_requirement(stats, badge):
-    """
-    Check if a responder meets the requirements for a badge
-    """
-    req_type = badge.requirement_type
-    req_value = badge.requirement_value
-    
-    if req_type == 'total_responses':
-        return stats.total_responses >= req_value
-    
-    elif req_type == 'lives_saved':
-        return stats.lives_saved >= req_value
-    
-    elif req_type == 'response_time':
-        # Average response time should be less than or equal to requirement
-        return stats.average_response_time <= req_value
-    
-    elif req_type == 'streak':
-        return stats.current_streak >= req_value
-    
-    elif req_type == 'rating':
-        return stats.rating >= req_value
-    
-    elif req_type == 'completed_responses':
-        return stats.completed_responses >= req_value
-    
-    elif req_type == 'level':
-        return stats.level >= req_value
-    
-    elif req_type == 'points':
-        return stats.total_points >= req_value
-    
-    return False
+@receiver([post_save, post_delete], sender=Badge)
+def reset_badge_rules(sender, **kwargs):
+    """Recompile badge rules after any Badge change"""
+    invalidate_rules()
+
+
+@receiver([pre_save, pre_delete], sender=ResponderStats)
+def look_up_leaderboard_key(sender, instance, **kwargs):
+    """Read the stored key of rows loaded with points or area deferred"""
+    if instance.pk is not None and getattr(instance, '_leaderboard_key', None) is None:
+        instance._leaderboard_key = (
+            ResponderStats.objects.filter(pk=instance.pk).values_list('total_points', 'area_cell').first()
+        )
+
+
+@receiver(post_save, sender=ResponderStats)
+def update_leaderboard(sender, instance, created, **kwargs):
+    """Keep the leaderboard trees current whenever points or area change"""
+    new_key = instance.leaderboard_key()
+    old_key = None if created else getattr(instance, '_leaderboard_key', None)
+    rankings.record_change_on_commit((old_key, new_key))
+    instance._leaderboard_key = new_key
+
+
+@receiver(post_delete, sender=ResponderStats)
+def remove_from_leaderboard(sender, instance, **kwargs):
+    rankings.record_change_on_commit((getattr(instance, '_leaderboard_key', None), None))
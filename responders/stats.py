@@ -0,0 +1,54 @@
+"""
+Incremental ResponderStats maintenance
+Each lifecycle event applies a delta to the responder's running sums
+instead of re-counting their whole history
+"""
+
+from django.db import transaction
+
+from .badges import award_badges
+from .models import ResponderStats
+
+# Metrics moved by an acceptance, i.e. the badge tables worth re-checking
+ACCEPTANCE_METRICS = ['total_responses', 'average_response_time', 'fastest_response', 'current_streak']
+
+
+def _locked_stats(responder_id):
+    stats, _ = ResponderStats.objects.select_for_update().get_or_create(responder_id=responder_id)
+    return stats
+
+
+def minutes_between(start, end):
+    if not start or not end:
+        return None
+    return max((end - start).total_seconds() / 60, 0.0)
+
+
+def record_acceptance(responder_id, response_minutes=None):
+    """Responder accepted an emergency after response_minutes"""
+    with transaction.atomic():
+        stats = _locked_stats(responder_id)
+        stats.record_acceptance(response_minutes)
+        award_badges(stats, ACCEPTANCE_METRICS)
+
+
+def record_arrival(responder_id, arrival_minutes):
+    """Responder arrived on scene arrival_minutes after accepting"""
+    if arrival_minutes is None:
+        return
+    with transaction.atomic():
+        _locked_stats(responder_id).record_arrival(arrival_minutes)
+
+
+def record_resolution(responder_id):
+    """An emergency handled by the responder was resolved"""
+    with transaction.atomic():
+        stats = _locked_stats(responder_id)
+        stats.record_resolution()
+        award_badges(stats, ['completed_responses'])
+
+
+def recompute_badges(responder_id):
+    """Check every badge rule against the responder's current stats"""
+    with transaction.atomic():
+        award_badges(_locked_stats(responder_id))
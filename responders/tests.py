@@ -1,3 +1,461 @@
-from django.test import TestCase
+import io
+import json
+import time
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from emergencies import outbox, rollups, snapshots
+from emergencies.models import ChangeCounter, Emergency, EmergencyResponse, EmergencyRollup, OutboxEvent
+from emergencies.realtime import emergency_event, get_broker
+
+from . import acceptance, badges, rankings, recompute, views
+from . import stats as responder_stats
+from .alerts import held_connection_slots
+from .management.commands import award_badges
+from .models import Badge, LeaderboardNode, ResponderStats
+
+User = get_user_model()
+
+
+class LeaderboardTests(TestCase):
+    """
+    The rank trees must always agree with counting the table. Every test
+    compares rankings.rank against a COUNT over ResponderStats after the
+    points or areas were changed through one of the write paths.
+    """
+
+    def setUp(self):
+        # Two areas, a few tied points values, some responders without an area
+        with self.captureOnCommitCallbacks(execute=True):
+            for i in range(12):
+                latitude, longitude = (None, None) if i % 6 == 0 else (18.52 + i % 2 * 0.3, 73.85)
+                responder = User.objects.create_user(
+                    username=f'rank_{i}', password=None, role='volunteer', latitude=latitude, longitude=longitude,
+                )
+                ResponderStats.objects.create(
+                    responder=responder,
+                    total_points=(i % 5) * 40,
+                    total_responses=i % 4,
+                    area_cell=rankings.area_for(latitude, longitude),
+                )
+
+    def count_rank(self, stats, area=False):
+        ahead = ResponderStats.objects.filter(total_points__gt=stats.total_points)
+        if area:
+            if stats.area_cell is None:
+                return None
+            ahead = ahead.filter(area_cell=stats.area_cell)
+        return ahead.count() + 1
+
+    def assertRanksMatchCounts(self):
+        for stats in ResponderStats.objects.all():
+            self.assertEqual(rankings.rank(stats), self.count_rank(stats), stats.responder_id)
+            self.assertEqual(rankings.rank(stats, area=True), self.count_rank(stats, area=True), stats.responder_id)
+
+    def assertTreesMatchRebuild(self):
+        incremental = set(LeaderboardNode.objects.exclude(count=0).values_list('scope', 'node', 'count'))
+        rankings.rebuild()
+        rebuilt = set(LeaderboardNode.objects.exclude(count=0).values_list('scope', 'node', 'count'))
+        self.assertEqual(incremental, rebuilt)
+
+    def test_saves_and_deletes(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            stats = ResponderStats.objects.get(responder__username='rank_3')
+            stats.add_points(170)
+            stats.responder.latitude, stats.responder.longitude = 18.52, 73.85
+            stats.responder.save()
+            stats.area_cell = rankings.area_for(18.52, 73.85)
+            stats.save()
+            ResponderStats.objects.get(responder__username='rank_4').delete()
+        self.assertRanksMatchCounts()
+        self.assertTreesMatchRebuild()
+
+    def test_trees_moved_after_commit(self):
+        stats = ResponderStats.objects.get(responder__username='rank_3')
+        nodes = set(LeaderboardNode.objects.values_list('scope', 'node', 'count'))
+        with self.captureOnCommitCallbacks() as callbacks:
+            stats.add_points(170)
+            # The tree rows aren't locked for the rest of the stats transaction
+            self.assertEqual(set(LeaderboardNode.objects.values_list('scope', 'node', 'count')), nodes)
+
+        for callback in callbacks:
+            callback()
+        self.assertRanksMatchCounts()
+        self.assertTreesMatchRebuild()
+
+    def test_deferred_save(self):
+        # Neither field loaded: the old key is looked up, not recursed into
+        with self.captureOnCommitCallbacks(execute=True):
+            stats = ResponderStats.objects.only('id', 'lives_saved').get(responder__username='rank_7')
+            stats.lives_saved = 2
+            stats.save()
+            stats = ResponderStats.objects.defer('area_cell').get(responder__username='rank_8')
+            stats.total_points += 500
+            stats.save()
+        self.assertRanksMatchCounts()
+        self.assertTreesMatchRebuild()
+
+    def test_award_badges(self):
+        Badge.objects.create(
+            badge_id='first_response', name='First Response', description='', icon_class='bi-star',
+            badge_type='milestone', requirement_type='total_responses', requirement_value=1,
+            points_reward=50,
+        )
+        Badge.objects.create(
+            badge_id='centurion', name='Centurion', description='', icon_class='bi-trophy',
+            badge_type='milestone', requirement_type='points', requirement_value=200,
+            points_reward=25,
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('award_badges', chunk_size=5, stdout=io.StringIO())
+
+        earned = [badges for badges in ResponderStats.objects.values_list('badges', flat=True) if badges]
+        self.assertIn('centurion', sum(earned, []))
+        self.assertRanksMatchCounts()
+        self.assertTreesMatchRebuild()
+
+    def test_award_badges_keeps_concurrent_writes(self):
+        Badge.objects.create(
+            badge_id='first_response', name='First Response', description='', icon_class='bi-star',
+            badge_type='milestone', requirement_type='total_responses', requirement_value=1,
+            points_reward=50,
+        )
+        chunk = list(award_badges.stats_queryset().filter(responder__username__in=['rank_1', 'rank_2']))
+        # A live acceptance lands between the command's read and its write
+        with self.captureOnCommitCallbacks(execute=True):
+            live = ResponderStats.objects.get(responder__username='rank_2')
+            live.total_points += 500
+            live.save()
+
+            award_badges.award_chunk(chunk)
+
+        live.refresh_from_db()
+        self.assertEqual(live.total_points, (2 % 5) * 40 + 500 + 50)
+        self.assertEqual(live.badges, ['first_response'])
+        self.assertRanksMatchCounts()
+        self.assertTreesMatchRebuild()
+
+
+class AcceptanceTests(TestCase):
+    """Exactly one volunteer becomes primary, and only while the emergency is active"""
+
+    def setUp(self):
+        self.first, self.second = [
+            User.objects.create_user(username=f'accept_{name}', password=None, role='volunteer')
+            for name in ('first', 'second')
+        ]
+        victim = User.objects.create_user(username='accept_victim', password=None, role='citizen')
+        self.emergency = Emergency.objects.create(
+            victim=victim, emergency_type='medical', severity='high', latitude=18.52, longitude=73.85,
+        )
+        self.url = reverse('responders:accept_emergency', args=[self.emergency.emergency_id])
+
+    def accept_as(self, volunteer):
+        self.client.force_login(volunteer)
+        return self.client.post(self.url)
+
+    def test_second_accept_conflicts(self):
+        self.assertEqual(self.accept_as(self.first).status_code, 302)
+        self.assertEqual(self.accept_as(self.second).status_code, 409)
+        self.emergency.refresh_from_db()
+        self.assertEqual(self.emergency.primary_responder, self.first)
+
+        # A stale copy that still looks free loses the conditional claim
+        stale = Emergency.objects.get(pk=self.emergency.pk)
+        stale.status, stale.primary_responder = 'active', None
+        self.assertIsNone(acceptance.accept(stale, self.second))
+        self.emergency.refresh_from_db()
+        self.assertEqual(self.emergency.primary_responder, self.first)
+        self.assertFalse(EmergencyResponse.objects.filter(responder=self.second, status='accepted').exists())
+
+    def test_inactive_emergency_rejected(self):
+        stale = Emergency.objects.get(pk=self.emergency.pk)
+        Emergency.objects.filter(pk=self.emergency.pk).update(status='cancelled')
+
+        self.assertEqual(self.accept_as(self.first).status_code, 409)
+        self.assertIsNone(acceptance.accept(stale, self.first))
+        self.emergency.refresh_from_db()
+        self.assertEqual(self.emergency.status, 'cancelled')
+        self.assertIsNone(self.emergency.primary_responder)
+        self.assertFalse(OutboxEvent.objects.filter(topic='responder_accepted').exists())
+
+
+class AlertDeliveryTests(TestCase):
+    """Long-polls must block past alerts the client has, and held connections stay capped"""
+
+    def setUp(self):
+        self.volunteer = User.objects.create_user(
+            username='alert_volunteer', password=None, role='volunteer', latitude=18.52, longitude=73.85,
+        )
+        victim = User.objects.create_user(username='alert_victim', password=None, role='citizen')
+        self.emergency = Emergency.objects.create(
+            victim=victim, emergency_type='medical', severity='high', latitude=18.521, longitude=73.851,
+        )
+        self.client.force_login(self.volunteer)
+        self.url = reverse('responders:check_new_emergencies')
+
+    def test_long_poll_waits_past_seen_alert(self):
+        alert_id = str(self.emergency.emergency_id)
+        self.assertEqual(self.client.get(self.url).json()['id'], alert_id)
+
+        started = time.monotonic()
+        data = self.client.get(self.url, {'wait': 0.3, 'since': alert_id}).json()
+        self.assertFalse(data['has_new'])
+        self.assertGreaterEqual(time.monotonic() - started, 0.3)
+
+    def test_held_connections_capped(self):
+        slots = held_connection_slots()
+        taken = 0
+        while slots.acquire(blocking=False):
+            taken += 1
+        try:
+            response = self.client.get(reverse('responders:alert_stream'))
+            self.assertEqual(response.status_code, 204)
+            data = self.client.get(self.url, {'wait': 25, 'since': str(self.emergency.emergency_id)}).json()
+            self.assertFalse(data['has_new'])
+            self.assertTrue(data['retry'])
+        finally:
+            for _ in range(taken):
+                slots.release()
+
+    def test_live_alerts_skip_handled_emergencies(self):
+        subscription = get_broker().subscribe()
+        try:
+            get_broker().publish(emergency_event(self.emergency))
+            data = views._wait_for_alert(subscription, self.volunteer, None, 0.2)
+            self.assertEqual(data['id'], str(self.emergency.emergency_id))
+
+            # Escalation announces it again after the volunteer declined
+            EmergencyResponse.objects.create(emergency=self.emergency, responder=self.volunteer, status='declined')
+            get_broker().publish(emergency_event(self.emergency))
+            self.assertIsNone(views._wait_for_alert(subscription, self.volunteer, None, 0.2))
+        finally:
+            subscription.close()
+
+    def test_stream_only_for_volunteers(self):
+        self.assertContains(self.client.get(reverse('home')), 'startAlertStream();')
+
+        citizen = User.objects.create_user(username='alert_citizen', password=None, role='citizen')
+        self.client.force_login(citizen)
+        self.assertNotContains(self.client.get(reverse('home')), 'startAlertStream();')
+        self.assertEqual(self.client.get(reverse('responders:alert_stream')).status_code, 204)
+
+
+class ResponderStatsTests(TestCase):
+    """Lifecycle deltas must match what reconcile_responder_stats recomputes"""
+
+    def setUp(self):
+        self.volunteer = User.objects.create_user(username='stats_volunteer', password=None, role='volunteer')
+        victim = User.objects.create_user(username='stats_victim', password=None, role='citizen')
+        self.emergency = Emergency.objects.create(
+            victim=victim, emergency_type='medical', severity='high', latitude=18.52, longitude=73.85,
+        )
+        # Triggered a while ago; the volunteer was notified just now
+        Emergency.objects.filter(pk=self.emergency.pk).update(triggered_at=timezone.now() - timedelta(minutes=3))
+        self.emergency.refresh_from_db()
+        EmergencyResponse.objects.create(emergency=self.emergency, responder=self.volunteer, status='notified')
+
+    def test_accept_and_arrive_match_reconcile(self):
+        self.assertIsNotNone(acceptance.accept(self.emergency, self.volunteer))
+        self.client.force_login(self.volunteer)
+        url = reverse('responders:update_response_status', args=[self.emergency.emergency_id])
+        self.client.post(url, {'status': 'arrived'})
+        self.client.post(url, {'status': 'arrived'})
+        outbox.dispatch_pending()
+
+        self.assertEqual(OutboxEvent.objects.filter(topic='responder_arrived').count(), 1)
+        stats = ResponderStats.objects.get(responder=self.volunteer)
+        self.assertEqual(stats.arrival_time_count, 1)
+        self.assertAlmostEqual(stats.average_response_time, 3, places=1)
+
+        out = io.StringIO()
+        call_command('reconcile_responder_stats', dry_run=True, stdout=out)
+        self.assertIn('Found 0 with drift', out.getvalue())
+
+    def test_reconcile_defers_undelivered_events(self):
+        ResponderStats.objects.create(responder=self.volunteer)
+        self.assertIsNotNone(acceptance.accept(self.emergency, self.volunteer))
+
+        out = io.StringIO()
+        call_command('reconcile_responder_stats', stdout=out)
+        self.assertIn('Repaired 0 with drift', out.getvalue())
+        self.assertIn('Deferred 1', out.getvalue())
+        self.assertEqual(ResponderStats.objects.get(responder=self.volunteer).total_responses, 0)
+
+        # The consumer applies the delta once, and then nothing has drifted
+        outbox.dispatch_pending()
+        self.assertEqual(ResponderStats.objects.get(responder=self.volunteer).total_responses, 1)
+        out = io.StringIO()
+        call_command('reconcile_responder_stats', dry_run=True, stdout=out)
+        self.assertIn('Found 0 with drift', out.getvalue())
+
+
+class RecomputeQueueTests(TestCase):
+    """Response saves mark their responder once; the drain checks each marked responder once"""
+
+    def setUp(self):
+        self.queue = recompute.RecomputeQueue(delay_seconds=0, threaded=False)
+        patcher = mock.patch.object(recompute, '_queue', self.queue)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        victim = User.objects.create_user(username='recompute_victim', password=None, role='citizen')
+        self.emergencies = [
+            Emergency.objects.create(
+                victim=victim, emergency_type='medical', severity='high', latitude=18.52, longitude=73.85,
+            )
+            for _ in range(3)
+        ]
+        self.volunteers = [
+            User.objects.create_user(username=f'recompute_{i}', password=None, role='volunteer') for i in range(2)
+        ]
+
+    def test_saves_coalesce(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            for emergency in self.emergencies:
+                response = EmergencyResponse.objects.create(emergency=emergency, responder=self.volunteers[0])
+                response.status = 'viewed'
+                response.save()
+            EmergencyResponse.objects.create(emergency=self.emergencies[0], responder=self.volunteers[1])
+        self.assertEqual(len(self.queue), 2)
+
+        with mock.patch('responders.stats.recompute_badges') as recompute_badges:
+            self.assertEqual(self.queue.drain(), 2)
+        self.assertEqual(
+            sorted(call.args[0] for call in recompute_badges.call_args_list),
+            sorted(volunteer.pk for volunteer in self.volunteers),
+        )
+        self.assertEqual(len(self.queue), 0)
+
+    def test_not_marked_before_commit(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            EmergencyResponse.objects.create(emergency=self.emergencies[0], responder=self.volunteers[0])
+            self.assertEqual(len(self.queue), 0)
+        self.assertEqual(len(callbacks), 1)
+
+    def test_drain_awards_badges(self):
+        Badge.objects.create(
+            badge_id='first_response', name='First Response', description='', icon_class='bi-star',
+            badge_type='milestone', requirement_type='total_responses', requirement_value=1,
+            points_reward=50,
+        )
+        for volunteer in self.volunteers:
+            ResponderStats.objects.create(responder=volunteer, total_responses=1)
+            self.queue.enqueue(volunteer.pk)
+
+        # One failing re-check doesn't hold up the rest
+        recompute_badges = responder_stats.recompute_badges
+
+        def fail_first(responder_id):
+            if responder_id == self.volunteers[0].pk:
+                raise RuntimeError('stats row locked')
+            recompute_badges(responder_id)
+
+        with mock.patch('responders.stats.recompute_badges', side_effect=fail_first), \
+                self.assertLogs('responders.recompute', 'ERROR'):
+            self.assertEqual(self.queue.drain(), 2)
+
+        badges_by_user = dict(ResponderStats.objects.values_list('responder_id', 'badges'))
+        self.assertEqual(badges_by_user[self.volunteers[0].pk], [])
+        self.assertEqual(badges_by_user[self.volunteers[1].pk], ['first_response'])
+
+
+class BadgeRuleTests(TestCase):
+    def setUp(self):
+        self.badge = Badge.objects.create(
+            badge_id='quick', name='Quick', description='', icon_class='bi-lightning',
+            badge_type='performance', requirement_type='total_responses', requirement_value=5,
+        )
+
+    def thresholds(self):
+        return badges.compiled_rules()['total_responses'].keys
+
+    def test_edit_elsewhere_picked_up_after_ttl(self):
+        self.assertEqual(self.thresholds(), [5])
+        # Another process edited the badge: no signal reaches this one
+        Badge.objects.filter(pk=self.badge.pk).update(requirement_value=3)
+        self.assertEqual(self.thresholds(), [5])
+        with override_settings(BADGE_RULES_TTL_SECONDS=0):
+            self.assertEqual(self.thresholds(), [3])
+
+    def test_invalidated_while_compiling(self):
+        compile_rules = badges.compile_rules
+
+        def racing_compile():
+            rules = compile_rules()
+            badges.invalidate_rules()
+            return rules
+
+        badges.invalidate_rules()
+        with mock.patch.object(badges, 'compile_rules', racing_compile):
+            self.assertEqual(self.thresholds(), [5])
+        # The raced tables weren't kept
+        self.assertIsNone(badges._rules)
+
+
+class AnalyticsFunnelTests(TestCase):
+    """The funnel counts what responders did, whatever the emergency's status"""
+
+    def setUp(self):
+        self.admin = User.objects.create_superuser(username='funnel_admin', email='admin@example.com', password=None)
+        self.volunteer = User.objects.create_user(username='funnel_volunteer', password=None, role='volunteer')
+        victim = User.objects.create_user(username='funnel_victim', password=None, role='citizen')
+        self.taken, self.untaken = [
+            Emergency.objects.create(
+                victim=victim, emergency_type='medical', severity='high', latitude=18.52, longitude=73.85,
+            )
+            for _ in range(2)
+        ]
+        EmergencyResponse.objects.create(emergency=self.taken, responder=self.volunteer, status='notified')
+
+    def test_admin_resolved_emergency_not_accepted(self):
+        acceptance.accept(self.taken, self.volunteer)
+        self.client.force_login(self.volunteer)
+        self.client.post(
+            reverse('responders:update_response_status', args=[self.taken.emergency_id]), {'status': 'arrived'},
+        )
+        # Nobody took the other one: an admin closes both
+        self.client.force_login(self.admin)
+        self.client.post(reverse('admin:emergencies_emergency_changelist'), {
+            'action': 'mark_resolved', '_selected_action': [self.taken.pk, self.untaken.pk],
+        })
+
+        response = self.client.get(reverse('responders:admin_analytics'))
+        self.assertEqual(json.loads(response.context['funnel_data']), [2, 1, 1, 2])
+
+        incremental = set(EmergencyRollup.objects.exclude(count=0).values_list(
+            'bucket_date', 'bucket_hour', 'emergency_type', 'severity', 'status', 'accepted', 'arrived', 'count',
+        ))
+        rollups.rebuild()
+        self.assertEqual(incremental, set(EmergencyRollup.objects.values_list(
+            'bucket_date', 'bucket_hour', 'emergency_type', 'severity', 'status', 'accepted', 'arrived', 'count',
+        )))
+
+    def test_admin_resolve_again_changes_nothing(self):
+        acceptance.accept(self.taken, self.volunteer)
+        outbox.dispatch_pending()
+        self.client.force_login(self.admin)
+        action = {'action': 'mark_resolved', '_selected_action': [self.taken.pk]}
+        self.client.post(reverse('admin:emergencies_emergency_changelist'), action)
+        version = ChangeCounter.current(snapshots.SNAPSHOT_COUNTER)
+        rows = set(EmergencyRollup.objects.values_list('status', 'count'))
+
+        self.client.post(reverse('admin:emergencies_emergency_changelist'), action)
+
+        self.assertEqual(ChangeCounter.current(snapshots.SNAPSHOT_COUNTER), version)
+        self.assertEqual(set(EmergencyRollup.objects.values_list('status', 'count')), rows)
+        self.assertEqual(ResponderStats.objects.get(responder=self.volunteer).completed_responses, 1)
+
+    def test_deferred_load_saved(self):
+        # Key fields deferred: the stored key is looked up, not read through from_db
+        emergency = Emergency.objects.only('id', 'status').get(pk=self.untaken.pk)
+        emergency.status = 'cancelled'
+        emergency.save()
+        Emergency.objects.defer('responder_arrived_at').get(pk=self.taken.pk).delete()
+        self.assertEqual(
+            dict(EmergencyRollup.objects.exclude(count=0).values_list('status', 'count')), {'cancelled': 1},
+        )
@@ -23,10 +23,12 @@ urlpatterns = [
     # API endpoints
     path('api/toggle-availability/', views.api_toggle_availability, name='api_toggle_availability'),
     path('api/check-alerts/', views.check_new_emergencies, name='check_new_emergencies'),
+    path('api/alerts/stream/', views.alert_stream, name='alert_stream'),
     path('api/ack-alert/', views.ack_alert, name='ack_alert'),
     
     # Analytics (Admin Only)
     path('analytics/', views.admin_analytics, name='admin_analytics'),
+    path('analytics/api/heatmap/', views.api_heatmap, name='api_heatmap'),
     path('admin-approvals/', views.admin_approvals, name='admin_approvals'),
     # Community
     path('profile/<str:username>/', views.responder_profile_public, name='responder_profile_public'),
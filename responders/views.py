@@ -4,10 +4,12 @@ from django.contrib import messages
 from django.http import JsonResponse
 from django.utils import timezone
 from django.views.decorators.http import require_POST
+from django.db import transaction
 from .models import VolunteerProfile, AreaSafetyScore, ResponderStats
+from . import acceptance, rankings, stats as responder_stats
 from emergencies.models import Emergency, EmergencyResponse, EmergencyTimeline
-from django.db.models import Avg, Count, Sum
-from django.db.models.functions import TruncDate
+from emergencies import outbox, tracks
+from django.db.models import Avg, Count, Q, Sum
 from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth import get_user_model
 User = get_user_model()
@@ -95,44 +97,24 @@ def volunteer_profile(request, pk):
 @require_POST
 def accept_emergency(request, emergency_id):
     """Accept an emergency"""
-    emergency = get_object_or_404(Emergency, emergency_id=emergency_id)
-    
     if request.user.role != 'volunteer':
         return JsonResponse({'success': False, 'message': 'Only volunteers can accept emergencies'}, status=403)
     
-    # Check if emergency is still active
-    if emergency.status != 'active':
+    emergency = get_object_or_404(Emergency, emergency_id=emergency_id)
+    
+    # Cheap read first: late taps fail fast without queueing for the row
+    if emergency.status == 'active' and emergency.primary_responder_id is None:
+        response = acceptance.accept(emergency, request.user)
+    else:
+        response = None
+    
+    if response is None:
         # If I am already the responder, just redirect back
-        if emergency.primary_responder == request.user:
-             messages.info(request, 'You have already accepted this emergency.')
-             return redirect('emergencies:emergency_detail', emergency_id=emergency.emergency_id)
-             
-        return JsonResponse({'success': False, 'message': 'Emergency is no longer active'}, status=400)
-    
-    # Assign responder
-    emergency.primary_responder = request.user
-    emergency.status = 'responder_assigned'
-    emergency.responder_accepted_at = timezone.now()
-    emergency.save()
-    
-    # Create or update response
-    response, created = EmergencyResponse.objects.get_or_create(
-        emergency=emergency,
-        responder=request.user,
-        defaults={'status': 'accepted'}
-    )
-    if not created:
-        response.status = 'accepted'
-        response.responded_at = timezone.now()
-        response.save()
-    
-    # Create timeline entry
-    EmergencyTimeline.objects.create(
-        emergency=emergency,
-        event_type='responder_accepted',
-        description=f'{request.user.username} accepted the emergency',
-        actor=request.user
-    )
+        if Emergency.objects.filter(pk=emergency.pk, primary_responder=request.user).exists():
+            messages.info(request, 'You have already accepted this emergency.')
+            return redirect('emergencies:emergency_detail', emergency_id=emergency.emergency_id)
+        
+        return JsonResponse({'success': False, 'message': 'Emergency is no longer available'}, status=409)
     
     messages.success(request, 'Emergency accepted! Please proceed to the location.')
     return redirect('emergencies:emergency_detail', emergency_id=emergency.emergency_id)
@@ -144,24 +126,29 @@ def decline_emergency(request, emergency_id):
     """Decline an emergency"""
     emergency = get_object_or_404(Emergency, emergency_id=emergency_id)
     
-    # Create or update response
-    response, created = EmergencyResponse.objects.get_or_create(
-        emergency=emergency,
-        responder=request.user,
-        defaults={'status': 'declined'}
-    )
+    with transaction.atomic():
+        # Create or update response
+        response, created = EmergencyResponse.objects.get_or_create(
+            emergency=emergency,
+            responder=request.user,
+            defaults={'status': 'declined'}
+        )
+        if not created:
+            response.status = 'declined'
+            response.responded_at = timezone.now()
+            response.save()
+        
+        # Create timeline entry
+        EmergencyTimeline.objects.create(
+            emergency=emergency,
+            event_type='responder_declined',
+            description=f'{request.user.username} declined the emergency',
+            actor=request.user
+        )
+        outbox.emit('responder_declined', emergency, request.user)
+    
     if not created:
-        response.status = 'declined'
-        response.responded_at = timezone.now()
-        response.save()
-    
-    # Create timeline entry
-    EmergencyTimeline.objects.create(
-        emergency=emergency,
-        event_type='responder_declined',
-        description=f'{request.user.username} declined the emergency',
-        actor=request.user
-    )
+        tracks.stop_tracking(request.user.id, response.id)
     
     messages.info(request, 'Emergency declined.')
     return redirect('responders:volunteer_dashboard')
@@ -182,23 +169,47 @@ def update_response_status(request, emergency_id):
         emergency.status = 'responder_en_route'
         event_type = 'responder_en_route'
         description = f'{request.user.username} is en route'
+        payload = {}
     elif new_status == 'arrived':
         emergency.status = 'responder_arrived'
         emergency.responder_arrived_at = timezone.now()
         event_type = 'responder_arrived'
         description = f'{request.user.username} has arrived'
+        payload = {
+            'arrival_minutes': responder_stats.minutes_between(
+                emergency.responder_accepted_at, emergency.responder_arrived_at
+            ),
+        }
     else:
         return JsonResponse({'success': False, 'message': 'Invalid status'}, status=400)
     
-    emergency.save()
+    with transaction.atomic():
+        if new_status == 'arrived':
+            # Stamp the arrival with a conditional UPDATE so a repeated (or
+            # concurrent) POST neither moves it nor counts it again
+            first_arrival = Emergency.objects.filter(
+                pk=emergency.pk, responder_arrived_at__isnull=True,
+            ).update(responder_arrived_at=emergency.responder_arrived_at)
+            if not first_arrival:
+                messages.info(request, 'Arrival was already recorded.')
+                return redirect('emergencies:emergency_detail', emergency_id=emergency.emergency_id)
+        emergency.save()
+        
+        # Create timeline entry
+        EmergencyTimeline.objects.create(
+            emergency=emergency,
+            event_type=event_type,
+            description=description,
+            actor=request.user
+        )
+        outbox.emit(event_type, emergency, request.user, **payload)
     
-    # Create timeline entry
-    EmergencyTimeline.objects.create(
-        emergency=emergency,
-        event_type=event_type,
-        description=description,
-        actor=request.user
-    )
+    if new_status == 'arrived':
+        response_id = EmergencyResponse.objects.filter(
+            emergency=emergency, responder=request.user
+        ).values_list('id', flat=True).first()
+        if response_id:
+            tracks.stop_tracking(request.user.id, response_id)
     
     messages.success(request, f'Status updated to: {new_status}')
     return redirect('emergencies:emergency_detail', emergency_id=emergency.emergency_id)
@@ -264,9 +275,6 @@ def enhanced_dashboard(request):
     from .models import ResponderStats, Badge
     stats, created = ResponderStats.objects.get_or_create(responder=request.user)
     
-    # Update stats
-    stats.update_stats()
-    
     # Get all badges
     all_badges = Badge.objects.all()
     earned_badges = Badge.objects.filter(badge_id__in=stats.badges)
@@ -276,9 +284,11 @@ def enhanced_dashboard(request):
     next_level_points = stats.level * 100
     level_progress = ((stats.total_points - current_level_points) / 100) * 100
     
-    # Get leaderboard (top 10)
-    leaderboard = ResponderStats.objects.select_related('responder').order_by('-total_points')[:10]
-    user_rank = ResponderStats.objects.filter(total_points__gt=stats.total_points).count() + 1
+    # Get leaderboard (top 10), ranks from the materialised trees
+    leaderboard = rankings.top(10)
+    user_rank = rankings.rank(stats)
+    area_rank = rankings.rank(stats, area=True)
+    neighbours = rankings.around(stats, 2, stats.area_cell if area_rank else rankings.GLOBAL_SCOPE)
     
     # Get recent emergencies
     active_emergencies = Emergency.objects.filter(status='active')[:5]
@@ -331,6 +341,8 @@ def enhanced_dashboard(request):
         'level_progress': level_progress,
         'leaderboard': leaderboard,
         'user_rank': user_rank,
+        'area_rank': area_rank,
+        'neighbours': neighbours,
         'active_emergencies': active_emergencies,
         'my_emergencies': my_emergencies,
         'my_responses': my_responses,
@@ -345,59 +357,63 @@ def admin_analytics(request):
     Analytics dashboard for admins to view system performance
     """
     import json
-    from django.db.models.functions import ExtractHour
+    from emergencies.models import EmergencyRollup
+    
+    # Emergency figures come from the hourly rollups (see emergencies.rollups),
+    # so the cost doesn't grow with the Emergency table
+    rollups = EmergencyRollup.objects.all()
     
     # 1. Key Metrics
-    total_emergencies = Emergency.objects.count()
+    total_emergencies = rollups.aggregate(total=Sum('count'))['total'] or 0
     total_volunteers = VolunteerProfile.objects.count()
     total_lives_saved = ResponderStats.objects.aggregate(total=Sum('lives_saved'))['total'] or 0
     avg_response_time = ResponderStats.objects.aggregate(avg=Avg('average_response_time'))['avg'] or 0
     
     # 2. Daily Emergency Trends (Last 30 days)
-    thirty_days_ago = timezone.now() - timezone.timedelta(days=30)
+    thirty_days_ago = timezone.localdate() - timezone.timedelta(days=30)
     
-    daily_stats = Emergency.objects.filter(
-        triggered_at__gte=thirty_days_ago
-    ).annotate(
-        date=TruncDate('triggered_at')
-    ).values('date').annotate(
-        count=Count('emergency_id')
-    ).order_by('date')
+    daily_stats = rollups.filter(
+        bucket_date__gte=thirty_days_ago
+    ).values('bucket_date').annotate(
+        total=Sum('count')
+    ).filter(total__gt=0).order_by('bucket_date')
     
-    dates = [stat['date'].strftime('%Y-%m-%d') for stat in daily_stats]
-    counts = [stat['count'] for stat in daily_stats]
+    dates = [stat['bucket_date'].strftime('%Y-%m-%d') for stat in daily_stats]
+    counts = [stat['total'] for stat in daily_stats]
     
     # 3. Emergency Types Distribution
-    type_stats = Emergency.objects.values('emergency_type').annotate(
-        count=Count('emergency_id')
-    ).order_by('-count')
+    type_stats = rollups.values('emergency_type').annotate(
+        total=Sum('count')
+    ).filter(total__gt=0).order_by('-total')
     
     type_labels = [stat['emergency_type'].replace('_', ' ').title() for stat in type_stats]
-    type_counts = [stat['count'] for stat in type_stats]
+    type_counts = [stat['total'] for stat in type_stats]
     
     # 4. Peak Hours Analysis (0-23)
-    peak_stats = Emergency.objects.annotate(
-        hour=ExtractHour('triggered_at')
-    ).values('hour').annotate(
-        count=Count('emergency_id')
-    ).order_by('hour')
+    peak_stats = rollups.values('bucket_hour').annotate(
+        total=Sum('count')
+    ).order_by('bucket_hour')
     
-    hours_data = {stat['hour']: stat['count'] for stat in peak_stats}
+    hours_data = {stat['bucket_hour']: stat['total'] for stat in peak_stats}
     peak_labels = [f"{h:02d}:00" for h in range(24)]
     peak_counts = [hours_data.get(h, 0) for h in range(24)]
     
-    # 5. Efficiency Funnel
+    # 5. Efficiency Funnel (how far each emergency has progressed). Accepted
+    # and arrived mean a responder did, not just that the status moved past
+    # it: an admin can resolve an emergency nobody took.
+    funnel = rollups.aggregate(
+        accepted=Sum('count', filter=Q(accepted=True)),
+        arrived=Sum('count', filter=Q(arrived=True)),
+        resolved=Sum('count', filter=Q(status='resolved')),
+    )
     funnel_triggered = total_emergencies
-    funnel_accepted = EmergencyResponse.objects.filter(status='accepted').count()
-    funnel_arrived = EmergencyResponse.objects.filter(status='arrived').count()
-    funnel_resolved = Emergency.objects.filter(status='resolved').count()
+    funnel_accepted = funnel['accepted'] or 0
+    funnel_arrived = funnel['arrived'] or 0
+    funnel_resolved = funnel['resolved'] or 0
     
     funnel_data = [funnel_triggered, funnel_accepted, funnel_arrived, funnel_resolved]
     
-    # 6. Heatmap Data (Lat/Long)
-    heatmap_raw = list(Emergency.objects.values('latitude', 'longitude', 'severity'))
-    # Convert Decimal/float to simple float for JSON
-    heatmap_data = [{'x': float(h['longitude']), 'y': float(h['latitude'])} for h in heatmap_raw]
+    # 6. Heatmap is loaded separately from api_heatmap (binned server-side)
 
     context = {
         'total_emergencies': total_emergencies,
@@ -413,11 +429,68 @@ def admin_analytics(request):
         'peak_labels': json.dumps(peak_labels),
         'peak_counts': json.dumps(peak_counts),
         'funnel_data': json.dumps(funnel_data),
-        'heatmap_data': json.dumps(heatmap_data),
     }
     
     return render(request, 'responders/analytics.html', context)
 
+
+# Heat contribution of one emergency by severity
+HEATMAP_SEVERITY_WEIGHTS = {'critical': 4, 'high': 3, 'moderate': 2, 'low': 1}
+
+
+@staff_member_required
+def api_heatmap(request):
+    """
+    API: Emergency heatmap binned into grid cells on the database side.
+    Query params: zoom (map zoom level, sets the cell size), bbox
+    (min_lon,min_lat,max_lon,max_lat viewport) and days (time window,
+    0 for all time). Returns parallel arrays, one entry per non-empty cell.
+    """
+    from django.db.models import Case, IntegerField, Value, When
+    from emergencies.geo import cell_annotations, parse_bbox, zoom_cell_deg
+    
+    try:
+        zoom = int(request.GET.get('zoom', 5))
+        days = int(request.GET.get('days', 30))
+    except ValueError:
+        return JsonResponse({'error': 'zoom and days must be integers'}, status=400)
+    
+    cell_deg = zoom_cell_deg(zoom)
+    emergencies = Emergency.objects.all()
+    
+    if days > 0:
+        emergencies = emergencies.filter(triggered_at__gte=timezone.now() - timezone.timedelta(days=days))
+    
+    if 'bbox' in request.GET:
+        bbox = parse_bbox(request.GET['bbox'])
+        if bbox is None:
+            return JsonResponse({'error': 'bbox must be min_lon,min_lat,max_lon,max_lat'}, status=400)
+        min_lon, min_lat, max_lon, max_lat = bbox
+        emergencies = emergencies.filter(
+            latitude__range=(min_lat, max_lat),
+            longitude__range=(min_lon, max_lon),
+        )
+    
+    severity_weight = Case(
+        *[When(severity=severity, then=Value(weight)) for severity, weight in HEATMAP_SEVERITY_WEIGHTS.items()],
+        default=Value(1),
+        output_field=IntegerField(),
+    )
+    cells = emergencies.annotate(**cell_annotations(cell_deg)).values('cell_row', 'cell_col').annotate(
+        count=Count('id'),
+        weight=Sum(severity_weight),
+    ).order_by()
+    
+    data = {'cell_deg': cell_deg, 'lat': [], 'lon': [], 'count': [], 'weight': []}
+    for cell in cells:
+        # Report the cell centre
+        data['lat'].append(round((cell['cell_row'] + 0.5) * cell_deg, 5))
+        data['lon'].append(round((cell['cell_col'] + 0.5) * cell_deg, 5))
+        data['count'].append(cell['count'])
+        data['weight'].append(cell['weight'])
+    
+    return JsonResponse(data)
+
 @staff_member_required
 def admin_approvals(request):
     """
@@ -455,57 +528,190 @@ def admin_approvals(request):
         'pending_volunteers': pending_volunteers
     })
 
-from django.http import JsonResponse
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+import json
+import time
+from .alerts import alert_payload, held_connection_slots, volunteer_area
+
+ALERT_LONG_POLL_MAX_SECONDS = 25
+ALERT_POLL_RETRY_SECONDS = 15  # Long-poll interval while held connections are at their cap
+ALERT_STREAM_HEARTBEAT_SECONDS = 15
+ALERT_STREAM_MAX_SECONDS = 300  # Let EventSource reconnect so workers are recycled
+
+
+def _alertable_emergencies(user):
+    """Active emergencies the user should still be alerted about"""
+    from emergencies.models import Emergency, EmergencyResponse
+    
+    return Emergency.objects.filter(
+        status='active'
+    ).exclude(
+        primary_responder=user # Don't alert if I'm already the primary
+    ).exclude(
+        # Don't alert if I already responded (being notified by dispatch doesn't count)
+        id__in=EmergencyResponse.objects.filter(
+            responder=user
+        ).exclude(status__in=['notified', 'viewed']).values('emergency_id')
+    )
+
+
+def _wait_for_alert(subscription, user, area, timeout):
+    """Block until a relevant alert arrives on the broker or timeout expires"""
+    deadline = time.monotonic() + timeout
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return None
+        event = subscription.get(timeout=min(remaining, ALERT_STREAM_HEARTBEAT_SECONDS))
+        if event is None:
+            continue
+        if event.get('victim_id') == user.id:
+            continue
+        # Escalation re-announces emergencies; skip ones already handled
+        if not _alertable_emergencies(user).filter(emergency_id=event['id']).exists():
+            continue
+        return _event_payload(event, area)
+
+
+def _event_payload(event, area):
+    from emergencies.geo import haversine_km
+    
+    distance = None
+    if area:
+        distance = haversine_km(area[0], area[1], event['latitude'], event['longitude'])
+    return alert_payload(event, distance)
+
 
 @login_required
 def check_new_emergencies(request):
     """
     Lightweight API for the frontend to poll for new alerts.
+    Pass ?wait=<seconds> to long-poll: the request is held open until a
+    new alert for the volunteer's area is published or the wait expires.
+    Pass ?since=<alert id> with the last alert the client has shown, so it
+    is waited past instead of being returned again.
     """
     # Using 'last_checked' timestamp from session, or default to now
     last_checked_str = request.session.get('last_alert_check')
     
-    # Check for emergencies created in the last 5 minutes that are active
-    # In a real app, you would filter by geospatial distance here.
-    # For now, we alert on ANY active emergency the user hasn't responded to.
+    # Alert on active emergencies inside the volunteer's area that they
+    # haven't responded to. Without any known location we can't filter,
+    # so every active emergency is a candidate.
     
-    from emergencies.models import Emergency, EmergencyResponse
+    from emergencies.geo import bounding_box, haversine_km
+    from emergencies.realtime import emergency_event, get_broker
     
-    # Get active emergencies
-    active_emergencies = Emergency.objects.filter(
-        status='active'
-    ).exclude(
-        primary_responder=request.user # Don't alert if I'm already the primary
-    ).exclude(
-        responses__responder=request.user # Don't alert if I already responded
-    )
+    try:
+        wait = min(float(request.GET.get('wait') or 0), ALERT_LONG_POLL_MAX_SECONDS)
+    except ValueError:
+        wait = 0
+    
+    area = volunteer_area(request.user)
     
-    # If we have a timestamp, only newer than that
-    # But actually, simpler is: Just get the latest one I haven't seen?
-    # Let's just return the latest active one to show as a popup
+    # A held request pins a worker thread: at the cap, answer at once and
+    # tell the client when to ask again
+    retry = None
+    held = wait > 0 and held_connection_slots().acquire(blocking=False)
+    if wait > 0 and not held:
+        wait, retry = 0, ALERT_POLL_RETRY_SECONDS
     
-    if active_emergencies.exists():
-        latest = active_emergencies.latest('created_at')
+    subscription = None
+    try:
+        # Subscribe before querying so nothing published in between is missed
+        if wait > 0:
+            subscription = get_broker().subscribe(*(area or ()))
         
-        # Avoid showing the same alert repeatedly in the same session instantly
-        # Check if we just showed this ID
-        last_alert_id = request.session.get('last_alert_id')
+        # Get active emergencies
+        active_emergencies = _alertable_emergencies(request.user)
         
-        # We send emergency_id to frontend, so we must compare against that
-        if str(latest.emergency_id) != str(last_alert_id):
-            # NEW ALERT!
-            data = {
-                'has_new': True,
-                'id': str(latest.emergency_id), # Use emergency_id uuid field? Or id logic?
-                'location': latest.location_address or f"{latest.latitude}, {latest.longitude}",
-                'type': latest.get_emergency_type_display(),
-                'distance': "Calculating...", # Frontend can calc dist if it has user loc
-                'timestamp': latest.created_at.isoformat()
-            }
-            return JsonResponse(data)
-    
+        latest, distance = None, None
+        if area:
+            # Bounding box on the indexed lat/lon columns, then exact distance
+            min_lat, max_lat, min_lon, max_lon = bounding_box(*area)
+            nearby = active_emergencies.filter(
+                latitude__range=(min_lat, max_lat),
+                longitude__range=(min_lon, max_lon),
+            ).order_by('-created_at')
+            for emergency in nearby:
+                km = haversine_km(area[0], area[1], emergency.latitude, emergency.longitude)
+                if km <= area[2]:
+                    latest, distance = emergency, km
+                    break
+        else:
+            latest = active_emergencies.order_by('-created_at').first()
+        
+        # Return the latest one I haven't seen to show as a popup
+        if latest:
+            # Avoid showing the same alert repeatedly: skip the one acknowledged
+            # in this session and the one the client says it already shows
+            seen = {str(request.session.get('last_alert_id')), request.GET.get('since')}
+            
+            # We send emergency_id to frontend, so we must compare against that
+            if str(latest.emergency_id) not in seen:
+                # NEW ALERT!
+                return JsonResponse(alert_payload(emergency_event(latest), distance))
+        
+        if subscription is not None:
+            data = _wait_for_alert(subscription, request.user, area, wait)
+            if data:
+                return JsonResponse(data)
+    finally:
+        if subscription is not None:
+            subscription.close()
+        if held:
+            held_connection_slots().release()
+    
+    if retry:
+        return JsonResponse({'has_new': False, 'retry': retry})
     return JsonResponse({'has_new': False})
 
+
+@login_required
+def alert_stream(request):
+    """
+    Server-Sent Events stream of new alerts for the volunteer's area.
+    Replaces polling check_new_emergencies; the stream ends after a few
+    minutes and the browser's EventSource reconnects automatically.
+    Each open stream pins a worker thread, so past ALERT_MAX_HELD_CONNECTIONS
+    the stream is refused with 204, which stops EventSource reconnecting,
+    and the page falls back to polling. Only volunteers get a stream.
+    """
+    from emergencies.realtime import get_broker
+    
+    if request.user.role != 'volunteer':
+        return HttpResponse(status=204)
+    
+    slots = held_connection_slots()
+    if not slots.acquire(blocking=False):
+        return HttpResponse(status=204)
+    
+    user = request.user
+    try:
+        area = volunteer_area(user)
+        subscription = get_broker().subscribe(*(area or ()))
+    except Exception:
+        slots.release()
+        raise
+    
+    def events():
+        deadline = time.monotonic() + ALERT_STREAM_MAX_SECONDS
+        try:
+            yield "retry: 3000\n\n"
+            while time.monotonic() < deadline:
+                data = _wait_for_alert(subscription, user, area, ALERT_STREAM_HEARTBEAT_SECONDS)
+                if data is None:
+                    yield ": keepalive\n\n"
+                    continue
+                yield f"event: alert\nid: {data['id']}\ndata: {json.dumps(data)}\n\n"
+        finally:
+            subscription.close()
+            slots.release()
+    
+    response = StreamingHttpResponse(events(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
 @login_required
 def ack_alert(request):
     """
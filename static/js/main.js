@@ -212,7 +212,7 @@ function updateEmergencyUI(data) {
                 <i class="bi bi-person-check-fill"></i>
                 <strong>Responder Assigned:</strong> ${data.primary_responder.name}
                 <br>
-                <small>ETA: ${data.primary_responder.eta} minutes</small>
+                <small>ETA: ${data.primary_responder.eta === null ? 'calculating...' : data.primary_responder.eta + ' minutes'}</small>
             </div>
         `;
     }
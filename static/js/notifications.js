@@ -81,7 +81,7 @@ class NotificationManager {
 
     async sendSubscriptionToBackend(subscription) {
         try {
-            const response = await fetch('/api/push-subscribe/', {
+            const response = await fetch('/emergencies/api/push-subscribe/', {
                 method: 'POST',
                 headers: {
                     'Content-Type': 'application/json',